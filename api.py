@@ -0,0 +1,364 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+import secrets
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from engine import EngineError, EVENT_JOB, EVENT_LINE, EVENT_MESSAGE, TRANSCODE_SOURCE_CODEC
+
+# =================================================================================
+# LOCAL JOB API
+# =================================================================================
+# A small HTTP/JSON server on the engine's event loop, for tools that produce lists of links.
+#   POST   /jobs            {"urls": [...], "target": ..., "codec": ..., "transcode": [...]}  -> 201
+#   GET    /jobs[?state=]   all jobs of this session
+#   GET    /jobs/<id>       one job
+#   DELETE /jobs/<id>       cancel a job (DELETE /jobs cancels every unfinished one)
+#   GET    /events[?lines=1] Server-Sent Events: job changes and messages (and output lines)
+#   GET    /metrics         Prometheus text; GET /stats for the live figures as JSON
+# Fields left out of a submission use the app's current settings; "target" must lie inside the
+# download folder. Every request needs "Authorization: Bearer <token>" (or ?token= for EventSource
+# clients); without one given, a token is generated once and kept in api_token in the app folder.
+# Requests for another Host or from another Origin are refused, so web pages can't reach the API.
+
+API_HOST = "127.0.0.1"
+API_PORT = 8765
+API_MAX_BODY = 1024 * 1024
+API_READ_TIMEOUT = 10.0  # Seconds a client gets to send the request line, headers and body
+API_CLIENT_QUEUE = 2000  # Events buffered per SSE client; a client that falls behind loses the oldest
+API_HEARTBEAT = 15.0
+API_TOKEN_FILE = "api_token"
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "[::1]", "::1")
+SUBMIT_FIELDS = ("target", "codec", "transcode", "keep_original")
+
+REASONS = {200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized",
+           403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+           415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def load_token(path):
+    # Created on first use, readable by the user only
+    path = Path(path)
+    try:
+        token = path.read_text(encoding="utf-8").strip()
+        if token: return token
+    except OSError:
+        pass
+    token = secrets.token_urlsafe(24)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    return token
+
+
+def check_target(target, roots):
+    # A submitted folder must be one of roots or inside it. Raises ApiError.
+    path = Path(target).resolve()
+    for root in roots:
+        if not root: continue
+        root = Path(root).resolve()
+        if path == root or root in path.parents:
+            return path
+    raise ApiError(403, "\"target\" must be inside the download folder")
+
+
+def job_dict(job):
+    eta = job.album.eta
+    return {"id": job.id, "key": job.key, "url": job.url, "target": str(job.target), "state": job.state,
+            "progress": round(job.progress, 1), "eta": round(eta, 1) if eta is not None else None,
+            "retries": job.retries, "returncode": job.returncode, "codec": job.codec,
+            "transcode": list(job.transcode), "parent": job.parent.id if job.parent else None,
+            "shard": list(job.shard) if job.shard else None}
+
+
+class ApiServer:
+    def __init__(self, engine, submit=None, metrics=None, host=API_HOST, port=API_PORT, token=None, defaults=None):
+        self.engine = engine
+        # submit(urls, options) -> (jobs, [(url, error)]); called in an executor thread. The GUI
+        # passes its own, so API links take the same path as links typed into the window; it has
+        # to check options["target"] itself.
+        self.submit = submit or self._submit
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.token_path = None if token else engine.base_dir / API_TOKEN_FILE
+        self.token = token or load_token(self.token_path)
+        self.defaults = defaults or {}
+        self._server = None
+        self._clients = set()  # (queue, wants_lines), only touched on the loop
+        self._listening = [0, 0]  # Clients, and clients that want output lines; read from any thread
+
+    # --- Lifecycle ---------------------------------------------------------------
+    def start(self):
+        self.engine.loop_thread.submit(self._start()).result(10)
+        self.engine.add_listener(self._on_event)
+        return self.port
+
+    def stop(self):
+        if self._server is None: return
+        if self._on_event in self.engine.listeners:
+            self.engine.listeners.remove(self._on_event)
+        self.engine.loop_thread.submit(self._stop()).result(10)
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # The real one when port 0 was asked for
+
+    async def _stop(self):
+        self._server.close()
+        for queue, _ in list(self._clients):
+            queue.put_nowait(None)
+        await self._server.wait_closed()
+        self._server = None
+
+    # --- Engine events -----------------------------------------------------------
+    def _on_event(self, event, job, data):
+        # Any engine thread: the payload is built here so it shows the job as it is now
+        if not self._listening[0]: return
+        if event == EVENT_JOB:
+            payload = ("job", job_dict(job))
+        elif event == EVENT_MESSAGE:
+            payload = ("message", {"job": job.id, "level": data[1], "text": data[0]})
+        elif event == EVENT_LINE:
+            if not self._listening[1]: return
+            payload = ("line", {"job": job.id, "level": data.level, "text": data.text})
+        else:
+            return
+        self.engine.loop_thread.loop.call_soon_threadsafe(self._broadcast, payload)
+
+    def _broadcast(self, payload):
+        for queue, lines in self._clients:
+            if payload[0] == "line" and not lines: continue
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    # --- HTTP ----------------------------------------------------------------------
+    async def _handle(self, reader, writer):
+        try:
+            method, path, query, headers, body = await self._read_request(reader)
+            self._check_origin(headers)
+            if not self._authorized(headers, query):
+                raise ApiError(401, "Missing or wrong token")
+            if method == "POST" and headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+                raise ApiError(415, "Send the body as application/json")
+            if method == "GET" and path == "/events":
+                await self._stream_events(writer, query.get("lines", ["0"])[0] == "1")
+                return
+            status, result = await self._route(method, path, query, body)
+            if isinstance(result, str):
+                self._respond(writer, status, result.encode(), "text/plain; version=0.0.4")
+            else:
+                self._respond(writer, status, json.dumps(result).encode(), "application/json")
+        except ApiError as e:
+            self._respond(writer, e.status, json.dumps({"error": str(e)}).encode(), "application/json")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            self._respond(writer, 500, json.dumps({"error": str(e)}).encode(), "application/json")
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+            except (ConnectionError, RuntimeError):
+                pass
+
+    async def _read_request(self, reader):
+        try:
+            return await asyncio.wait_for(self._parse_request(reader), API_READ_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ApiError(408, "Request not received in time")
+        except ValueError:  # A line longer than the stream buffer
+            raise ApiError(400, "Request line or header too long")
+
+    async def _parse_request(self, reader):
+        line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = line.split(" ", 2)
+        except ValueError:
+            raise ApiError(400, "Malformed request line")
+        method = method.upper()
+        headers = {}
+        while True:
+            raw = (await reader.readline()).decode("latin-1").strip()
+            if not raw: break
+            name, _, value = raw.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(self._content_length(method, headers))
+        parts = urlsplit(target)
+        return method, parts.path.rstrip("/") or "/", parse_qs(parts.query), headers, body
+
+    @staticmethod
+    def _content_length(method, headers):
+        # Only plain digits; a POST has to say how long its body is
+        raw = headers.get("content-length")
+        if raw is None:
+            if method == "POST":
+                raise ApiError(400, "Content-Length required")
+            return 0
+        if not (raw.isascii() and raw.isdigit()):
+            raise ApiError(400, f"Invalid Content-Length {raw!r}")
+        length = int(raw)
+        if length > API_MAX_BODY:
+            raise ApiError(413, "Request body too large")
+        return length
+
+    def _check_origin(self, headers):
+        # DNS rebinding and cross-site requests: a browser sends the page's Host and Origin
+        host = headers.get("host", "")
+        if self.host in LOOPBACK_HOSTS and urlsplit(f"//{host}").hostname not in LOOPBACK_HOSTS:
+            raise ApiError(403, f"Host {host!r} not allowed")
+        origin = headers.get("origin")
+        if origin is not None and urlsplit(origin).netloc != host:
+            raise ApiError(403, f"Origin {origin!r} not allowed")
+
+    def _authorized(self, headers, query):
+        given = headers.get("authorization", "")
+        bearer = given[7:] if given.startswith("Bearer ") else query.get("token", [""])[0]
+        return hmac.compare_digest(bearer.encode(), self.token.encode())
+
+    @staticmethod
+    def _respond(writer, status, body, content_type):
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+    async def _route(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if path == "/":
+            return 200, {"endpoints": ["/jobs", "/jobs/<id>", "/events", "/metrics", "/stats"]}
+        if parts[0] == "jobs" and len(parts) == 1:
+            if method == "GET":
+                state = query.get("state", [None])[0]
+                return 200, {"jobs": [job_dict(j) for j in list(self.engine.jobs) if not state or j.state == state]}
+            if method == "POST":
+                return await self._post_jobs(body)
+            if method == "DELETE":
+                jobs = [j for j in list(self.engine.jobs) if not j.finished]
+                for job in jobs: self.engine.cancel(job)
+                return 202, {"cancelled": [j.id for j in jobs]}
+            raise ApiError(405, f"{method} not allowed on /jobs")
+        if parts[0] == "jobs" and len(parts) == 2:
+            job = self._find_job(parts[1])
+            if method == "GET":
+                return 200, job_dict(job)
+            if method == "DELETE":
+                self.engine.cancel(job)
+                return 202, job_dict(job)
+            raise ApiError(405, f"{method} not allowed on a job")
+        if path == "/metrics" and method == "GET":
+            return 200, self._prometheus()
+        if path == "/stats" and method == "GET":
+            return 200, self._stats()
+        raise ApiError(404, f"No such endpoint: {path}")
+
+    def _find_job(self, job_id):
+        for job in list(self.engine.jobs):
+            if str(job.id) == job_id or job.key == job_id:
+                return job
+        raise ApiError(404, f"No such job: {job_id}")
+
+    async def _post_jobs(self, body):
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise ApiError(400, "Body is not valid JSON")
+        urls = request.get("urls") or ([request["url"]] if request.get("url") else [])
+        if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            raise ApiError(400, "\"urls\" must be a list of links")
+        urls = [u.strip() for u in urls if u.strip()]
+        if not urls:
+            raise ApiError(400, "No links given")
+        options = {k: request[k] for k in SUBMIT_FIELDS if k in request}
+        jobs, errors = await asyncio.get_running_loop().run_in_executor(None, self.submit, urls, options)
+        return 201 if jobs else 400, {"jobs": [job_dict(j) for j in jobs],
+                                      "errors": [{"url": u, "error": e} for u, e in errors]}
+
+    def _submit(self, urls, options):
+        if not self.defaults.get("target"):
+            return [], [(u, "No download folder given") for u in urls]
+        settings = {**self.defaults, **options}
+        target = check_target(settings["target"], [self.defaults["target"]])
+        codec = TRANSCODE_SOURCE_CODEC if settings.get("transcode") else settings.get("codec", "aac-legacy")
+        jobs, errors = [], []
+        for url in urls:
+            try:
+                job = self.engine.submit(url, target, settings.get("cookies"), codec,
+                                         transcode=settings.get("transcode"),
+                                         keep_original=settings.get("keep_original", True))
+            except EngineError as e:
+                errors.append((url, str(e)))
+                continue
+            if job not in jobs: jobs.append(job)  # Duplicates come back as the queued job
+        return jobs, errors
+
+    async def _stream_events(self, writer, lines):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+        # A snapshot first, so a client that connects mid-batch knows every job
+        for job in list(self.engine.jobs):
+            writer.write(f"event: job\ndata: {json.dumps(job_dict(job))}\n\n".encode())
+        await writer.drain()
+
+        client = (asyncio.Queue(API_CLIENT_QUEUE), lines)
+        self._clients.add(client)
+        self._listening[0] += 1
+        self._listening[1] += lines
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(client[0].get(), API_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                else:
+                    if payload is None: return  # Server stopping
+                    kind, data = payload
+                    writer.write(f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+                await writer.drain()
+        finally:
+            self._clients.discard(client)
+            self._listening[0] -= 1
+            self._listening[1] -= lines
+
+    # --- Metrics -------------------------------------------------------------------
+    def _stats(self):
+        jobs = list(self.engine.jobs)
+        states = {}
+        for job in jobs:
+            states[job.state] = states.get(job.state, 0) + 1
+        stats = {"time": round(time.time(), 3), "jobs": states, "workers": self.engine.concurrency.limit,
+                 "max_workers": self.engine.concurrency.ceiling, "throttled": self.engine.concurrency.throttled,
+                 "transcoding": self.engine.transcoder.active, "killed": self.engine.killed,
+                 "restarted": self.engine.restarted}
+        if self.metrics:
+            tracks_per_min, bytes_per_sec, running = self.metrics.rates()
+            stats.update(tracks_per_min=round(tracks_per_min, 2), bytes_per_sec=round(bytes_per_sec, 1))
+        return stats
+
+    def _prometheus(self):
+        text = self.metrics.prometheus_text() if self.metrics else ""
+        stats = self._stats()
+        return text + "\n".join([
+            "# HELP ams_jobs_active Jobs of this session not finished yet.",
+            "# TYPE ams_jobs_active gauge",
+            f"ams_jobs_active {self.engine.queue.active_count()}",
+            "# HELP ams_workers_limit Parallel downloads currently allowed.",
+            "# TYPE ams_workers_limit gauge",
+            f"ams_workers_limit {stats['workers']}",
+            "# HELP ams_runs_killed_total gamdl runs killed (cancelled, timed out or stalled).",
+            "# TYPE ams_runs_killed_total counter",
+            f"ams_runs_killed_total {stats['killed']}",
+            "# HELP ams_runs_restarted_total Stalled runs requeued.",
+            "# TYPE ams_runs_restarted_total counter",
+            f"ams_runs_restarted_total {stats['restarted']}",
+        ]) + "\n"
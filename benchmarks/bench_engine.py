@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from engine import DownloadEngine, StageEvent, EVENT_JOB, EVENT_LINE, JOB_DONE, STAGE_DOWNLOAD  # noqa: E402
+
+# End-to-end load test against benchmarks/fake_gamdl.py: real engine, real subprocesses and,
+# when a display is available, the real Tk app (log sink, job list, status bar).
+#   python benchmarks/bench_engine.py                  # all scenarios, compared with the last run
+#   python benchmarks/bench_engine.py flood --no-ui --baseline benchmarks/results/<file>.json
+
+BENCH_DIR = Path(__file__).resolve().parent
+FAKE_GAMDL = BENCH_DIR / "fake_gamdl.py"
+RESULTS_DIR = BENCH_DIR / "results"
+LAG_INTERVAL = 0.01  # Seconds between lag probes on the engine loop and the Tk loop
+REGRESSION_THRESHOLD = 0.10
+
+# links: jobs submitted, fail_every: every n-th link exits with an error, adaptive: let the engine back off
+# on throttling (off elsewhere so runs stay comparable), fake: FAKE_GAMDL_* settings
+SCENARIOS = {
+    "throughput": {"links": 16, "workers": 4, "fake": {"tracks": 12, "lines": 40}},
+    "flood": {"links": 2, "workers": 2, "fake": {"tracks": 50, "lines": 2000, "cr": 1}},
+    "failures": {"links": 16, "workers": 4, "fail_every": 4,
+                 "fake": {"tracks": 6, "lines": 20, "error_rate": 0.2, "warn_rate": 0.1}},
+    "paced": {"links": 8, "workers": 8, "fake": {"tracks": 4, "lines": 50, "delay": 0.002}},
+    "throttled": {"links": 24, "workers": 8, "adaptive": True,
+                  "fake": {"tracks": 6, "lines": 20, "delay": 0.002, "throttle": 3}},
+}
+
+# Direction of a better result, for the comparison with a baseline
+HIGHER_IS_BETTER = {"lines_per_sec", "jobs_per_min", "tracks_per_min"}
+LOWER_IS_BETTER = {"seconds", "loop_lag_p95_ms", "loop_lag_max_ms", "ui_lag_p95_ms", "ui_lag_max_ms", "rss_growth_mb"}
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        pass
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale  # Peak, not current
+    except ImportError:
+        return None
+
+
+def percentile(values, p):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def lag_summary(prefix, lags):
+    return {f"{prefix}_p50_ms": round(percentile(lags, 0.5) * 1000, 2) if lags else None,
+            f"{prefix}_p95_ms": round(percentile(lags, 0.95) * 1000, 2) if lags else None,
+            f"{prefix}_max_ms": round(max(lags) * 1000, 2) if lags else None}
+
+
+class Counter:
+    # Engine listener: counts what the engine delivered
+    def __init__(self):
+        self.lines = 0
+        self.tracks = 0
+        self.finished = {}
+
+    def __call__(self, event, job, data):
+        if event == EVENT_LINE:
+            self.lines += 1
+            if data.kind == "step" and StageEvent(STAGE_DOWNLOAD) in data.events:
+                self.tracks += 1
+        elif event == EVENT_JOB and job.finished:
+            self.finished[job.id] = job.state
+
+
+async def probe_loop(lags, stop):
+    # How late the engine's event loop wakes up: time spent in output handling and listeners
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+
+def make_app(engine, base_dir):
+    # The real GUI wired to the benchmark engine; None when there is no display
+    try:
+        import tkinter as tk
+        import main
+        root = tk.Tk()
+    except Exception:
+        return None, None
+    main.messagebox.showinfo = lambda *a, **k: None  # The "Download complete" dialog would block
+    app = main.GamdlApp(root)
+    app.engine.close()
+    app.engine = engine
+    app.metrics = main.MetricsRecorder(base_dir / "metrics")
+    engine.add_listener(app._on_engine_event)
+    engine.add_listener(app.metrics.on_event)
+    return root, app
+
+
+def run_scenario(name, spec, ui=True):
+    env_backup = dict(os.environ)
+    os.environ.update({f"FAKE_GAMDL_{k.upper()}": str(v) for k, v in spec["fake"].items()})
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"ams_bench_{name}_") as tmp:
+            return _run(name, spec, Path(tmp), ui)
+    finally:
+        os.environ.clear()
+        os.environ.update(env_backup)
+
+
+def _run(name, spec, base_dir, ui):
+    cookies = base_dir / "cookies.txt"
+    cookies.write_text("# Netscape HTTP Cookie File\n", encoding="utf-8")
+    output = base_dir / "music"
+
+    engine = DownloadEngine(base_dir, gamdl_cmd=[sys.executable, str(FAKE_GAMDL)], workers=spec["workers"],
+                            skip_existing=False, rate_limit=0, adaptive=spec.get("adaptive", False),
+                            space_check=False, shard_tracks=0)
+    counter = Counter()
+    engine.add_listener(counter)
+    root, app = make_app(engine, base_dir) if ui else (None, None)
+
+    loop_lags, ui_lags = [], []
+    stop = threading.Event()
+    engine.loop_thread.submit(probe_loop(loop_lags, stop))
+
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    fail_every = spec.get("fail_every")
+    for i in range(1, spec["links"] + 1):
+        fail = "&fail=1" if fail_every and i % fail_every == 0 else ""
+        job = engine.submit(f"https://music.apple.com/us/album/bench/{1000 + i}?seed={i}{fail}", output,
+                            str(cookies))
+        if app: app.batch.append(job)
+
+    if root:
+        # Drive the Tk loop ourselves and measure how late the after() callbacks fire
+        expected = [time.perf_counter() + LAG_INTERVAL]
+
+        def tick():
+            now = time.perf_counter()
+            ui_lags.append(max(0.0, now - expected[0]))
+            expected[0] = now + LAG_INTERVAL
+            root.after(int(LAG_INTERVAL * 1000), tick)
+
+        root.after(int(LAG_INTERVAL * 1000), tick)
+        while engine.queue.active_count():
+            root.update()
+            time.sleep(0.001)
+        root.update()
+    else:
+        engine.join()
+    seconds = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    stop.set()
+    engine.close()
+    if root: root.destroy()
+
+    done = sum(1 for state in counter.finished.values() if state == JOB_DONE)
+    result = {
+        "links": spec["links"], "workers": spec["workers"], "done": done,
+        "failed": len(counter.finished) - done, "lines": counter.lines, "tracks": counter.tracks,
+        "seconds": round(seconds, 3),
+        "lines_per_sec": round(counter.lines / seconds, 1),
+        "jobs_per_min": round(len(counter.finished) * 60 / seconds, 1),
+        "tracks_per_min": round(counter.tracks * 60 / seconds, 1),
+        "rss_growth_mb": round((rss_after - rss_before) / 2 ** 20, 2) if rss_before and rss_after else None,
+        "ui": bool(root),
+        "throttle_cuts": engine.concurrency.throttled, "final_workers": engine.concurrency.limit,
+    }
+    result.update(lag_summary("loop_lag", loop_lags))
+    result.update(lag_summary("ui_lag", ui_lags))
+    return result
+
+
+# --- Results -----------------------------------------------------------------------
+
+def save_results(results):
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"bench_engine_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "cpus": os.cpu_count(), "scenarios": results}
+    path.write_text(json.dumps(record, indent=2), encoding="utf-8")
+    return path
+
+
+def latest_results():
+    files = sorted(RESULTS_DIR.glob("bench_engine_*.json"))
+    return files[-1] if files else None
+
+
+def compare(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))["scenarios"]
+    regressions = 0
+    print(f"\nCompared with {baseline_path}:")
+    for name, result in results.items():
+        if name not in baseline: continue
+        for metric in sorted(HIGHER_IS_BETTER | LOWER_IS_BETTER):
+            old, new = baseline[name].get(metric), result.get(metric)
+            if not old or new is None: continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = "  REGRESSION" if worse > threshold else ""
+            regressions += bool(flag)
+            print(f"  {name:<11} {metric:<16} {old:>10} -> {new:<10} {change:+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end engine benchmark with a fake gamdl")
+    parser.add_argument("scenarios", nargs="*", help=f"Any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--no-ui", action="store_true", help="Don't drive the Tk app even if a display exists")
+    parser.add_argument("--baseline", help="Results file to compare with (default: the previous run)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative change counted as a regression (default: %(default)s)")
+    parser.add_argument("--no-save", action="store_true", help="Don't write a results file")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        result = run_scenario(name, SCENARIOS[name], ui=not args.no_ui)
+        results[name] = result
+        ui = f"ui lag p95 {result['ui_lag_p95_ms']} ms" if result["ui"] else "no ui"
+        print(f"{name:<11} {result['lines']:>8} lines in {result['seconds']:7.2f}s  "
+              f"{result['lines_per_sec'] / 1e3:7.1f} k lines/s  {result['jobs_per_min']:7.1f} jobs/min  "
+              f"loop lag p95 {result['loop_lag_p95_ms']} ms  {ui}  rss growth {result['rss_growth_mb']} MB")
+
+    baseline = args.baseline or latest_results()
+    saved = None if args.no_save else save_results(results)
+    if saved: print(f"\nSaved {saved}")
+    if baseline:
+        return 1 if compare(results, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
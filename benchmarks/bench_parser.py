@@ -0,0 +1,56 @@
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from engine import GamdlOutputParser, AlbumProgress  # noqa: E402
+
+LOG_DIR = Path(__file__).resolve().parent / "logs"
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+
+def legacy_parse(line):
+    # The per-line work the old _process_log did, minus the Tk calls
+    clean = ANSI_ESCAPE.sub('', line)
+    if "[download]" in clean:
+        if match := re.search(r'(\d+\.?\d*)%', clean):
+            float(match.group(1))
+        return "100%" in clean or "Destination" in clean
+    tag = "green" if any(x in clean for x in ["INFO", "Downloading", "Finished", "Processing"]) else \
+        "yellow" if "WARNING" in clean else \
+            "red" if "ERROR" in clean or "Traceback" in clean else None
+    prefix = "\n" if "Processing" in clean or "Finished" in clean else "    " if "Downloading" in clean else ""
+    return prefix, tag
+
+
+def structured_parse(lines):
+    parser = GamdlOutputParser()
+    progress = AlbumProgress()
+    for line in lines:
+        parsed = parser.parse(line)
+        if parsed.events:
+            progress.update(parsed.events)
+    return progress
+
+
+def bench(name, fn, lines, repeat=5):
+    number = max(1, 200_000 // len(lines))
+    best = min(timeit.repeat(fn, number=number, repeat=repeat))
+    rate = len(lines) * number / best
+    print(f"  {name:<12} {rate / 1e3:10.1f} k lines/s  {best / number / len(lines) * 1e6:8.2f} us/line")
+
+
+def main(paths):
+    for path in paths:
+        lines = Path(path).read_text(encoding="utf-8", errors="replace").splitlines()
+        progress = structured_parse(lines)
+        print(f"{Path(path).name}: {len(lines)} lines, "
+              f"final progress {progress.percent:.1f}% (track {progress.index}/{progress.total})")
+        bench("legacy", lambda: [legacy_parse(l) for l in lines], lines)
+        bench("structured", lambda: structured_parse(lines), lines)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or sorted(LOG_DIR.glob("*.log")))
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import random
+import shutil
+import struct
+import argparse
+import hashlib
+import subprocess
+from urllib.parse import urlsplit, parse_qs
+
+# Stand-in for the gamdl executable: accepts the arguments the engine passes, prints gamdl-like
+# output at a configurable rate and writes small tagged .m4a files into the output folder.
+# Nothing touches the network. Settings come from FAKE_GAMDL_* environment variables and can be
+# overridden per link with query parameters, e.g. https://music.apple.com/us/album/x/123?tracks=3&fail=1
+#   tracks     tracks per link (default 12)
+#   lines      [download] percentage lines per track (default 40)
+#   delay      seconds between output lines (default 0)
+#   size       track size in MiB as printed (default 8)
+#   file_kb    size of the dummy files written (default 16)
+#   fail       1 to exit with an error halfway through
+#   flaky      fail with a network error halfway through the first n runs of a link (default 0)
+#   stall      hang halfway through the first n runs of a link, with a child process holding the
+#              output pipe like a stuck ffmpeg (default 0)
+#   error_rate chance that a track fails with an ERROR line (default 0)
+#   warn_rate  chance that a track is skipped with a WARNING line (default 0)
+#   throttle   with more than n fake runs at once, half the tracks hit an HTTP 429 first (default 0: never)
+#   seed       random seed (default: derived from the link)
+#   cr         1 to end progress lines with \r like a terminal
+
+DEFAULTS = {"tracks": "12", "lines": "40", "delay": "0", "size": "8", "file_kb": "16", "fail": "0", "flaky": "0", "stall": "0",
+            "error_rate": "0", "warn_rate": "0", "throttle": "0", "seed": "", "cr": "0"}
+
+
+def settings(url):
+    values = {k: os.environ.get(f"FAKE_GAMDL_{k.upper()}", v) for k, v in DEFAULTS.items()}
+    values.update({k: v[0] for k, v in parse_qs(urlsplit(url).query).items() if k in DEFAULTS})
+    return values
+
+
+# --- Dummy media files -------------------------------------------------------------
+
+def box(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def item(kind, payload, data_type=0):
+    return box(kind, box(b"data", struct.pack(">II", data_type, 0) + payload))
+
+
+def fake_m4a(catalog_id, album_id, track, total, title, size):
+    ilst = box(b"ilst", item(b"\xa9nam", title.encode(), 1)
+               + item(b"cnID", struct.pack(">I", catalog_id), 21)
+               + item(b"plID", struct.pack(">Q", album_id), 21)
+               + item(b"trkn", struct.pack(">HHHH", 0, track, total, 0))
+               + item(b"disk", struct.pack(">HHH", 0, 1, 1)))
+    meta = box(b"meta", b"\0\0\0\0" + ilst)
+    stsd = box(b"stsd", struct.pack(">II", 0, 1) + box(b"mp4a", bytes(28)))
+    trak = box(b"trak", box(b"mdia", box(b"minf", box(b"stbl", stsd))))
+    head = box(b"ftyp", b"M4A \0\0\0\0M4A mp42isom") + box(b"moov", trak + box(b"udta", meta))
+    return head + box(b"mdat", bytes(max(size - len(head) - 8, 0)))
+
+
+# Run counters and markers live in the working directory (the engine's base_dir), not the output
+# folder: a job's runs may each get an output folder of their own
+STATE_DIR = ".fake_gamdl"
+
+
+def attempt(folder, album_id):
+    # Runs of this link so far, counted in a hidden file so retries can succeed
+    path = os.path.join(folder, f".fake_gamdl_{album_id}")
+    count = int(open(path).read()) + 1 if os.path.exists(path) else 1
+    os.makedirs(folder, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(str(count))
+    return count
+
+
+def running(folder):
+    # Fake runs alive right now, one marker file each
+    folder = os.path.join(folder, ".fake_gamdl_running")
+    try:
+        return sum(1 for name in os.listdir(folder) if os.path.exists(f"/proc/{name}") or os.name == "nt")
+    except OSError:
+        return 0
+
+
+def write_track(temp_path, folder, name, data):
+    # Like gamdl: written in the temp folder, then moved into the album folder
+    os.makedirs(temp_path, exist_ok=True)
+    os.makedirs(folder, exist_ok=True)
+    tmp = os.path.join(temp_path, f"{os.getpid()}_{name}")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    return shutil.move(tmp, os.path.join(folder, name))
+
+
+# --- Output ------------------------------------------------------------------------
+
+class Printer:
+    def __init__(self, delay, cr):
+        self.delay = delay
+        self.cr = cr
+
+    def log(self, level, msg):
+        print(f"[{level:<8} {time.strftime('%H:%M:%S')}] {msg}", flush=True)
+        self.pause()
+
+    def progress(self, text):
+        sys.stdout.write(text + ("\r" if self.cr else "\n"))
+        sys.stdout.flush()
+        self.pause()
+
+    def pause(self):
+        if self.delay: time.sleep(self.delay)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="gamdl")
+    parser.add_argument("--config-path")
+    parser.add_argument("--cookies-path")
+    parser.add_argument("--output-path", default=".")
+    parser.add_argument("--temp-path", default="temp")
+    parser.add_argument("urls", nargs="+")
+    args = parser.parse_args(argv)
+
+    marker = os.path.join(STATE_DIR, ".fake_gamdl_running", str(os.getpid()))
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    open(marker, "w").close()
+    try:
+        return run(args)
+    finally:
+        os.unlink(marker)
+
+
+def run(args):
+    errors = 0
+    for url_index, url in enumerate(args.urls, 1):
+        opts = settings(url)
+        rng = random.Random(opts["seed"] or url)
+        out = Printer(float(opts["delay"]), opts["cr"] == "1")
+        tracks, lines = int(opts["tracks"]), int(opts["lines"])
+        size_mib, file_size = float(opts["size"]), int(float(opts["file_kb"]) * 1024)
+        # The link's own ID when it has one, so the library index recognises finished albums
+        last = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+        album_id = int(last) if last.isdigit() else int(hashlib.sha1(url.encode()).hexdigest()[:12], 16)
+        album = f"Album {album_id % 10000}"
+        where = f"from URL {url_index}/{len(args.urls)}"
+        runs = attempt(STATE_DIR, album_id) if int(opts["flaky"]) or int(opts["stall"]) else 0
+        flaky = 0 < runs <= int(opts["flaky"])
+        stall = 0 < runs <= int(opts["stall"])
+
+        out.log("INFO", f'(URL {url_index}/{len(args.urls)}) Checking "{url}"')
+        out.log("INFO", f"(URL {url_index}/{len(args.urls)}) Getting download queue")
+
+        for track in range(1, tracks + 1):
+            title = f"Track {track}"
+            prefix = f"(Track {track}/{tracks} {where})"
+            if opts["fail"] == "1" and track > tracks // 2:
+                print("Traceback (most recent call last):", flush=True)
+                print('  File "gamdl/cli.py", line 1, in main', flush=True)
+                print("RuntimeError: fake failure", flush=True)
+                return 1
+            if flaky and track > tracks // 2:
+                out.log("ERROR", f"{prefix} Failed to download \"{title}\"")
+                print("requests.exceptions.ConnectionError: ('Connection aborted.', "
+                      "ConnectionResetError(104, 'Connection reset by peer'))", flush=True)
+                return 1
+            if stall and track > tracks // 2:
+                subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3600)"])
+                time.sleep(3600)
+
+            folder = os.path.join(args.output_path, "Fake Artist", album)
+            name = f"{track:02d} {title}.m4a"
+            if os.path.exists(os.path.join(folder, name)) or rng.random() < float(opts["warn_rate"]):
+                out.log("WARNING", f'{prefix} Skipping "{title}": Media file already exists')
+                continue
+
+            throttle = int(opts["throttle"])
+            if throttle and running(STATE_DIR) > throttle and rng.random() < 0.5:
+                out.log("WARNING", f'{prefix} HTTP Error 429: Too Many Requests, retrying "{title}"')
+                time.sleep(0.05 * (running(STATE_DIR) - throttle))
+
+            out.log("INFO", f'{prefix} Downloading "{title}"')
+            out.progress(f"[download] Destination: temp/{album_id + track}_encrypted.m4a")
+            speed = rng.uniform(1.0, 3.5)
+            for i in range(1, lines + 1):
+                pct = 100.0 * i / lines
+                eta = int((size_mib * (1 - pct / 100)) / speed)
+                out.progress(f"[download] {pct:5.1f}% of {size_mib:8.2f}MiB at {speed:8.2f}MiB/s ETA 00:{eta:02d}")
+            out.progress(f"[download] 100% of {size_mib:8.2f}MiB in 00:00:0{int(size_mib / speed) % 10} "
+                         f"at {speed:.2f}MiB/s")
+
+            if rng.random() < float(opts["error_rate"]):
+                out.log("ERROR", f'{prefix} Failed to download "{title}"')
+                errors += 1
+                continue
+            out.log("DEBUG", f'{prefix} Decrypting/Remuxing "{title}"')
+            out.log("DEBUG", f'{prefix} Applying tags to "{title}"')
+            write_track(args.temp_path, folder, name, fake_m4a((album_id + track) % 2 ** 32, album_id, track, tracks, title,
+                                               file_size))
+
+    print(f"[INFO     {time.strftime('%H:%M:%S')}] Finished with {errors} error(s)", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
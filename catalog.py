@@ -0,0 +1,159 @@
+import re
+import json
+import time
+import gzip
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+from preflight import CookieFileError, load_cookies
+
+# =================================================================================
+# CATALOG METADATA
+# =================================================================================
+# Just enough of Apple Music's web API (the one the web player and gamdl use) to list the
+# tracks of a playlist or album and the albums of an artist. One request returns up to
+# 300 playlist tracks, so checking a watched playlist costs one or two calls instead of a
+# gamdl run. The web player's bearer token is cached on disk and only scraped again when
+# the API rejects it.
+
+HOMEPAGE_URL = "https://music.apple.com"
+AMP_API_URL = "https://amp-api.music.apple.com"
+TOKEN_FILE = "catalog_token.json"
+TOKEN_MAX_AGE = 7 * 24 * 3600
+PAGE_LIMIT = {"tracks": 300, "albums": 100}
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0"
+
+
+class CatalogError(Exception):
+    pass
+
+
+class CatalogTrack:
+    def __init__(self, data):
+        attrs = data.get("attributes", {})
+        self.id = data["id"]
+        self.title = attrs.get("name", "")
+        self.artist = attrs.get("artistName", "")
+        self.album = attrs.get("albumName", "")
+        self.duration = (attrs.get("durationInMillis") or 0) // 1000
+        self.playable = "playParams" in attrs  # Greyed-out tracks have no play parameters
+        self.is_song = data.get("type") == "songs"
+
+
+class CatalogClient:
+    def __init__(self, cookies_path, cache_dir, language="en-US"):
+        self.cookies_path = cookies_path
+        self.token_path = Path(cache_dir) / TOKEN_FILE
+        self.language = language
+        self.calls = 0  # API requests made, for the sync report
+        self._lock = threading.Lock()
+        self._token = None
+
+    # --- Lookups ---------------------------------------------------------------
+    def playlist(self, storefront, playlist_id):
+        # (name, [CatalogTrack]) with every page of tracks
+        data = self._get(f"/v1/catalog/{storefront}/playlists/{playlist_id}", {"limit[tracks]": PAGE_LIMIT["tracks"]})
+        item = data["data"][0]
+        tracks = self._all_pages(item["relationships"]["tracks"], "tracks")
+        return item["attributes"].get("name", playlist_id), [CatalogTrack(t) for t in tracks]
+
+    def album(self, storefront, album_id):
+        data = self._get(f"/v1/catalog/{storefront}/albums/{album_id}")
+        item = data["data"][0]
+        tracks = self._all_pages(item["relationships"]["tracks"], "tracks")
+        return item["attributes"].get("name", album_id), [CatalogTrack(t) for t in tracks]
+
+    def artist_albums(self, storefront, artist_id):
+        # (name, [album ID]) without the albums' track lists
+        data = self._get(f"/v1/catalog/{storefront}/artists/{artist_id}",
+                         {"include": "albums", "limit[albums]": PAGE_LIMIT["albums"]})
+        item = data["data"][0]
+        albums = self._all_pages(item["relationships"]["albums"], "albums")
+        return item["attributes"].get("name", artist_id), [a["id"] for a in albums]
+
+    def storefront(self):
+        # The account's country, for links that don't carry one
+        return self._cookie_jar().get("itua", "us").lower()
+
+    # --- Requests --------------------------------------------------------------
+    def _all_pages(self, relationship, kind):
+        items = list(relationship.get("data", []))
+        next_uri = relationship.get("next")
+        while next_uri:
+            page = self._get(next_uri, {"limit": PAGE_LIMIT[kind]})
+            items.extend(page.get("data", []))
+            next_uri = page.get("next")
+        return items
+
+    def _get(self, path, params=None):
+        for attempt in range(2):
+            try:
+                return self._request(path, params, self._bearer(refresh=attempt > 0))
+            except urllib.error.HTTPError as e:
+                if e.code == 401 and attempt == 0:
+                    continue  # Token expired: scrape a fresh one and try once more
+                raise CatalogError(f"HTTP {e.code} for {path}") from e
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                raise CatalogError(f"{path}: {e}") from e
+
+    def _request(self, path, params, token):
+        query = {"l": self.language, **(params or {})}
+        url = AMP_API_URL + path + ("&" if "?" in path else "?") + urllib.parse.urlencode(query)
+        cookies = self._cookie_jar()
+        request = urllib.request.Request(url, headers={
+            "User-Agent": USER_AGENT, "Accept": "application/json", "Accept-Encoding": "gzip",
+            "Authorization": f"Bearer {token}", "Media-User-Token": cookies.get("media-user-token", ""),
+            "Origin": HOMEPAGE_URL,
+        })
+        self.calls += 1
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read()
+            if response.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+        return json.loads(body)
+
+    def _cookie_jar(self):
+        # Shared with the preflight check, parsed again when the file changes
+        try:
+            return load_cookies(self.cookies_path).values()
+        except CookieFileError as e:
+            raise CatalogError(str(e)) from e
+
+    def _bearer(self, refresh=False):
+        with self._lock:
+            if self._token and not refresh:
+                return self._token
+            if not refresh:
+                try:
+                    cached = json.loads(self.token_path.read_text(encoding="utf-8"))
+                    if time.time() - cached["time"] < TOKEN_MAX_AGE:
+                        self._token = cached["token"]
+                        return self._token
+                except (OSError, ValueError, KeyError):
+                    pass
+            self._token = self._scrape_token()
+            try:
+                self.token_path.write_text(json.dumps({"token": self._token, "time": time.time()}), encoding="utf-8")
+            except OSError:
+                pass
+            return self._token
+
+    def _scrape_token(self):
+        # The token is embedded in the web player's main script
+        def fetch(url):
+            self.calls += 1
+            request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.read().decode("utf-8", errors="replace")
+
+        try:
+            script = re.search(r'/(assets/index[^"/]*\.js)', fetch(HOMEPAGE_URL))
+            token = script and re.search(r'(eyJh[\w.-]+)', fetch(f"{HOMEPAGE_URL}/{script.group(1)}"))
+        except (urllib.error.URLError, OSError) as e:
+            raise CatalogError(f"Web player not reachable: {e}") from e
+        if not token:
+            raise CatalogError("No API token found in the web player")
+        return token.group(1)
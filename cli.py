@@ -0,0 +1,284 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+from api import ApiServer, API_HOST, API_PORT
+from dedup import DedupIndex
+from engine import (DownloadEngine, EngineError, CODEC_MAP, DEFAULT_MUSIC_FOLDER, TRANSCODE_MAP, TRANSCODE_SOURCE_CODEC,
+                    EVENT_JOB, EVENT_LINE, EVENT_MESSAGE, JOB_FAILED, JOB_TIMEOUT, SHARD_TRACKS, STALL_TIMEOUT,
+                    WORKER_MAX_JOBS, app_dir, find_cookies)
+from library import LibraryIndex
+from verify import Verifier, find_ffprobe
+from ratelimit import RATE_LIMIT
+from watchlist import WatchList, WatchScheduler, WATCHLIST_FILE
+from logstore import LogStore
+from metrics import MetricsRecorder
+
+# Headless batch mode: never imports tkinter, prints one JSON object per line on stdout.
+#   python cli.py -i links.txt -o /srv/music -c cookies.txt
+#   cat links.txt | python cli.py --codec mp3
+#   python cli.py --serve -o /srv/music        (keeps running, takes jobs over the local API)
+
+
+def read_urls(args):
+    urls = list(args.urls)
+    if args.input:
+        stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        with stream:
+            urls.extend(stream.read().splitlines())
+    elif not urls and not sys.stdin.isatty():
+        urls.extend(sys.stdin.read().splitlines())
+    return [u.strip() for u in urls if u.strip() and not u.strip().startswith("#")]
+
+
+class JsonReporter:
+    def __init__(self, out=sys.stdout, verbose=False):
+        self.out = out
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.out.flush()
+
+    def __call__(self, event, job, data):
+        if event == EVENT_JOB:
+            eta = job.album.eta
+            self.write({"event": "job", "job": job.id, "url": job.url, "shard": job.shard, "state": job.state,
+                        "progress": round(job.progress, 1), "eta": round(eta, 1) if eta is not None else None,
+                        "returncode": job.returncode})
+        elif event == EVENT_MESSAGE:
+            self.write({"event": "message", "job": job.id, "level": data[1], "text": data[0]})
+        elif event == EVENT_LINE and self.verbose:
+            self.write({"event": "line", "job": job.id, "level": data.level, "text": data.text})
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Download Apple Music links with gamdl, without the GUI.")
+    parser.add_argument("urls", nargs="*", help="Links to download (also read from --input or stdin)")
+    parser.add_argument("-i", "--input", help="File with one link per line, '-' for stdin")
+    parser.add_argument("-o", "--output", default=str(DEFAULT_MUSIC_FOLDER), help="Download folder")
+    parser.add_argument("-c", "--cookies", help="Netscape cookies.txt (default: same lookup as the GUI)")
+    parser.add_argument("--codec", default=CODEC_MAP["m4a (AAC - Original)"], choices=sorted(set(CODEC_MAP.values())))
+    parser.add_argument("--transcode", action="append", choices=sorted(set(TRANSCODE_MAP.values())),
+                        help="Download originals once and convert them to this format with a parallel ffmpeg "
+                             "stage; repeat for several formats")
+    parser.add_argument("--remove-originals", action="store_true",
+                        help="Delete the downloaded originals once they are transcoded")
+    parser.add_argument("--transcode-workers", type=int, help="Parallel ffmpeg processes (default: CPU count)")
+    parser.add_argument("-w", "--workers", type=int, help="Parallel gamdl processes (default: CPU count)")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT, metavar="N",
+                        help="At most N gamdl launches per minute across all jobs, 0 for no limit "
+                             "(default: %(default)s)")
+    parser.add_argument("--fixed-workers", action="store_true",
+                        help="Keep --workers jobs running even when Apple throttles (no adaptive back-off)")
+    parser.add_argument("--persistent", action="store_true",
+                        help="Run jobs in long-lived gamdl workers instead of one process per link")
+    parser.add_argument("--recycle", type=int, default=WORKER_MAX_JOBS, metavar="N",
+                        help="Restart a persistent worker after N jobs (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="Retry jobs that fail with a transient error up to N times (default: %(default)s)")
+    parser.add_argument("--staging", metavar="DIR",
+                        help="Fast local folder (tmpfs, NVMe) for gamdl's intermediate files")
+    parser.add_argument("--no-space-check", action="store_true",
+                        help="Start jobs without checking the free space for their estimated size")
+    parser.add_argument("--shard", type=int, default=SHARD_TRACKS, metavar="N",
+                        help="Split albums and playlists with enough missing tracks into parallel jobs of at "
+                             "least N tracks, 0 to never (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=JOB_TIMEOUT / 60, metavar="MIN",
+                        help="Kill a gamdl run after this many minutes (default: no limit)")
+    parser.add_argument("--stall", type=float, default=STALL_TIMEOUT, metavar="SEC",
+                        help=f"Kill and requeue a run without progress for this long, 0 to never "
+                             f"(default: {STALL_TIMEOUT:.0f})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Also resume the jobs an earlier run left unfinished")
+    parser.add_argument("--no-skip", action="store_true",
+                        help="Don't skip links whose tracks are already in the library index")
+    parser.add_argument("--scan", action="store_true",
+                        help="Update the library index of the output folder and exit")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Replace identical files in the output folder with links after each job")
+    parser.add_argument("--dedup-only", action="store_true",
+                        help="Deduplicate the output folder, print a report and exit")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="Don't probe and checksum new files after each job")
+    parser.add_argument("--verify-only", action="store_true",
+                        help="Verify the output folder (only files changed since the last check), print a report "
+                             "and exit")
+    parser.add_argument("--watch", metavar="URL", action="append",
+                        help="Add a playlist/album/artist link to the watch list (with -o and --codec) and exit")
+    parser.add_argument("--unwatch", metavar="URL", action="append", help="Remove a link from the watch list and exit")
+    parser.add_argument("--list-watch", action="store_true", help="Print the watch list and exit")
+    parser.add_argument("--sync", action="store_true",
+                        help="Sync the watch list: queue only tracks missing from each entry's folder")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep running and accept jobs over the local HTTP API until Ctrl+C")
+    parser.add_argument("--api-host", default=API_HOST, help=f"Address the API listens on (default: {API_HOST})")
+    parser.add_argument("--api-port", type=int, default=API_PORT, help=f"API port (default: {API_PORT})")
+    parser.add_argument("--api-token", help="Bearer token API requests must send (default: generated and kept in "
+                                            "api_token in the app folder)")
+    parser.add_argument("--search", metavar="TEXT", help="Search the stored logs of past runs and exit")
+    parser.add_argument("--errors-only", action="store_true", help="With --search: only match error lines")
+    parser.add_argument("--metrics-dir", help="Where jobs.jsonl and ams.prom are written (default: ./metrics)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Also print every gamdl output line")
+    return parser
+
+
+def scan_library(folder):
+    started = time.monotonic()
+    changed, removed = LibraryIndex(folder).scan()
+    print(json.dumps({"event": "scan", "folder": str(folder), "changed": changed, "removed": removed,
+                      "seconds": round(time.monotonic() - started, 3)}))
+    return 0
+
+
+def dedup_folder(folder):
+    started = time.monotonic()
+    index = DedupIndex(folder)
+    try:
+        report = index.run()
+    finally:
+        index.close()
+    print(json.dumps({"event": "dedup", "folder": str(folder), **report.to_dict(),
+                      "seconds": round(time.monotonic() - started, 3)}))
+    return 0
+
+
+def verify_folder(folder):
+    started = time.monotonic()
+    verifier = Verifier(find_ffprobe(base_dir=app_dir()))
+    try:
+        report = verifier.verify_library(folder)
+    finally:
+        verifier.close()
+    print(json.dumps({"event": "verify", "folder": str(folder), "ffprobe": bool(verifier.ffprobe),
+                      **report.to_dict(), "seconds": round(time.monotonic() - started, 3)}, ensure_ascii=False))
+    return 1 if report.bad else 0
+
+
+def manage_watchlist(args):
+    watchlist = WatchList(app_dir() / WATCHLIST_FILE)
+    for url in args.watch or []:
+        entry = watchlist.add(url, Path(args.output).resolve(), TRANSCODE_SOURCE_CODEC if args.transcode else args.codec,
+                              args.transcode)
+        print(json.dumps({"event": "watch", "url": entry.url, "target": entry.target}))
+    for url in args.unwatch or []:
+        print(json.dumps({"event": "unwatch", "url": url, "removed": watchlist.remove(url)}))
+    if args.list_watch:
+        for entry in watchlist.entries:
+            print(json.dumps({"event": "watched", **entry.to_dict()}, ensure_ascii=False))
+    return 0
+
+
+def search_logs(pattern, errors_only):
+    store = LogStore(app_dir() / "logs")
+    try:
+        for url, written, line in store.search(pattern, errors_only):
+            print(json.dumps({"event": "match", "url": url, "time": round(written, 3), "text": line},
+                             ensure_ascii=False))
+    finally:
+        store.close()
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.scan:
+        return scan_library(args.output)
+    if args.dedup_only:
+        return dedup_folder(args.output)
+    if args.verify_only:
+        return verify_folder(args.output)
+    if args.search:
+        return search_logs(args.search, args.errors_only)
+    try:
+        if args.watch or args.unwatch or args.list_watch:
+            return manage_watchlist(args)
+    except EngineError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 2
+
+    urls = read_urls(args) if not args.sync or args.urls or args.input else []
+    if not urls and not args.resume and not args.sync and not args.serve:
+        print("No links given.", file=sys.stderr)
+        return 2
+
+    engine = DownloadEngine(workers=args.workers, persistent=args.persistent, worker_max_jobs=args.recycle,
+                            skip_existing=not args.no_skip, transcode_workers=args.transcode_workers,
+                            retries=args.retries, dedup=args.dedup,
+                            rate_limit=args.rate, adaptive=not args.fixed_workers,
+                            job_timeout=args.timeout * 60, stall_timeout=args.stall, verify=not args.no_verify,
+                            staging_dir=args.staging, space_check=not args.no_space_check, shard_tracks=args.shard)
+    cookies = args.cookies or find_cookies(app_dir())
+    reporter = JsonReporter(verbose=args.verbose)
+    engine.add_listener(reporter)
+    metrics_dir = Path(args.metrics_dir) if args.metrics_dir else engine.base_dir / "metrics"
+    metrics = MetricsRecorder(metrics_dir)
+    engine.add_listener(metrics.on_event)
+
+    if args.resume:
+        for url, error in engine.resume()[1]:
+            print(f"[WARNING] Could not resume {url}: {error}", file=sys.stderr)
+
+    codec = TRANSCODE_SOURCE_CODEC if args.transcode else args.codec
+    try:
+        for url in urls:
+            engine.submit(url, args.output, str(cookies) if cookies else None, codec, transcode=args.transcode,
+                          keep_original=not args.remove_originals)
+    except EngineError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 2
+
+    scheduler = None
+    if args.sync:
+        try:
+            watchlist = WatchList(engine.base_dir / WATCHLIST_FILE)
+        except EngineError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            return 2
+        scheduler = WatchScheduler(engine, watchlist, str(cookies) if cookies else None,
+                                   log=lambda text, level: reporter.write({"event": "watch", "level": level,
+                                                                           "text": text}))
+        scheduler.sync_now().result()
+
+    if args.serve:
+        # Links submitted without settings use the ones given on the command line
+        defaults = {"target": args.output, "cookies": str(cookies) if cookies else None, "codec": codec,
+                    "transcode": args.transcode, "keep_original": not args.remove_originals}
+        api = ApiServer(engine, metrics=metrics, host=args.api_host, port=args.api_port, token=args.api_token,
+                        defaults=defaults)
+        try:
+            port = api.start()
+        except OSError as e:
+            print(f"[ERROR] API not started: {e}", file=sys.stderr)
+            engine.close()
+            return 2
+        reporter.write({"event": "api", "url": f"http://{args.api_host}:{port}",
+                        "token_file": str(api.token_path) if api.token_path else None})
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        api.stop()
+
+    try:
+        engine.join()
+    except KeyboardInterrupt:
+        # Running gamdl trees are killed; the unfinished jobs resume with --resume
+        engine.close()
+        metrics.close()
+        return 130
+    if scheduler:
+        scheduler.wait_playlists()
+    engine.close()
+    metrics.close()
+    return 1 if any(job.state == JOB_FAILED for job in engine.jobs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import errno
+import hashlib
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from library import SCAN_WORKERS, walk_files
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# =================================================================================
+# CONTENT DEDUP
+# =================================================================================
+# Finds files with identical content in a download folder (the same track saved through an
+# album and a playlist link, the same cover in every folder) and keeps one copy on disk.
+# Only files whose size matches another file's are ever hashed; digests are kept in
+# .ams_dedup.sqlite so later runs only look at new or changed files. After a job only the
+# files it wrote are looked up against that index; the folder is walked on the first run
+# and by --dedup-only. Duplicates become
+# reflinks where the filesystem supports them (independent copies sharing blocks) and
+# hardlinks otherwise.
+
+DEDUP_INDEX = ".ams_dedup.sqlite"
+DEDUP_EXTENSIONS = {".m4a", ".mp4", ".m4v", ".mp3", ".jpg", ".jpeg", ".png", ".lrc"}
+HASH_CHUNK = 1024 * 1024
+FICLONE = 0x40049409  # Linux ioctl: share all blocks of another file (btrfs, XFS, ...)
+
+DEDUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE TABLE IF NOT EXISTS totals (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks not supported")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+class DedupReport:
+    def __init__(self):
+        self.scanned = 0
+        self.hashed = 0
+        self.linked = 0
+        self.reclaimed = 0  # Bytes freed by this run
+        self.total_reclaimed = 0  # Bytes freed in this folder so far
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class DedupIndex:
+    def __init__(self, root, workers=SCAN_WORKERS, mode="auto"):
+        self.root = Path(root)
+        self.workers = workers
+        self.mode = mode  # "auto" (reflink, else hardlink), "reflink" or "hardlink"
+        self._lock = threading.Lock()
+        self._no_reflink = set()  # Devices where FICLONE failed once
+        self._db = sqlite3.connect(self.root / DEDUP_INDEX, check_same_thread=False)
+        with self._db:
+            self._db.executescript(DEDUP_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def run(self, paths=None):
+        # One incremental pass: index new/changed files, hash size collisions, link duplicates.
+        # paths: the only files that can be new (a job's outputs); None walks the whole folder.
+        with self._lock:
+            report = DedupReport()
+            if paths is not None and not self._walked():
+                paths = None  # Nothing to compare them with yet
+            with ThreadPoolExecutor(self.workers) as pool:
+                if paths is None:
+                    found = walk_files(self.root, pool, DEDUP_EXTENSIONS)
+                    known = {p: (s, m) for p, s, m in self._db.execute("SELECT path, size, mtime FROM files")}
+                else:
+                    paths = [os.path.abspath(p) for p in paths]
+                    found = self._stat_files(paths)
+                    known = {}
+                    for path in paths:
+                        row = self._db.execute("SELECT size, mtime FROM files WHERE path = ?", (path,)).fetchone()
+                        if row: known[path] = tuple(row)
+                seen, changed = set(), []
+                for path, size, mtime in found:
+                    seen.add(path)
+                    if known.get(path) != (size, mtime):
+                        changed.append((path, size, mtime))
+                report.scanned = len(seen)
+
+                with self._db:
+                    self._db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in known.keys() - seen])
+                    self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)", changed)
+                    if paths is None:
+                        self._db.execute("INSERT OR REPLACE INTO totals VALUES ('walked', 1)")
+
+                # Only sizes a changed file shares with another file can hold new duplicates
+                groups = self._size_groups({size for _, size, _ in changed}, None if paths is None else seen)
+                unhashed = [path for paths in groups for path, digest in paths if digest is None]
+                digests = dict(zip(unhashed, pool.map(self._safe_digest, unhashed)))
+                report.hashed = sum(1 for d in digests.values() if d)
+            with self._db:
+                self._db.executemany("UPDATE files SET digest = ? WHERE path = ?",
+                                     [(d, p) for p, d in digests.items() if d])
+
+            for paths in groups:
+                by_digest = defaultdict(list)
+                for path, digest in paths:
+                    digest = digest or digests.get(path)
+                    if digest: by_digest[digest].append(path)
+                for same in by_digest.values():
+                    if len(same) > 1:
+                        self._link_group(sorted(same), report)
+
+            with self._db:
+                self._db.execute("INSERT INTO totals VALUES ('reclaimed', ?) ON CONFLICT(key) "
+                                 "DO UPDATE SET value = value + excluded.value", (report.reclaimed,))
+            report.total_reclaimed = self._db.execute(
+                "SELECT value FROM totals WHERE key = 'reclaimed'").fetchone()[0]
+            return report
+
+    def _walked(self):
+        return self._db.execute("SELECT 1 FROM totals WHERE key = 'walked'").fetchone() is not None
+
+    @staticmethod
+    def _stat_files(paths):
+        found = []
+        for path in paths:
+            name = os.path.basename(path)
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in DEDUP_EXTENSIONS: continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((path, st.st_size, st.st_mtime))
+        return found
+
+    def _size_groups(self, sizes, fresh=None):
+        # fresh: the paths stat'ed by this pass (None: all of them). Other rows may be out of
+        # date without a walk, so they are checked on disk and dropped if the file changed.
+        groups, stale = [], []
+        for size in sizes:
+            rows = []
+            for path, digest, mtime in self._db.execute("SELECT path, digest, mtime FROM files WHERE size = ?",
+                                                        (size,)).fetchall():
+                if fresh is None or path in fresh or self._unchanged(path, size, mtime):
+                    rows.append((path, digest))
+                else:
+                    stale.append((path,))
+            if len(rows) > 1 and size > 0:
+                groups.append(rows)
+        if stale:
+            with self._db:
+                self._db.executemany("DELETE FROM files WHERE path = ?", stale)
+        return groups
+
+    @staticmethod
+    def _unchanged(path, size, mtime):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime) == (size, mtime)
+
+    @staticmethod
+    def _safe_digest(path):
+        try:
+            return file_digest(path)
+        except OSError:
+            return None
+
+    def _link_group(self, paths, report):
+        # The first path (sorted) is kept; the others become links to it
+        keep = paths[0]
+        try:
+            kst = os.stat(keep)
+        except OSError:
+            return
+        for path in paths[1:]:
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) == (kst.st_dev, kst.st_ino) or st.st_dev != kst.st_dev:
+                    continue  # Already one file, or on another filesystem
+                self._replace_with_link(keep, path, st)
+            except OSError:
+                continue
+            report.linked += 1
+            if st.st_nlink == 1:  # Otherwise another link still holds the old blocks
+                report.reclaimed += st.st_size
+            st = os.stat(path)
+            with self._db:
+                self._db.execute("UPDATE files SET size = ?, mtime = ? WHERE path = ?",
+                                 (st.st_size, st.st_mtime, path))
+
+    def _replace_with_link(self, keep, path, st):
+        # Built next to the duplicate and swapped in atomically, so a crash never loses a file
+        tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.dedup")
+        if os.path.exists(tmp): os.unlink(tmp)
+        try:
+            if self.mode != "hardlink" and st.st_dev not in self._no_reflink:
+                try:
+                    reflink(keep, tmp)
+                    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                    os.replace(tmp, path)
+                    return
+                except OSError:
+                    if os.path.exists(tmp): os.unlink(tmp)
+                    self._no_reflink.add(st.st_dev)
+                    if self.mode == "reflink": raise
+            os.link(keep, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.unlink(tmp)
@@ -0,0 +1,1560 @@
+import os
+import sys
+import asyncio
+import codecs
+import hashlib
+import itertools
+import json
+import random
+import re
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from pathlib import Path
+
+from catalog import CatalogClient, CatalogError
+from dedup import DedupIndex
+from gamdl_worker import CONTROL_PREFIX
+from journal import JobJournal, JOURNAL_FILE
+from logstore import LogStore
+from preflight import CookieFileError, load_cookies
+from ratelimit import ConcurrencyControl, TokenBucket, RATE_LIMIT
+from storage import SpaceBudget, InsufficientSpace, INTERMEDIATE_COPIES, estimate_size, missing_tracks
+from library import LibraryIndex, read_tags
+from transcode import Transcoder, TranscodeError, TRANSCODE_PROFILES, TRANSCODE_SOURCES
+from urls import parse_url, song_id, track_link, url_key
+from verify import Verifier, find_ffprobe
+
+# =================================================================================
+# CONSTANTS & CONFIGURATION
+# =================================================================================
+
+GAMDL_CONFIG_TEMPLATE = """[gamdl]
+save_cover = true
+no_synced_lyrics = true
+log_level = INFO
+log_file = null
+no_exceptions = false
+language = en-US
+wvd_path = null
+overwrite = false
+save_playlist = false
+nm3u8dlre_path = N_m3u8DL-RE
+mp4decrypt_path = mp4decrypt
+ffmpeg_path = ffmpeg
+mp4box_path = MP4Box
+download_mode = ytdlp
+remux_mode = ffmpeg
+cover_format = jpg
+album_folder_template = {album_artist}/{album}
+compilation_folder_template = Compilations/{album}
+single_disc_file_template = {track:02d} {title}
+multi_disc_file_template = {disc}-{track:02d} {title}
+no_album_folder_template = {artist}/Unknown Album
+no_album_file_template = {title}
+playlist_file_template = Playlists/{playlist_artist}/{playlist_title}
+date_tag_template = %Y-%m-%dT%H:%M:%SZ
+exclude_tags = null
+cover_size = 1200
+truncate = null
+synced_lyrics_format = lrc
+synced_lyrics_only = false
+music_video_codec_priority = h264,h265
+music_video_remux_format = m4v
+music_video_resolution = 1080p
+uploaded_video_quality = best
+codec_song = {codec}
+cookies_path = {cookies}
+"""
+
+
+def render_config(codec, cookies):
+    # The template also holds gamdl's own {placeholders}, so only our two fields are filled in
+    return GAMDL_CONFIG_TEMPLATE.replace("{codec}", codec).replace("{cookies}", cookies)
+
+
+CODEC_MAP = {
+    "m4a (AAC - Original)": "aac-legacy",
+    "mp3 (Converted)": "mp3"
+}
+
+# Downloaded once as TRANSCODE_SOURCE_CODEC, then converted to every selected profile by the
+# engine's own ffmpeg stage
+TRANSCODE_MAP = {spec["label"]: name for name, spec in TRANSCODE_PROFILES.items()}
+TRANSCODE_SOURCE_CODEC = "aac-legacy"
+
+JOB_QUEUED = "Queued"
+JOB_RUNNING = "Running"
+JOB_PROCESSING = "Processing"  # gamdl is done, post-processing (transcodes) still running
+JOB_RETRYING = "Retrying"  # Failed with a transient error, queued again after a backoff delay
+JOB_DONE = "Done"
+JOB_FAILED = "Failed"
+JOB_SKIPPED = "Skipped"
+JOB_CANCELLED = "Cancelled"
+
+
+# =================================================================================
+# PROCESS OUTPUT STREAMING
+# =================================================================================
+
+class EventLoopThread:
+    # One background asyncio loop shared by every job, instead of a thread per process
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self, timeout=5):
+        async def shutdown():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.submit(shutdown()).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+
+class LineSplitter:
+    # Incrementally decodes a byte stream and splits it into lines. Carriage returns count
+    # as line breaks so progress bars redrawn in place arrive as separate updates.
+    LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+    def __init__(self, encoding="utf-8"):
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._tail = ""
+
+    def feed(self, data):
+        parts = self.LINE_BREAK.split(self._tail + self._decoder.decode(data))
+        self._tail = parts.pop()
+        return [p for p in parts if p]
+
+    def flush(self):
+        rest, self._tail = self._tail + self._decoder.decode(b"", final=True), ""
+        return [rest] if rest else []
+
+
+async def stream_lines(stream, on_line, chunk_size=65536):
+    splitter = LineSplitter()
+    while data := await stream.read(chunk_size):
+        for line in splitter.feed(data):
+            on_line(line)
+    for line in splitter.flush():
+        on_line(line)
+
+
+# =================================================================================
+# GAMDL OUTPUT PARSING
+# =================================================================================
+
+TrackEvent = namedtuple("TrackEvent", "index total")
+StageEvent = namedtuple("StageEvent", "stage")
+
+# text: line without ANSI codes, level: INFO/WARNING/ERROR or None,
+# kind: "download" (yt-dlp line), "heading", "step" or None
+ParsedLine = namedtuple("ParsedLine", "text level kind events")
+_tuple_new = tuple.__new__
+
+STAGE_DOWNLOAD = "download"
+STAGE_DECRYPT = "decrypt"
+STAGE_REMUX = "remux"
+STAGE_TAG = "tag"
+STAGE_COVER = "cover"
+
+# Share of a track's progress reached once a stage starts (download fills 0 -> 0.85 by percent)
+STAGE_PROGRESS = {STAGE_DOWNLOAD: 0.0, STAGE_DECRYPT: 0.85, STAGE_REMUX: 0.92, STAGE_TAG: 0.97, STAGE_COVER: 0.97}
+DOWNLOAD_SHARE = 0.85
+
+UNIT_SCALE = {"B": 1, "KB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12,
+              "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4}
+DOWNLOAD_LINE = re.compile(r"""\[download\]\s+(?:
+    (?P<pct>\d+(?:\.\d+)?)%
+    (?:\s+of\s+~?\s*(?P<size>\d+(?:\.\d+)?)\s*(?P<size_u>[KMGT]?i?B))?
+    (?:\s+in\s+[\d:]+)?
+    (?:\s+at\s+(?P<speed>\d+(?:\.\d+)?)\s*(?P<speed_u>[KMGT]?i?B)/s)?
+    (?:\s+ETA\s+(?P<eta>[\d:]+))?
+)?""", re.VERBOSE)
+
+
+class DownloadEvent(namedtuple("DownloadEvent", "percent text")):
+    # One yt-dlp progress line:
+    #   [download]  45.3% of    7.89MiB at    1.23MiB/s ETA 00:05
+    # Only the percentage is read up front. Hundreds of these arrive per track and each one
+    # supersedes the last, so size, speed and ETA are parsed from the text when asked for.
+    __slots__ = ()
+
+    def _group(self, name):
+        m = DOWNLOAD_LINE.match(self.text)
+        return m and m.group(name), m and m.group(name + "_u")
+
+    @property
+    def total(self):
+        value, unit = self._group("size")
+        return int(float(value) * UNIT_SCALE.get(unit, 1)) if value else None
+
+    @property
+    def bytes_per_sec(self):
+        value, unit = self._group("speed")
+        return float(value) * UNIT_SCALE.get(unit, 1) if value else None
+
+    @property
+    def eta(self):
+        m = DOWNLOAD_LINE.match(self.text)
+        if not (m and m.group("eta")): return None
+        parts = [int(x) for x in m.group("eta").split(":") if x]
+        return sum(v * 60 ** i for i, v in enumerate(reversed(parts)))
+
+
+class GamdlOutputParser:
+    ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+    # yt-dlp progress lines ("[download] ...", most of gamdl's output) take a plain string
+    # fast path; every other line is matched by one precompiled pattern:
+    #   [INFO     12:00:02] (Track 3/12 from URL 1/1) Downloading "Title"
+    LOG_LINE = re.compile(r"""
+        (?:\[(?P<level>[A-Z]+)\b[^\]]*\]\s*)?
+        (?:\((?:Track\s+(?P<track_i>\d+)\s*/\s*(?P<track_n>\d+)
+              (?:\s+from\s+URL\s+(?P<url_i>\d+)\s*/\s*(?P<url_n>\d+))?)?[^)]*\)\s*)*
+        (?P<word>[A-Za-z]+)?(?:\s+(?P<word2>[A-Za-z]+))?
+    """, re.VERBOSE)
+
+    DOWNLOAD_STARTED = (StageEvent(STAGE_DOWNLOAD),)  # "[download] Destination: ..." and the like
+    LEVELS = {"DEBUG": None, "INFO": "INFO", "WARNING": "WARNING", "ERROR": "ERROR", "CRITICAL": "ERROR"}
+    # First word of a message -> (line kind, stage it starts)
+    WORDS = {
+        "Downloading": ("step", STAGE_DOWNLOAD),
+        "Decrypting": ("step", STAGE_DECRYPT),
+        "Remuxing": ("step", STAGE_REMUX),
+        "Converting": ("step", STAGE_REMUX),
+        "Applying": ("step", STAGE_TAG),
+        "Tagging": ("step", STAGE_TAG),
+        "Saving": ("step", None),
+        "Processing": ("heading", None),
+        "Finished": ("heading", None),
+    }
+
+    def parse(self, line):
+        text = self.ANSI_ESCAPE.sub('', line) if "\x1b" in line else line
+
+        if text.startswith("[download]"):
+            # tuple.__new__ skips the namedtuples' Python-level __new__, a third of this path's cost
+            end = text.find("%", 10)
+            if end > 0:
+                try:
+                    event = _tuple_new(DownloadEvent, (float(text[10:end]), text))
+                except ValueError:
+                    pass
+                else:
+                    return _tuple_new(ParsedLine, (text, None, "download", (event,)))
+            return ParsedLine(text, None, "download", self.DOWNLOAD_STARTED)
+
+        m = self.LOG_LINE.match(text)
+        level = self.LEVELS.get(m.group("level"))
+        events = []
+        if m.group("track_n"):
+            if m.group("url_n") and m.group("track_n") == "1" and m.group("url_n") != "1":
+                # A shard's track links, one track each: the links are the tracks
+                events.append(TrackEvent(int(m.group("url_i")), int(m.group("url_n"))))
+            else:
+                events.append(TrackEvent(int(m.group("track_i")), int(m.group("track_n"))))
+
+        word = m.group("word")
+        if word == "Traceback":
+            level = "ERROR"
+        kind, stage = self.WORDS.get(word, (None, None))
+        if kind == "step" and m.group("word2") == "cover":
+            stage = STAGE_COVER
+        if stage:
+            events.append(StageEvent(stage))
+        return ParsedLine(text, level, kind, events)
+
+
+class AlbumProgress:
+    # Folds parser events of one gamdl run into an overall progress value and ETA
+    def __init__(self):
+        self.index = 0
+        self.total = 0
+        self.fraction = 0.0  # Progress of the current track, 0..1
+        self.download = None  # Latest DownloadEvent of the current track
+        self.track_times = []
+        self._track_started = time.monotonic()
+
+    def update(self, events):
+        for ev in events:
+            kind = type(ev)
+            if kind is DownloadEvent:
+                fraction = min(ev.percent, 100.0) / 100 * DOWNLOAD_SHARE
+                if fraction > self.fraction: self.fraction = fraction
+                self.download = ev
+            elif kind is TrackEvent:
+                if ev.index != self.index:
+                    now = time.monotonic()
+                    if self.index and self.fraction > 0:
+                        self.track_times.append(now - self._track_started)
+                    self._track_started = now
+                    self.fraction = 0.0
+                    self.download = None
+                self.index, self.total = ev.index, max(ev.total, 1)
+            elif kind is StageEvent:
+                self.fraction = max(self.fraction, STAGE_PROGRESS[ev.stage])
+
+    @property
+    def download_eta(self):
+        return self.download.eta if self.download else None
+
+    @property
+    def percent(self):
+        if not self.total:
+            return self.fraction * 100
+        return min(100.0, (self.index - 1 + self.fraction) / self.total * 100)
+
+    @property
+    def eta(self):
+        elapsed = time.monotonic() - self._track_started
+        download_eta = self.download_eta
+        if self.track_times:
+            per_track = sum(self.track_times) / len(self.track_times)
+        elif download_eta is not None:
+            per_track = (elapsed + download_eta) / DOWNLOAD_SHARE
+        elif self.fraction > 0:
+            per_track = elapsed / self.fraction
+        else:
+            return None
+
+        current = max(per_track - elapsed, 0.0)
+        if download_eta is not None and self.fraction < DOWNLOAD_SHARE:
+            current = max(current, download_eta)
+        return current + per_track * max(self.total - self.index, 0)
+
+
+def format_eta(seconds):
+    if seconds is None: return ""
+    minutes, sec = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{sec:02d}" if hours else f"{minutes}:{sec:02d}"
+
+
+# =================================================================================
+# DOWNLOAD QUEUE
+# =================================================================================
+
+class Job:
+    def __init__(self, job_id, url, target, codec, cookies, config_file, key=None):
+        self.id = job_id
+        self.key = key or uuid.uuid4().hex  # Stable across restarts, used by the journal
+        self.url = url
+        self.urls = [url]  # What gamdl is given: the link itself, or a shard's track links
+        self.target = target
+        self.codec = codec
+        self.cookies = cookies
+        self.state = JOB_QUEUED
+        self.progress = 0.0
+        self.returncode = None
+        self.album = AlbumProgress()
+        self.retries = 0
+        self.resumed = False  # Queued again from the journal: tracks of the interrupted run aren't indexed yet
+        self.finished_files = set()  # Files an interrupted earlier run of this job completed (journaled)
+        self.identity = None  # Key in the engine's duplicate check while unfinished
+        self.tail = deque(maxlen=20)  # Last output lines, to tell transient failures apart
+
+        # Transcode profiles every finished track is converted to, and what happens to the originals
+        self.transcode = []
+        self.keep_original = True
+        self.pending = []  # Post-processing tasks that must finish before the job does
+        self.outputs = set()  # Files the job wrote into the target: the only ones it converts, verifies or removes
+        self.output_dir = None  # Private --output-path when gamdl's moves can't be observed, merged afterwards
+        self.unobserved = False  # Plain gamdl wrote straight into the target: outputs is incomplete
+        self.staging = None  # gamdl's temp folder for this run, inside the engine's staging folder
+        self.proc = None  # The gamdl process (or persistent worker) running this job
+        self.cancelled = False
+        self.killed = None  # Why the supervisor killed the current run: "cancelled", "timeout" or "stalled"
+        self.last_progress = 0.0  # Monotonic time of the last progress event, for the stall watchdog
+
+        # A large album or playlist is split into shards that run as jobs of their own
+        self.parent = None
+        self.shard = None  # (index, count) of a shard
+        self.shards = []  # Of a split job, which is done when they are
+        self.shards_done = None  # asyncio.Event, set when the last shard has finished
+        self.tracks = None  # Catalog tracks still missing (of a shard: the ones it downloads), None if unknown
+
+        # Jobs with identical settings share one rendered config
+        self.config_file = config_file
+
+    @property
+    def finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED, JOB_SKIPPED, JOB_CANCELLED)
+
+    @property
+    def label(self):
+        return f"{self.url} [{self.shard[0]}/{self.shard[1]}]" if self.shard else self.url
+
+
+class RetryPolicy:
+    # Exponential backoff with jitter: attempt n waits between half and all of base * 2^n
+    # (capped), so jobs that failed together don't all come back at the same moment.
+    TRANSIENT = re.compile(r"time[ds]? ?out|temporar|connection|reset by peer|network|too many requests|"
+                           r"\b(?:429|500|502|503|504)\b|remote end closed|broken pipe|incompleteread|ssl",
+                           re.IGNORECASE)
+
+    def __init__(self, max_retries=3, base_delay=5.0, max_delay=300.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def is_transient(self, job):
+        # Network-looking errors, or a process that was killed after it had started working
+        if any(self.TRANSIENT.search(line) for line in job.tail):
+            return True
+        return job.returncode is not None and job.returncode < 0 and bool(job.tail)
+
+
+class DownloadQueue:
+    # Persistent job queue drained by a resizable pool of asyncio workers.
+    # Public methods are thread-safe; workers run on the given event loop.
+    def __init__(self, loop, runner, workers=None, on_change=None, retry=None, kill=None):
+        self.loop = loop
+        self.runner = runner
+        self.on_change = on_change or (lambda job: None)
+        self.retry = retry or (lambda job: None)  # Returns a delay to run a failed job again, or None
+        self.kill = kill or (lambda job, reason: asyncio.ensure_future(kill_tree(job.proc)))
+        self.jobs = []
+        self.max_workers = 0
+
+        self._pending = deque()
+        self._workers = set()
+        self._cond = asyncio.Condition()
+        self.set_workers(workers or os.cpu_count() or 1)
+
+    def add(self, job):
+        self.jobs.append(job)
+        self.on_change(job)
+        asyncio.run_coroutine_threadsafe(self._enqueue(job), self.loop)
+
+    def set_workers(self, count):
+        self.max_workers = max(1, int(count))
+        asyncio.run_coroutine_threadsafe(self._resize(), self.loop)
+
+    def active_count(self):
+        return sum(1 for j in self.jobs if not j.finished)
+
+    async def _enqueue(self, job):
+        async with self._cond:
+            self._pending.append(job)
+            self._cond.notify()
+
+    async def _resize(self):
+        async with self._cond:
+            while len(self._workers) < self.max_workers:
+                self._workers.add(asyncio.create_task(self._worker()))
+            # Surplus workers retire themselves once their current job is finished
+            self._cond.notify_all()
+
+    async def _worker(self):
+        me = asyncio.current_task()
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._pending or len(self._workers) > self.max_workers)
+                if len(self._workers) > self.max_workers:
+                    self._workers.discard(me)
+                    return
+                job = self._pending.popleft()
+                if job.finished: continue  # Cancelled while it was waiting
+                job.state = JOB_RUNNING
+            self.on_change(job)
+
+            try:
+                job.returncode = await self.runner(job)
+            except Exception:
+                job.returncode = -1
+            if job.cancelled and job.state == JOB_RUNNING:
+                job.state = JOB_CANCELLED
+            # The runner may settle the final state itself (e.g. skipped)
+            delay = self.retry(job) if job.state == JOB_RUNNING and job.returncode != 0 else None
+            if delay is not None:
+                job.retries += 1
+                job.state = JOB_RETRYING
+                self.loop.call_later(delay, lambda j=job: asyncio.ensure_future(self._enqueue(j)))
+            elif job.state == JOB_RUNNING and job.pending:
+                # Post-processing finishes in the background and doesn't hold a download slot
+                job.state = JOB_PROCESSING
+                asyncio.create_task(self._settle(job))
+            elif job.state == JOB_RUNNING:
+                job.state = JOB_DONE if job.returncode == 0 else JOB_FAILED
+            self.on_change(job)
+
+    async def _settle(self, job):
+        results = []
+        while len(results) < len(job.pending):  # Late scans may still add tasks
+            results += await asyncio.gather(*job.pending[len(results):], return_exceptions=True)
+        ok = job.returncode == 0 and all(r is True for r in results)
+        job.state = JOB_CANCELLED if job.cancelled else JOB_DONE if ok else JOB_FAILED
+        self.on_change(job)
+
+    def cancel(self, job):
+        # Runs on the loop. Waiting jobs end at once; a running one when its process is gone.
+        # A run without a process yet is killed by the runner once it has one.
+        if job.finished: return
+        job.cancelled = True
+        if job.state in (JOB_QUEUED, JOB_RETRYING):
+            job.state = JOB_CANCELLED
+            self.on_change(job)
+        elif job.state == JOB_RUNNING and job.proc and job.proc.returncode is None:
+            self.kill(job, "cancelled")
+        elif job.state == JOB_PROCESSING:
+            for task in job.pending: task.cancel()
+
+
+# =================================================================================
+# PERSISTENT GAMDL WORKERS
+# =================================================================================
+
+WORKER_SCRIPT = Path(__file__).with_name("gamdl_worker.py")
+WORKER_MAX_JOBS = 50  # A worker is recycled after this many jobs (and after any failed job)
+KILL_GRACE = 5.0  # Seconds between asking a process tree to exit and killing it
+JOB_TIMEOUT = 0  # Wall-clock limit for one gamdl run in seconds (0 = none)
+STALL_TIMEOUT = 300.0  # A run without a progress event for this long is killed and requeued (0 = never)
+WATCHDOG_INTERVAL = 1.0
+CATALOG_BACKOFF = 600.0  # After a failed catalog lookup, sizes are guessed for this long
+SHARD_TRACKS = 10  # Fewest tracks per shard; shorter albums and playlists run as one job (0 = never split)
+
+
+def process_env():
+    env = os.environ.copy()
+    env.update({"PYTHONUNBUFFERED": "1", "TERM": "dumb", "NO_COLOR": "1"})
+    return env
+
+
+def popen_kwargs(group=False):
+    kwargs = {}
+    if sys.platform == "win32":
+        # Keep gamdl from flashing a console window
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        kwargs["startupinfo"] = si
+        if group: kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    elif group:
+        # gamdl's children (ffmpeg, mp4decrypt) share the group and are killed with it
+        kwargs["start_new_session"] = True
+    return kwargs
+
+
+async def kill_tree(proc, grace=KILL_GRACE):
+    # For processes started with popen_kwargs(group=True). Children would otherwise keep the
+    # output pipe open, and the job would wait for them.
+    if proc is None or proc.returncode is not None: return
+    if sys.platform == "win32":
+        try:
+            killer = await asyncio.create_subprocess_exec("taskkill", "/F", "/T", "/PID", str(proc.pid),
+                                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                                          **popen_kwargs())
+            await killer.wait()
+        except OSError:
+            proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), grace)
+    except asyncio.TimeoutError:
+        pass
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)  # Whatever ignored SIGTERM or outlived gamdl
+    except ProcessLookupError:
+        pass
+
+
+def find_gamdl_python(gamdl_exe):
+    # The interpreter gamdl is installed into, so the worker can import it
+    exe = Path(gamdl_exe)
+    if sys.platform == "win32":
+        for candidate in (exe.parent.parent / "python.exe", exe.parent / "python.exe"):
+            if candidate.exists():
+                return str(candidate)
+    else:
+        try:
+            with open(exe, "rb") as f:
+                first = f.readline(512).decode(errors="replace")
+            if first.startswith("#!"):
+                parts = first[2:].split()
+                if parts and Path(parts[0]).name == "env" and len(parts) > 1:
+                    return shutil.which(parts[1])
+                if parts:
+                    return parts[0]
+        except OSError:
+            pass
+    return None if getattr(sys, 'frozen', False) else sys.executable
+
+
+class WorkerUnavailable(Exception):
+    pass
+
+
+class GamdlWorker:
+    # One long-lived gamdl_worker.py process. Jobs go in as JSON lines on stdin, gamdl
+    # output comes back on stdout until the worker's "done" control message.
+    def __init__(self, cmd, cwd, max_jobs=WORKER_MAX_JOBS):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.max_jobs = max_jobs
+        self.proc = None
+        self.jobs_done = 0
+        self.last_returncode = 0
+
+        self._splitter = LineSplitter()
+        self._lines = deque()
+        self._eof = False
+
+    @property
+    def reusable(self):
+        # Mirrors the worker's own exit rules
+        return (self.proc is not None and self.proc.returncode is None and not self._eof
+                and self.last_returncode == 0 and (not self.max_jobs or self.jobs_done < self.max_jobs))
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.cmd, "--max-jobs", str(self.max_jobs), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=self.cwd, env=process_env(), **popen_kwargs(group=True))
+        startup = []
+        msg = await self._read_until_control(startup.append)
+        if not msg or msg.get("event") != "ready":
+            await self.stop()
+            reason = msg.get("error") if msg else (startup[-1] if startup else "worker exited")
+            raise WorkerUnavailable(reason)
+
+    async def run(self, job_id, args, on_line, on_moved=None):
+        self.proc.stdin.write((json.dumps({"id": job_id, "args": args}) + "\n").encode())
+        await self.proc.stdin.drain()
+        msg = await self._read_until_control(on_line, on_moved)
+        self.jobs_done += 1
+        if msg is None:
+            # The worker died mid-job
+            self.last_returncode = await self.proc.wait() or -1
+        else:
+            self.last_returncode = msg["returncode"]
+        return self.last_returncode
+
+    async def stop(self):
+        if self.proc is None or self.proc.returncode is not None: return
+        try:
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), 5)
+        except (asyncio.TimeoutError, OSError):
+            self.proc.kill()
+            await self.proc.wait()
+
+    async def _read_until_control(self, on_line, on_moved=None):
+        while True:
+            while not self._lines:
+                if self._eof: return None
+                data = await self.proc.stdout.read(65536)
+                if data:
+                    self._lines.extend(self._splitter.feed(data))
+                else:
+                    self._lines.extend(self._splitter.flush())
+                    self._eof = True
+            line = self._lines.popleft()
+            if line.startswith(CONTROL_PREFIX):
+                msg = json.loads(line[len(CONTROL_PREFIX):])
+                if msg.get("event") != "moved":
+                    return msg
+                if on_moved: on_moved(msg["path"])
+                continue
+            on_line(line)
+
+
+class GamdlWorkerPool:
+    # Idle workers are kept warm and handed to the next job; dead or recycled ones are replaced
+    def __init__(self, cmd, cwd, max_jobs=WORKER_MAX_JOBS):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.max_jobs = max_jobs
+        self.available = True
+        self._idle = []
+
+    async def acquire(self):
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.reusable:
+                return worker
+            await worker.stop()
+        worker = GamdlWorker(self.cmd, self.cwd, self.max_jobs)
+        try:
+            await worker.start()
+        except WorkerUnavailable:
+            self.available = False
+            raise
+        return worker
+
+    async def release(self, worker, keep):
+        if worker.reusable and len(self._idle) < keep:
+            self._idle.append(worker)
+        else:
+            await worker.stop()
+
+    async def close(self):
+        while self._idle:
+            await self._idle.pop().stop()
+
+
+# =================================================================================
+# PATHS
+# =================================================================================
+
+DOC_COOKIES_PATH = Path(os.path.expanduser("~")) / "Documents" / "Apple Music" / "cookies.txt"
+DEFAULT_MUSIC_FOLDER = Path(os.path.expanduser("~")) / "Downloads" / "Apple Music Download"
+
+
+def app_dir():
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent
+    return Path(__file__).parent.resolve()
+
+
+def find_cookies(base_dir):
+    for path in (DOC_COOKIES_PATH, Path(base_dir) / "cookies.txt"):
+        if path.exists():
+            return path
+    return None
+
+
+# =================================================================================
+# DOWNLOAD ENGINE
+# =================================================================================
+
+# Listener events, delivered as fn(event, job, data). Listeners may be called from any
+# thread (mostly the engine loop thread) and must hand work off to their own thread.
+EVENT_JOB = "job"  # A job was queued, or its state/progress changed
+EVENT_LINE = "line"  # gamdl printed a line, data: ParsedLine
+EVENT_MESSAGE = "message"  # Engine message about a job, data: (text, level)
+
+
+class EngineError(Exception):
+    pass
+
+
+class DownloadEngine:
+    def __init__(self, base_dir=None, gamdl_cmd=None, workers=None, keep_logs=True, persistent=False,
+                 worker_cmd=None, worker_max_jobs=WORKER_MAX_JOBS, skip_existing=True, ffmpeg=None,
+                 transcode_workers=None, journal=True, retries=3, dedup=False,
+                 rate_limit=RATE_LIMIT, adaptive=True, job_timeout=JOB_TIMEOUT, stall_timeout=STALL_TIMEOUT,
+                 verify=True, staging_dir=None, space_check=True, shard_tracks=SHARD_TRACKS):
+        self.base_dir = Path(base_dir) if base_dir else app_dir()
+        self.jobs_dir = self.base_dir / "jobs"
+        self.configs_dir = self.jobs_dir / "configs"
+        if gamdl_cmd is None:
+            exe = shutil.which("gamdl")
+            gamdl_cmd = [exe] if exe else None
+        self.gamdl_cmd = gamdl_cmd
+        self.skip_existing = skip_existing
+
+        # Persistent mode runs jobs inside long-lived gamdl workers instead of a fresh process each
+        self.persistent = persistent
+        if worker_cmd is None and gamdl_cmd and WORKER_SCRIPT.exists():
+            python = find_gamdl_python(gamdl_cmd[0])
+            worker_cmd = [python, "-u", str(WORKER_SCRIPT)] if python else None
+        self.worker_pool = GamdlWorkerPool(worker_cmd, self.base_dir, worker_max_jobs) if worker_cmd else None
+
+        # Intermediates go to a fast local folder; jobs only start when their files fit
+        self.staging_dir = Path(staging_dir) if staging_dir else None
+        self.space_check = space_check
+        self.space = SpaceBudget()
+        self._catalogs = {}
+        self._catalog_down_until = 0.0
+
+        # Albums and playlists with many missing tracks are split into parallel shards
+        self.shard_tracks = shard_tracks
+
+        if ffmpeg is None:
+            bundled = self.base_dir / "ffmpeg.exe"
+            ffmpeg = shutil.which("ffmpeg") or (str(bundled) if bundled.exists() else None)
+        self.transcoder = Transcoder(ffmpeg, transcode_workers, popen_kwargs())
+
+        # New files are probed and hashed after each job, results kept in per-album manifests
+        self.verify = verify
+        self.verifier = Verifier(find_ffprobe(ffmpeg, self.base_dir), transcode_workers, popen_kwargs())
+
+        # Unfinished jobs survive restarts; transient failures are retried with backoff
+        self.journal = JobJournal(self.jobs_dir / JOURNAL_FILE) if journal else None
+        self.retry_policy = RetryPolicy(retries)
+
+        # Runs are killed (with their child processes) on cancel, timeout or stall
+        self.job_timeout = job_timeout
+        self.stall_timeout = stall_timeout
+        self.killed = 0  # Runs killed this session, for any reason
+        self.restarted = 0  # Stalled runs requeued
+        self.closing = False  # Set by close(): whatever is unfinished then resumes on the next start
+
+        # Identical files in the download folder are replaced by links once a job finishes
+        self.dedup = dedup
+
+        self.parser = GamdlOutputParser()
+        self.listeners = []
+
+        # Output of every job, kept across sessions in logs/ and searchable
+        self.logs = LogStore(self.base_dir / "logs") if keep_logs else None
+        if self.logs:
+            self.add_listener(self._store_log)
+        self._job_ids = itertools.count(1)
+        self._configs = set()
+        self._libraries = {}
+        self._libraries_lock = threading.Lock()
+        self._dedups = {}
+        self._converting = set()  # Sources being transcoded, by any job
+        self._journaled = {}  # Job key -> last state written to the journal
+        self._queued = {}  # (url_key, target, codec, transcode) -> unfinished job, to collapse duplicates
+        self._submit_lock = threading.Lock()
+        self._cookies_checked = {}  # Cookies path -> (mtime, problem levels) last reported; under _submit_lock
+        self._idle = threading.Condition()
+
+        self.loop_thread = EventLoopThread()
+        self.queue = DownloadQueue(self.loop_thread.loop, self._run_process, workers,
+                                   on_change=self._on_job_changed, retry=self._retry_delay, kill=self._kill)
+
+        # Global launch budget, and a parallel job limit that backs off when Apple throttles
+        self.rate_limit = rate_limit
+        self.bucket = TokenBucket(rate_limit)
+        self.concurrency = ConcurrencyControl(self.queue.max_workers, adaptive)
+
+    @property
+    def jobs(self):
+        return self.queue.jobs
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def emit(self, event, job, data=None):
+        for fn in self.listeners:
+            fn(event, job, data)
+
+    def cancel(self, job):
+        # Thread-safe; the job ends as Cancelled, with its shards
+        self.loop_thread.loop.call_soon_threadsafe(self._cancel, job)
+
+    def _cancel(self, job):
+        for shard in job.shards:
+            self.queue.cancel(shard)
+        self.queue.cancel(job)
+
+    def set_workers(self, count):
+        # The user's setting is the ceiling the adaptive limit moves under
+        self.loop_thread.loop.call_soon_threadsafe(lambda: self._apply_limit(self.concurrency.set_ceiling(count)))
+
+    def submit(self, url, target, cookies, codec="aac-legacy", transcode=None, keep_original=True, key=None,
+               retries=0, resumed=False, finished=()):
+        if not self.gamdl_cmd:
+            raise EngineError("Gamdl not found in PATH! Install it via pip.")
+        # One profile name or several (older journals and watch lists hold a single name)
+        transcode = [transcode] if isinstance(transcode, str) else list(transcode or ())
+        unknown = [p for p in transcode if p not in TRANSCODE_PROFILES]
+        if unknown:
+            raise EngineError(f"Unknown output format: {', '.join(unknown)}")
+        if transcode and not self.transcoder.available:
+            raise EngineError("FFmpeg not found in PATH! It is needed for transcoding.")
+
+        target = Path(target).resolve()  # gamdl runs in base_dir
+        try:
+            target.mkdir(parents=True, exist_ok=True)
+        except Exception as e:
+            raise EngineError(f"Folder creation error: {e}")
+
+        cookie_file = self._cookie_file(cookies)
+        problems = cookie_file.problems()
+        cookie_path = Path(cookies).resolve().as_posix()
+
+        # The same link (however it is spelled) with the same settings is only queued once
+        identity = (url_key(url) or url.strip(), str(target), codec, tuple(transcode))
+        with self._submit_lock:
+            existing = self._queued.get(identity)
+            if existing is not None and not existing.finished:
+                self.emit(EVENT_MESSAGE, existing, (f"Already queued: {url}", "INFO"))
+                return existing
+
+            job_id = next(self._job_ids)
+            job = Job(job_id, url, target, codec, cookie_path, self._config_file(codec, cookie_path),
+                      key=key)
+            job.transcode = transcode
+            job.keep_original = keep_original
+            job.retries = retries
+            job.resumed = resumed
+            job.finished_files.update(os.path.normpath(os.path.join(target, path)) for path in finished)
+            job.identity = identity
+            self._queued[identity] = job
+        if self.journal:
+            self.journal.write(job.key, "queued", url=url, target=str(target), cookies=cookie_path, codec=codec,
+                               transcode=transcode, keep_original=keep_original, retries=retries,
+                               tracks=sorted(os.path.relpath(p, target) for p in job.finished_files))
+            self._journaled[job.key] = JOB_QUEUED
+        if self.logs:
+            self.logs.start_job(job.key, url)
+        self.queue.add(job)
+
+        # Cookie problems are reported once per file version, before gamdl is launched
+        seen = (cookie_file.mtime, tuple(level for level, _ in problems))
+        with self._submit_lock:
+            report = self._cookies_checked.get(cookie_path) != seen
+            self._cookies_checked[cookie_path] = seen
+        if report:
+            for level, text in problems:
+                self.emit(EVENT_MESSAGE, job, (text, level))
+        return job
+
+    def check_cookies(self, cookies):
+        # Preflight: [(level, text)] about the Apple Music auth cookies; EngineError when unusable
+        return self._cookie_file(cookies).problems()
+
+    @staticmethod
+    def _cookie_file(cookies):
+        if not cookies or not os.path.exists(cookies):
+            raise EngineError("Cookies file not found!")
+        try:
+            return load_cookies(cookies)
+        except CookieFileError as e:
+            raise EngineError(str(e))
+
+    def resume(self):
+        # Queues the jobs an earlier run left unfinished. The files their tracks were finished in
+        # are taken over (see _adopt_finished), and albums and playlists are narrowed to the tracks
+        # still missing when they start (see _plan). Returns (jobs, [(url, error), ...]).
+        if not self.journal: return [], []
+        jobs, errors = [], []
+        for entry in self.journal.unfinished():
+            try:
+                job = self.submit(entry["url"], entry["target"], entry["cookies"], entry["codec"],
+                                  entry.get("transcode"), entry.get("keep_original", True), key=entry["job"],
+                                  retries=entry["retries"], resumed=True, finished=entry["tracks"])
+                if job.key != entry["job"]:
+                    # A duplicate of a job already resumed
+                    self.journal.write(entry["job"], "skipped")
+                else:
+                    jobs.append(job)
+            except EngineError as e:
+                self.journal.write(entry["job"], "failed", error=str(e))
+                errors.append((entry["url"], str(e)))
+        return jobs, errors
+
+    def close(self):
+        # gamdl runs in process groups of its own, so running trees are killed here rather than
+        # left behind. Their jobs keep no final journal record and are resumed on the next start.
+        self.closing = True
+        self.loop_thread.submit(self._interrupt()).result(2 * KILL_GRACE + 5)
+        if self.worker_pool:
+            self.loop_thread.submit(self.worker_pool.close()).result(10)
+        self.loop_thread.stop()
+        for library in self._libraries.values():
+            library.close()
+        for index in self._dedups.values():
+            index.close()
+        self.verifier.close()
+        if self.journal:
+            self.journal.close()
+        if self.logs:
+            self.logs.close()
+
+    async def _interrupt(self):
+        jobs = [job for job in self.jobs if not job.finished]
+        for job in jobs:
+            job.cancelled = True  # Nothing new is launched for them
+        for _ in range(2):  # Again for runs that were being launched during the first round
+            procs = [job.proc for job in jobs if job.proc is not None and job.proc.returncode is None]
+            for job in jobs:
+                if job.proc is not None: job.killed = job.killed or "shutdown"
+            await asyncio.gather(*(kill_tree(proc) for proc in procs), return_exceptions=True)
+            await asyncio.sleep(0.1)
+        if self.journal:
+            for job in jobs:
+                if job.parent is None: self.journal.write(job.key, "interrupted")
+
+    def library_for(self, target):
+        # One index per download folder, stored inside it
+        key = str(Path(target).resolve())
+        with self._libraries_lock:
+            if key not in self._libraries:
+                self._libraries[key] = LibraryIndex(key)
+            return self._libraries[key]
+
+    def dedup_for(self, target):
+        # Same as library_for, for the content dedup index
+        key = str(Path(target).resolve())
+        with self._libraries_lock:
+            if key not in self._dedups:
+                self._dedups[key] = DedupIndex(key)
+            return self._dedups[key]
+
+    def _config_file(self, codec, cookie_path):
+        # Rendered and written once per distinct settings, then reused by every job
+        content = render_config(codec, cookie_path)
+        path = self.configs_dir / f"config_{hashlib.sha1(content.encode()).hexdigest()[:12]}.ini"
+        if path not in self._configs:
+            self.configs_dir.mkdir(parents=True, exist_ok=True)
+            if not path.exists():
+                tmp = path.with_suffix(".tmp")
+                tmp.write_text(content, encoding="utf-8")
+                os.replace(tmp, path)
+            self._configs.add(path)
+        return path
+
+    def join(self, timeout=None):
+        # Blocks until every submitted job has finished
+        with self._idle:
+            return self._idle.wait_for(lambda: not self.queue.active_count(), timeout)
+
+    def _on_job_changed(self, job):
+        if job.finished and job.identity:
+            with self._submit_lock:
+                if self._queued.get(job.identity) is job: del self._queued[job.identity]
+        # Shards aren't journaled: a resumed split job splits what is still missing again
+        if self.journal and job.parent is None and not self.closing and self._journaled.get(job.key) != job.state:
+            self._journaled[job.key] = job.state
+            self.journal.write(job.key, job.state.lower(), retries=job.retries, returncode=job.returncode)
+            if job.finished: del self._journaled[job.key]
+        self.emit(EVENT_JOB, job)
+        if job.parent:
+            self._update_parent(job.parent)
+        if job.finished:
+            with self._idle:
+                self._idle.notify_all()
+
+    def _store_log(self, event, job, data):
+        if event == EVENT_LINE:
+            self.logs.write(job.key, data.text, data.level == "ERROR")
+        elif event == EVENT_MESSAGE:
+            self.logs.write(job.key, f"[{data[1]}] {data[0]}", data[1] == "ERROR")
+        elif event == EVENT_JOB and job.state != JOB_RUNNING:
+            self.logs.flush(job.key)  # Whatever the job printed becomes searchable now
+
+    def _gamdl_args(self, job):
+        staging = ["--temp-path", str(job.staging)] if job.staging else []
+        return ["--config-path", str(job.config_file), "--cookies-path", job.cookies,
+                "--output-path", str(job.output_dir or job.target), *staging, *job.urls]
+
+    async def _run_process(self, job):
+        on_line = lambda line: self._on_output(job, line.strip())
+        try:
+            if self.skip_existing and await self._in_library(job):
+                return self._skip(job, "Already in library, skipped")
+            if job.cancelled: return -1
+            if job.parent is None and await self._plan(job):
+                # Done when its shards are; they download, verify and dedup on their own
+                job.pending.append(asyncio.ensure_future(self._await_shards(job)))
+                return 0
+            if job.tracks == []:
+                return self._skip(job, "No tracks missing, skipped")
+
+            await self.bucket.acquire()
+            if job.cancelled: return -1
+            try:
+                reservation = await asyncio.get_running_loop().run_in_executor(None, self._reserve_space, job)
+            except InsufficientSpace as e:
+                self.emit(EVENT_MESSAGE, job, (f"Not started, not enough free space: {e}", "ERROR"))
+                return -1
+            if job.cancelled:  # While the catalog was asked
+                self.space.release(reservation)
+                return -1
+
+            job.killed = None
+            job.last_progress = time.monotonic()
+            if self.staging_dir:
+                job.staging = self.staging_dir / job.key
+                job.staging.mkdir(parents=True, exist_ok=True)
+            watchdog = asyncio.ensure_future(self._supervise(job))
+            try:
+                returncode = None
+                if self.persistent and self.worker_pool and self.worker_pool.available:
+                    returncode = await self._run_in_worker(job, on_line)
+                if returncode is None:
+                    returncode = await self._run_subprocess(job, on_line)
+            finally:
+                watchdog.cancel()
+                self.space.release(reservation)
+                if job.staging:
+                    # Whatever a failed or killed run left behind
+                    await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, job.staging, True)
+                    job.staging = None
+
+            if returncode == 0:
+                job.progress = 100.0
+            elif not (job.killed or job.cancelled):  # The supervisor already said why
+                self.emit(EVENT_MESSAGE, job, (f"Code: {returncode}", "ERROR"))
+            # Even a failed run may have finished some tracks
+            if job.output_dir:
+                await self._publish(job)
+            await self._update_library(job)
+            if self.verify and returncode == 0:
+                job.pending.append(asyncio.ensure_future(self._verify(job, list(job.pending))))
+            if self.dedup and returncode == 0:
+                job.pending.append(asyncio.ensure_future(self._dedup(job, list(job.pending))))
+            return returncode
+
+        except Exception as e:
+            self.emit(EVENT_MESSAGE, job, (f"Launch error: {e}", "ERROR"))
+            return -1
+
+    def _skip(self, job, text):
+        job.progress = 100.0
+        job.state = JOB_SKIPPED
+        self.emit(EVENT_MESSAGE, job, (text, "INFO"))
+        return 0
+
+    def _reserve_space(self, job):
+        # In an executor: the estimate may ask the catalog. Returns a reservation or None.
+        if not self.space_check: return None
+        parsed = parse_url(job.url)
+        library = self.library_for(job.target) if self.skip_existing else None
+        catalog = self._catalog(job) if parsed and parsed.kind in ("album", "playlist") else None
+        try:
+            estimate = estimate_size(parsed, job.codec, job.transcode, catalog, library, job.tracks)
+        except CatalogError as e:
+            self._catalog_failed(job, f"Track list unavailable, size guessed ({e})")
+            estimate = estimate_size(parsed, job.codec, job.transcode, None, library)
+        if estimate is None: return None
+        temp = self.staging_dir or self.base_dir
+        return self.space.reserve({job.target: estimate.total, temp: estimate.largest * INTERMEDIATE_COPIES})
+
+    def _catalog(self, job):
+        # One client per cookies file; None for a while after a failed lookup
+        if time.monotonic() < self._catalog_down_until: return None
+        catalog = self._catalogs.get(job.cookies)
+        if catalog is None:
+            catalog = self._catalogs[job.cookies] = CatalogClient(job.cookies, self.base_dir)
+        return catalog
+
+    def _catalog_failed(self, job, message):
+        self._catalog_down_until = time.monotonic() + CATALOG_BACKOFF
+        self.emit(EVENT_MESSAGE, job, (message, "WARNING"))
+
+    async def _in_library(self, job):
+        parsed = parse_url(job.url)
+        track = song_id(parsed)
+        if track is None and (parsed is None or parsed.kind != "album"):
+            return False
+
+        def check():
+            library = self.library_for(job.target)
+            library.ensure_scanned()
+            return library.has_track(track) if track else library.album_complete(parsed.id)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, check)
+        except Exception as e:
+            self.emit(EVENT_MESSAGE, job, (f"Library index unavailable: {e}", "WARNING"))
+            return False
+
+    async def _update_library(self, job):
+        # Only the files the job wrote; whole folders are scanned by --scan, on resume and after
+        # plain gamdl runs whose files weren't observed
+        if not self.skip_existing: return
+        library = self.library_for(job.target)
+        try:
+            if job.unobserved:
+                await asyncio.get_running_loop().run_in_executor(None, library.scan)
+            elif job.outputs:
+                await asyncio.get_running_loop().run_in_executor(None, library.update, sorted(job.outputs))
+        except Exception as e:
+            self.emit(EVENT_MESSAGE, job, (f"Library index update failed: {e}", "WARNING"))
+
+    def _retry_delay(self, job):
+        # Stalled runs come back like transient failures; timed out ones would only time out again
+        policy = self.retry_policy
+        stalled = job.killed == "stalled"
+        if self.closing or job.killed == "timeout" or job.retries >= policy.max_retries or not (stalled or policy.is_transient(job)):
+            return None
+        delay = policy.delay(job.retries)
+        if stalled:
+            self.restarted += 1
+        reason = "Stalled" if stalled else "Transient failure"
+        self.emit(EVENT_MESSAGE, job, (f"{reason}, retrying in {delay:.0f}s "
+                                       f"(attempt {job.retries + 1} of {policy.max_retries})", "WARNING"))
+        job.tail.clear()
+        job.album = AlbumProgress()
+        return delay
+
+    # --- Sharding ------------------------------------------------------------------
+    async def _plan(self, job):
+        # Asks the catalog once which tracks of an album or playlist are still missing. The space
+        # check reuses the answer (job.tracks). With enough of them the job is split into shards
+        # of track links, at most one per download slot, queued as jobs of their own: True.
+        # When only some are missing (a resumed or retried job, an album downloaded in part),
+        # gamdl gets just their links instead of checking every track on disk again.
+        job.tracks, job.urls = None, [job.url]
+        if not (self.shard_tracks or self.space_check or self.skip_existing): return False
+        parsed = parse_url(job.url)
+        if parsed is None or parsed.kind not in ("album", "playlist") or parsed.track_id: return False
+        catalog = self._catalog(job)
+        if catalog is None: return False
+        library = self.library_for(job.target) if self.skip_existing else None
+
+        def lookup():
+            if library and job.resumed:
+                library.scan()
+                job.resumed = False
+            storefront, tracks, total = missing_tracks(parsed, catalog, library)
+            if job.finished_files:  # Also without the library index (--no-skip)
+                done = {read_tags(path).get("catalog_id") for path in job.finished_files}
+                tracks = [t for t in tracks if t.id not in done]
+            return storefront, tracks, total
+
+        try:
+            storefront, tracks, total = await asyncio.get_running_loop().run_in_executor(None, lookup)
+        except CatalogError as e:
+            effects = [what for what, on in (("not split", self.shard_tracks), ("size guessed", self.space_check)) if on]
+            self._catalog_failed(job, f"Track list unavailable, {' and '.join(effects)} ({e})")
+            return False
+        job.tracks = tracks
+        count = min(self.concurrency.ceiling, len(tracks) // self.shard_tracks) if self.shard_tracks else 0
+        if count < 2 or job.cancelled:
+            if 0 < len(tracks) < total:
+                job.urls = [track_link(storefront, t) for t in tracks]
+                self.emit(EVENT_MESSAGE, job, (f"{len(tracks)} of {total} track(s) missing, downloading those", "INFO"))
+            return False
+
+        # Contiguous runs of the catalog order; the files land in the same album folders
+        bounds = [len(tracks) * i // count for i in range(count + 1)]
+        for i in range(count):
+            shard = Job(next(self._job_ids), job.url, job.target, job.codec, job.cookies, job.config_file)
+            shard.parent, shard.shard = job, (i + 1, count)
+            shard.tracks = tracks[bounds[i]:bounds[i + 1]]
+            shard.urls = [track_link(storefront, t) for t in shard.tracks]
+            shard.transcode, shard.keep_original = job.transcode, job.keep_original
+            job.shards.append(shard)
+        job.shards_done = asyncio.Event()
+        self.emit(EVENT_MESSAGE, job, (f"{len(tracks)} track(s) to download, split into {count} shards", "INFO"))
+        for shard in job.shards:
+            if self.logs:
+                self.logs.start_job(shard.key, shard.label)
+            self.queue.add(shard)
+        return True
+
+    async def _await_shards(self, job):
+        await job.shards_done.wait()
+        failed = sum(1 for s in job.shards if s.state not in (JOB_DONE, JOB_SKIPPED))
+        if failed:
+            self.emit(EVENT_MESSAGE, job, (f"{failed} of {len(job.shards)} shard(s) not completed", "ERROR"))
+        return not failed
+
+    def _update_parent(self, job):
+        # A split job's progress is the mean of its shards'
+        if job.finished or not job.shards: return
+        if all(s.finished for s in job.shards):
+            job.shards_done.set()
+        progress = sum(100.0 if s.finished else s.progress for s in job.shards) / len(job.shards)
+        if int(progress) != int(job.progress):
+            job.progress = progress
+            self.emit(EVENT_JOB, job)
+
+    # --- Supervision ---------------------------------------------------------------
+    async def _supervise(self, job):
+        # Runs next to every gamdl run: enforces the wall-clock limit and the stall watchdog
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            if job.proc is None or job.killed: continue
+            if job.cancelled:
+                self._kill(job, "cancelled")
+                continue
+            now = time.monotonic()
+            if self.job_timeout and now - started > self.job_timeout:
+                self._kill(job, "timeout")
+            elif self.stall_timeout and now - job.last_progress > self.stall_timeout:
+                self._kill(job, "stalled")
+
+    def _kill(self, job, reason):
+        # On the loop. The run ends with a negative code; the queue decides what comes next.
+        proc = job.proc
+        if proc is None or proc.returncode is not None or job.killed: return
+        job.killed = reason
+        self.killed += 1
+        if reason == "timeout":
+            self.emit(EVENT_MESSAGE, job, (f"Timed out after {format_eta(self.job_timeout)}, killed", "ERROR"))
+        elif reason == "stalled":
+            self.emit(EVENT_MESSAGE, job, (f"No progress for {self.stall_timeout:.0f}s, killed", "WARNING"))
+        else:
+            self.emit(EVENT_MESSAGE, job, ("Cancelled, stopping gamdl", "WARNING"))
+        asyncio.ensure_future(kill_tree(proc))
+
+    # --- Adaptive concurrency -----------------------------------------------------
+    def _adapt(self, job, limit):
+        if limit is None: return
+        lowered = limit < self.queue.max_workers
+        self._apply_limit(limit)
+        if lowered:
+            self.emit(EVENT_MESSAGE, job, (f"Throttling detected, parallel downloads reduced to {limit}", "WARNING"))
+        else:
+            self.emit(EVENT_MESSAGE, job, (f"Downloads healthy, parallel downloads raised to {limit}", "INFO"))
+
+    def _apply_limit(self, limit):
+        # The launch rate follows the same cuts, so a cut also spaces out new sessions
+        self.queue.set_workers(limit)
+        self.bucket.set_rate(self.rate_limit * limit / self.concurrency.ceiling)
+
+    # --- Job outputs ---------------------------------------------------------------
+    # Several jobs can write into the same folder at once, so a job only ever converts,
+    # verifies or removes the files it wrote itself. Through the worker script every move out
+    # of gamdl's temp folder is reported as it happens. Plain gamdl writes into a hidden folder
+    # of the job's own instead, merged into the target when it exits (gamdl can't skip tracks
+    # already in the target that way, and conversions wait until the end).
+
+    def _on_written(self, job, path):
+        # gamdl finished a file: it is complete, so it can be converted right away
+        path = os.path.abspath(path)
+        if not path.startswith(os.path.join(str(job.target), "")): return
+        job.outputs.add(path)
+        top = job.parent or job
+        if self.journal:  # Resumed jobs take these over instead of downloading them
+            self.journal.write(top.key, "track", path=os.path.relpath(path, top.target))
+        if job.transcode and os.path.splitext(path)[1].lower() in TRANSCODE_SOURCES and path not in self._converting:
+            self._converting.add(path)
+            job.pending.append(asyncio.ensure_future(self._transcode_file(job, path)))
+
+    def _private_output(self, job):
+        job.output_dir = job.target / f".ams-{job.key}"
+        shutil.rmtree(job.output_dir, ignore_errors=True)  # Left by a crashed run
+        job.output_dir.mkdir(parents=True)
+
+    async def _adopt_finished(self, job):
+        # Right before gamdl starts. The files an interrupted earlier run (or an earlier attempt)
+        # of the job finished count as its outputs. gamdl skips them as long as it can see them
+        # (overwrite = false), so a private output folder gets hard links to them; conversions
+        # that didn't get written are started again.
+        if not (job.finished_files or job.output_dir and job.outputs): return
+        inside = os.path.join(str(job.target), "")
+        candidates = sorted(p for p in job.finished_files | job.outputs if p.startswith(inside))
+        outputs = set(job.outputs)
+
+        def adopt():
+            found, convert = [], []
+            for path in candidates:
+                if not os.path.isfile(path): continue
+                if job.output_dir:
+                    link = job.output_dir / os.path.relpath(path, job.target)
+                    try:
+                        link.parent.mkdir(parents=True, exist_ok=True)
+                        os.link(path, link)
+                    except OSError:
+                        pass  # gamdl downloads it again
+                if path in outputs: continue
+                found.append(path)
+                if os.path.splitext(path)[1].lower() in TRANSCODE_SOURCES and not all(
+                        self.transcoder.output_path(Path(path), p, job.target).exists() for p in job.transcode):
+                    convert.append(path)
+            return found, convert
+
+        found, convert = await asyncio.get_running_loop().run_in_executor(None, adopt)
+        job.outputs.update(found)
+        for path in convert:
+            if path not in self._converting:
+                self._converting.add(path)
+                job.pending.append(asyncio.ensure_future(self._transcode_file(job, path)))
+
+    async def _publish(self, job):
+        # Moves a plain gamdl run's files from its private folder into the target
+        def merge():
+            moved = []
+            for folder, _, files in os.walk(job.output_dir):
+                relative = os.path.relpath(folder, job.output_dir)
+                for name in files:
+                    src = os.path.join(folder, name)
+                    dst = os.path.normpath(os.path.join(job.target, relative, name))
+                    if os.path.exists(dst) and os.path.samefile(src, dst):
+                        os.unlink(src)  # Linked in by _adopt_finished, gamdl left it alone
+                        continue
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    os.replace(src, dst)
+                    moved.append(dst)
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+            return moved
+
+        try:
+            moved = await asyncio.get_running_loop().run_in_executor(None, merge)
+        except OSError as e:
+            self.emit(EVENT_MESSAGE, job, (f"Files not moved out of {job.output_dir.name}: {e}", "ERROR"))
+            return
+        finally:
+            job.output_dir = None
+        for path in moved:
+            self._on_written(job, path)
+
+    # --- Transcoding -------------------------------------------------------------
+    async def _transcode_file(self, job, src):
+        # Fans one downloaded track out to every selected profile, all encoded in parallel
+        try:
+            return await self._transcode_outputs(job, src)
+        finally:
+            self._converting.discard(src)
+
+    async def _transcode_outputs(self, job, src):
+        loop = asyncio.get_running_loop()
+        name = os.path.basename(src)
+        try:
+            tags = await loop.run_in_executor(None, read_tags, src) if self.skip_existing else None
+        except OSError as e:
+            self.emit(EVENT_MESSAGE, job, (f"Transcode failed: {name}: {e}", "ERROR"))
+            return False
+        results = await asyncio.gather(*(self.transcoder.transcode(src, p, True, job.target) for p in job.transcode),
+                                       return_exceptions=True)
+
+        ok = True
+        for profile, result in zip(job.transcode, results):
+            label = TRANSCODE_PROFILES[profile]["label"]
+            if isinstance(result, (TranscodeError, OSError)):
+                self.emit(EVENT_MESSAGE, job, (f"Transcode failed: {name} ({label}): {result}", "ERROR"))
+                ok = False
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            job.outputs.add(str(result))
+            try:
+                if tags:
+                    await loop.run_in_executor(None, self.library_for(job.target).add, result, tags)
+            except OSError as e:
+                self.emit(EVENT_MESSAGE, job, (f"Library index update failed: {e}", "WARNING"))
+            self.emit(EVENT_MESSAGE, job, (f"Transcoded: {result.name} ({label})", "INFO"))
+
+        # The original goes only once every format has been written, and only if no other
+        # running job wrote the same file (the same track through another link)
+        shared = any(src in j.outputs for j in self.jobs if j is not job and not j.finished)
+        if ok and not job.keep_original and src in job.outputs and not shared:
+            try:
+                os.unlink(src)
+            except OSError as e:
+                self.emit(EVENT_MESSAGE, job, (f"Original not removed: {name}: {e}", "WARNING"))
+            else:
+                job.outputs.discard(src)
+                if self.skip_existing:
+                    await loop.run_in_executor(None, self.library_for(job.target).update, [src])
+        return ok
+
+    # --- Verification ------------------------------------------------------------
+    async def _verify(self, job, transcodes):
+        # After the job's conversions, so their outputs are checked too. A damaged file fails the job.
+        await asyncio.gather(*transcodes, return_exceptions=True)
+        try:
+            report = await asyncio.get_running_loop().run_in_executor(None, self.verifier.verify_files,
+                                                                      sorted(job.outputs))
+        except Exception as e:
+            self.emit(EVENT_MESSAGE, job, (f"Verification not possible: {e}", "WARNING"))
+            return True
+        for path, error in report.bad:
+            self.emit(EVENT_MESSAGE, job, (f"Damaged file: {os.path.relpath(path, job.target)}: {error}", "ERROR"))
+        if report.checked:
+            how = "" if self.verifier.ffprobe else " (checksums only, ffprobe not found)"
+            self.emit(EVENT_MESSAGE, job, (f"Verified {report.checked - len(report.bad)} of {report.checked} "
+                                           f"file(s){how}", "ERROR" if report.bad else "INFO"))
+        return not report.bad
+
+    # --- Dedup -------------------------------------------------------------------
+    async def _dedup(self, job, transcodes):
+        # Runs after the job's conversions, so their outputs are included. Only the files the job
+        # wrote are matched against the folder's index. Never fails the job.
+        await asyncio.gather(*transcodes, return_exceptions=True)
+        if not (job.outputs or job.unobserved): return True
+        try:
+            paths = None if job.unobserved else sorted(job.outputs)
+            report = await asyncio.get_running_loop().run_in_executor(None, self.dedup_for(job.target).run, paths)
+        except Exception as e:
+            self.emit(EVENT_MESSAGE, job, (f"Dedup failed: {e}", "WARNING"))
+            return True
+        if report.linked:
+            self.emit(EVENT_MESSAGE, job, (f"Dedup: {report.linked} duplicate(s) linked, "
+                                           f"{report.reclaimed / 2 ** 20:.1f} MB reclaimed "
+                                           f"({report.total_reclaimed / 2 ** 20:.1f} MB in this folder)", "INFO"))
+        return True
+
+    async def _run_subprocess(self, job, on_line):
+        # gamdl runs through the worker script when it can: its moves into the album folders
+        # are atomic and reported (see _on_written)
+        wrapped = bool(self.worker_pool and self.worker_pool.available)
+        cmd = [*self.worker_pool.cmd, "--run"] if wrapped else self.gamdl_cmd
+        if not wrapped and (job.transcode or self.verify):
+            await asyncio.get_running_loop().run_in_executor(None, self._private_output, job)
+        job.unobserved = not wrapped and job.output_dir is None
+        await self._adopt_finished(job)
+        if job.cancelled: return -1
+        unavailable = []
+
+        def relay(line):
+            if not line.startswith(CONTROL_PREFIX):
+                on_line(line)
+                return
+            msg = json.loads(line[len(CONTROL_PREFIX):])
+            if msg.get("event") == "moved":
+                self._on_written(job, msg["path"])
+            else:
+                unavailable.append(msg)  # The script couldn't load gamdl
+
+        proc = await asyncio.create_subprocess_exec(*cmd, *self._gamdl_args(job),
+                                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                    stdin=subprocess.DEVNULL, cwd=self.base_dir,
+                                                    env=process_env(), **popen_kwargs(group=True))
+        job.proc = proc
+        if job.cancelled:  # Cancelled while it was being launched
+            self._kill(job, "cancelled")
+        try:
+            await stream_lines(proc.stdout, relay)
+            returncode = await proc.wait()
+        finally:
+            job.proc = None
+        if unavailable and not job.killed:
+            if self.worker_pool.available:  # Said once, not by every job that tried at the same time
+                self.worker_pool.available = False
+                self.emit(EVENT_MESSAGE, job, ("gamdl can't be loaded by the worker script, moves out of the temp "
+                                               "folder are not atomic", "WARNING"))
+            return await self._run_subprocess(job, on_line)
+        return returncode
+
+    async def _run_in_worker(self, job, on_line):
+        try:
+            worker = await self.worker_pool.acquire()
+        except WorkerUnavailable as e:
+            self.emit(EVENT_MESSAGE, job, (f"Persistent gamdl worker unavailable ({e}), "
+                                           f"starting one gamdl process per job", "WARNING"))
+            return None
+
+        if job.cancelled:  # Cancelled while the worker was starting: it stays warm for the next job
+            await self.worker_pool.release(worker, keep=self.queue.max_workers)
+            return -1
+        job.proc = worker.proc  # Cancelling the job kills the worker; a fresh one takes its place
+        try:
+            await self._adopt_finished(job)
+            return await worker.run(job.id, self._gamdl_args(job), on_line, lambda path: self._on_written(job, path))
+        finally:
+            job.proc = None
+            await self.worker_pool.release(worker, keep=self.queue.max_workers)
+
+    def _on_output(self, job, line):
+        if not line: return
+        parsed = self.parser.parse(line)
+
+        if parsed.kind != "download":
+            job.tail.append(parsed.text)
+            if parsed.level in ("WARNING", "ERROR") or (parsed.level is None and parsed.kind is None):
+                self._adapt(job, self.concurrency.observe(parsed.text, parsed.level))
+
+        if parsed.events:
+            job.last_progress = time.monotonic()
+            track = job.album.index
+            job.album.update(parsed.events)
+            if job.album.index != track and track:
+                self._adapt(job, self.concurrency.track_done())
+            percent = job.album.percent
+            changed = int(percent) != int(job.progress)
+            job.progress = percent
+            # Only report progress when the visible percentage actually changes
+            if changed:
+                self.emit(EVENT_JOB, job)
+                if job.parent:
+                    self._update_parent(job.parent)
+
+        self.emit(EVENT_LINE, job, parsed)
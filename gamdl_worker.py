@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import errno
+import shutil
+import logging
+import traceback
+from importlib import metadata
+
+# Long-lived gamdl worker. Loads gamdl once, then runs jobs sent by the engine as JSON lines on
+# stdin ({"id": 1, "args": [...]}). gamdl output goes to stdout as usual; control messages are
+# single lines starting with CONTROL_PREFIX. The worker exits after --max-jobs jobs or after a
+# failed job, and the engine starts a fresh one. Every file gamdl moves into place is reported
+# with a "moved" message, so the engine knows which files a job wrote.
+#   python gamdl_worker.py --max-jobs 50
+#   python gamdl_worker.py --run <gamdl arguments>   (one job, exit code and output as gamdl's)
+
+CONTROL_PREFIX = "\x1eAMS:"
+
+
+def send(**msg):
+    # Leading newline so a control message never shares a line with unterminated output
+    sys.stdout.write("\n" + CONTROL_PREFIX + json.dumps(msg) + "\n")
+    sys.stdout.flush()
+
+
+def load_gamdl():
+    # The console script entry point works across gamdl versions (a click command in 2.x)
+    for ep in metadata.entry_points(group="console_scripts"):
+        if ep.name == "gamdl":
+            return ep.load(), sys.modules.get(ep.module)
+    raise ImportError("gamdl entry point not found")
+
+
+def keep_sessions_warm(module):
+    # API clients are created on every invocation, paying for token scraping and auth each time.
+    # Reuse one instance per set of constructor arguments for as long as this worker lives.
+    if module is None: return
+    for name, obj in list(vars(module).items()):
+        if isinstance(obj, type) and name.endswith("Api"):
+            setattr(module, name, cached_class(obj))
+
+
+def cached_class(cls):
+    instances = {}
+
+    class Cached(cls):
+        def __new__(klass, *args, **kwargs):
+            key = repr((args, sorted(kwargs.items())))
+            if key not in instances:
+                if cls.__new__ is object.__new__:
+                    instance = object.__new__(klass)
+                else:
+                    instance = super().__new__(klass, *args, **kwargs)
+                cls.__init__(instance, *args, **kwargs)
+                instances[key] = instance
+            return instances[key]
+
+        def __init__(self, *args, **kwargs):
+            pass  # Initialised once in __new__
+
+    Cached.__name__ = cls.__name__
+    Cached.__qualname__ = cls.__qualname__
+    return Cached
+
+
+def atomic_move(src, dst, copy_function=shutil.copy2, _move=shutil.move):
+    # gamdl moves finished tracks out of its temp folder with shutil.move, which copies across
+    # filesystems under the final name: a crash mid-copy leaves a short file that looks done.
+    # Copy under a hidden name next to the target instead and rename it into place.
+    if os.path.isdir(src):
+        return _move(src, dst, copy_function)
+    dst = os.fspath(dst)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        part = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.part")
+        try:
+            copy_function(src, part)
+            os.replace(part, dst)
+        finally:
+            if os.path.exists(part): os.unlink(part)
+        os.unlink(src)
+    send(event="moved", path=os.path.abspath(dst))
+    return dst
+
+
+def reset_logging():
+    # gamdl configures logging on every run; drop the handlers of the previous job
+    for logger in [logging.getLogger()] + [logging.getLogger(n) for n in logging.root.manager.loggerDict]:
+        if isinstance(logger, logging.Logger):
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+
+
+def run_job(entry, args):
+    reset_logging()
+    try:
+        if hasattr(entry, "main"):
+            entry.main(args=args, prog_name="gamdl", standalone_mode=False)
+        else:
+            sys.argv = ["gamdl", *args]
+            entry()
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        return 1
+
+
+def main(argv):
+    max_jobs = int(argv[argv.index("--max-jobs") + 1]) if "--max-jobs" in argv else 0
+
+    # One stream for everything, so output and control messages stay in order
+    sys.stderr = sys.stdout
+    shutil.move = atomic_move
+    try:
+        entry, module = load_gamdl()
+        if argv[:1] != ["--run"]: keep_sessions_warm(module)
+    except Exception as e:
+        send(event="unavailable", error=f"{type(e).__name__}: {e}")
+        return 1
+    if argv[:1] == ["--run"]:
+        return run_job(entry, argv[1:])
+    send(event="ready")
+
+    done = 0
+    for raw in sys.stdin:
+        if not raw.strip(): continue
+        job = json.loads(raw)
+        returncode = run_job(entry, job["args"])
+        done += 1
+        send(event="done", id=job["id"], returncode=returncode)
+        if returncode != 0 or (max_jobs and done >= max_jobs):
+            break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
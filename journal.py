@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+
+# =================================================================================
+# JOB JOURNAL
+# =================================================================================
+# Append-only record of every job: one JSON line per state change and per finished track file.
+# Records are written and fsynced by a thread of their own, in batches, so callers on the
+# engine loop never wait for the disk. After a crash or restart the jobs without a final
+# record are handed back to the engine, with the files they had finished. The file is
+# compacted to those jobs when it is opened.
+#   {"t": 1700000000.0, "job": "3f2a...", "event": "queued", "url": "...", "target": "...", ...}
+#   {"t": ..., "job": "3f2a...", "event": "running", "retries": 0, "returncode": null}
+#   {"t": ..., "job": "3f2a...", "event": "track", "path": "Artist/Album/04 Title.m4a"}
+
+JOURNAL_FILE = "journal.jsonl"
+JOURNAL_FINAL = {"done", "failed", "skipped", "cancelled"}
+
+
+class JobJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._unfinished = self._load()
+        self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._queue = queue.SimpleQueue()  # Records, then None when closing
+        self._writer = threading.Thread(target=self._write_loop, name="journal", daemon=True)
+        self._writer.start()
+
+    def write(self, key, event, **fields):
+        # Any thread, returns at once
+        self._queue.put({"t": round(time.time(), 3), "job": key, "event": event, **fields})
+
+    def unfinished(self):
+        # Settings, finished track files (relative to the target) and retry count of every job
+        # left over from earlier runs. Handed out once: resumed jobs are journaled again under
+        # the same key.
+        with self._lock:
+            jobs, self._unfinished = self._unfinished, {}
+        return [{**{k: v for k, v in entry["queued"].items() if k not in ("t", "event")},
+                 "tracks": sorted(entry["tracks"]), "retries": entry["retries"]} for entry in jobs.values()]
+
+    def close(self):
+        # Whatever was written before is on disk when this returns
+        if not self._writer.is_alive(): return
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        # Everything queued while the last batch was synced goes out in the next one
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+            closing = None in batch
+            lines = [json.dumps(record) + "\n" for record in batch if record is not None]
+            try:
+                self._file.writelines(lines)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass  # A full or failing disk must not stop the downloads
+        self._file.close()
+
+    def _load(self):
+        jobs = {}
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return jobs
+        with f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue  # A line torn by a crash
+                key, event = record.get("job"), record.get("event")
+                if event == "queued":
+                    # Older journals counted tracks by number, which can't be taken over
+                    tracks = {t for t in record.get("tracks", ()) if isinstance(t, str)}
+                    jobs[key] = {"queued": record, "tracks": tracks, "retries": record.get("retries", 0),
+                                 "records": [record]}
+                elif key in jobs:
+                    if event in JOURNAL_FINAL:
+                        del jobs[key]
+                        continue
+                    entry = jobs[key]
+                    if event == "track":
+                        if not isinstance(record.get("path"), str): continue
+                        entry["tracks"].add(record["path"])
+                    entry["records"].append(record)
+                    entry["retries"] = max(entry["retries"], record.get("retries", 0))
+        return jobs
+
+    def _compact(self):
+        if not self.path.exists(): return
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in self._unfinished.values():
+                f.writelines(json.dumps(r) + "\n" for r in entry["records"])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
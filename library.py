@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+# =================================================================================
+# LIBRARY INDEX
+# =================================================================================
+# An on-disk index of the downloaded library, keyed by Apple Music catalog ID. It lets the
+# queue skip tracks that are already downloaded without asking gamdl (or the network),
+# no matter which folder template they were saved with.
+
+INDEX_NAME = ".ams_library.sqlite"
+AUDIO_EXTENSIONS = {".m4a", ".mp4", ".m4v", ".mp3"}
+MP4_EXTENSIONS = {".m4a", ".mp4", ".m4v"}
+SCAN_WORKERS = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    catalog_id TEXT,
+    album_id TEXT,
+    track_no INTEGER,
+    track_total INTEGER,
+    disc_no INTEGER,
+    disc_total INTEGER,
+    codec TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS tracks_catalog ON tracks (catalog_id);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+# =================================================================================
+# MP4 TAG READER
+# =================================================================================
+# Reads only box headers and the few iTunes atoms gamdl writes, without loading the file:
+# cnID (catalog ID), plID (album ID), trkn/disk (position) and the stsd sample type (codec).
+
+MP4_CONTAINERS = {b"moov", b"udta", b"ilst", b"trak", b"mdia", b"minf", b"stbl"}
+MP4_ITEMS = {b"cnID", b"plID", b"trkn", b"disk"}
+
+
+def read_mp4_tags(path):
+    tags = {}
+    with open(path, "rb") as f:
+        _walk_boxes(f, 0, os.fstat(f.fileno()).st_size, tags)
+    return tags
+
+
+def _walk_boxes(f, start, end, tags):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8: return
+        size, kind = struct.unpack(">I4s", header)
+        header_len = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_len = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_len: return
+        body = pos + header_len
+
+        if kind in MP4_CONTAINERS:
+            _walk_boxes(f, body, pos + size, tags)
+        elif kind == b"meta":
+            _walk_boxes(f, body + 4, pos + size, tags)  # Full box: skip version/flags
+        elif kind == b"stsd" and "codec" not in tags:
+            f.seek(body + 12)  # version/flags, entry count, first entry size
+            tags["codec"] = f.read(4).decode("latin-1").strip()
+        elif kind in MP4_ITEMS:
+            f.seek(body)
+            data = f.read(min(size - header_len, 32))
+            if len(data) > 16 and data[4:8] == b"data":
+                _read_item(kind, data[16:], tags)
+        pos += size
+
+
+def _read_item(kind, payload, tags):
+    if kind == b"cnID" and len(payload) >= 4:
+        tags["catalog_id"] = str(struct.unpack(">I", payload[:4])[0])
+    elif kind == b"plID" and len(payload) >= 8:
+        tags["album_id"] = str(struct.unpack(">Q", payload[:8])[0])
+    elif kind in (b"trkn", b"disk") and len(payload) >= 6:
+        number, total = struct.unpack(">HH", payload[2:6])
+        prefix = "track" if kind == b"trkn" else "disc"
+        tags[f"{prefix}_no"], tags[f"{prefix}_total"] = number, total
+
+
+def read_tags(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in MP4_EXTENSIONS:
+        return {"codec": ext.lstrip(".")}
+    try:
+        return read_mp4_tags(path)
+    except (OSError, struct.error):
+        return {}
+
+
+# =================================================================================
+# DIRECTORY SCAN
+# =================================================================================
+
+def _scan_dir(path, extensions=AUDIO_EXTENSIONS):
+    dirs, files = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."): continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in extensions:
+                    st = entry.stat()
+                    files.append((entry.path, st.st_size, st.st_mtime))
+    except OSError:
+        pass
+    return dirs, files
+
+
+def walk_files(root, pool, extensions=AUDIO_EXTENSIONS):
+    # Parallel directory walk: every directory listing is its own task
+    pending = {pool.submit(_scan_dir, str(root), extensions)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            dirs, files = future.result()
+            pending.update(pool.submit(_scan_dir, d, extensions) for d in dirs)
+            yield from files
+
+
+class LibraryIndex:
+    def __init__(self, root, workers=SCAN_WORKERS):
+        self.root = Path(root)
+        self.path = self.root / INDEX_NAME
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)  # A watched folder may not exist before its first sync
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --- Lookups ---------------------------------------------------------------
+    def has_track(self, catalog_id):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM tracks WHERE catalog_id = ? LIMIT 1",
+                                    (str(catalog_id),)).fetchone() is not None
+
+    def album_complete(self, album_id):
+        # Every disc of the album has as many indexed tracks as its track total says
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT disc_no, MAX(disc_total), MAX(track_total), COUNT(DISTINCT track_no) "
+                "FROM tracks WHERE album_id = ? GROUP BY disc_no", (str(album_id),)).fetchall()
+        if not rows: return False
+        disc_total = max(r[1] or 1 for r in rows)
+        return len(rows) >= disc_total and all(r[2] and r[3] >= r[2] for r in rows)
+
+    def paths_for(self, catalog_ids):
+        ids = [str(i) for i in catalog_ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                query = f"SELECT catalog_id, path FROM tracks WHERE catalog_id IN ({','.join('?' * len(chunk))})"
+                found.update(self._db.execute(query, chunk).fetchall())
+        return found
+
+    @property
+    def scanned(self):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM meta WHERE key = 'scanned'").fetchone() is not None
+
+    # --- Updates ---------------------------------------------------------------
+    def scan(self):
+        # Incremental: only new or changed files (by size and mtime) have their tags read
+        with self._scan_lock:
+            with self._lock:
+                known = {p: (s, m) for p, s, m in self._db.execute("SELECT path, size, mtime FROM tracks")}
+
+            seen, changed = set(), []
+            with ThreadPoolExecutor(self.workers) as pool:
+                for path, size, mtime in walk_files(self.root, pool):
+                    seen.add(path)
+                    if known.get(path) != (size, mtime):
+                        changed.append((path, size, mtime))
+                tags = list(pool.map(read_tags, [c[0] for c in changed]))
+            removed = known.keys() - seen
+            self._store(changed, tags, removed, scanned=True)
+            return len(changed), len(removed)
+
+    def update(self, paths):
+        # Index just these files (a job's outputs) without walking the folder; the ones that
+        # are gone are dropped
+        changed, removed = [], []
+        for path in paths:
+            path = os.path.abspath(path)
+            name = os.path.basename(path)
+            if name.startswith(".") or os.path.splitext(name)[1].lower() not in AUDIO_EXTENSIONS: continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                removed.append(path)
+                continue
+            changed.append((path, st.st_size, st.st_mtime))
+        with self._scan_lock:
+            self._store(changed, [read_tags(c[0]) for c in changed], removed)
+        return len(changed), len(removed)
+
+    def _store(self, changed, tags, removed, scanned=False):
+        rows = [(path, t.get("catalog_id"), t.get("album_id"), t.get("track_no"), t.get("track_total"),
+                 t.get("disc_no"), t.get("disc_total"), t.get("codec"), size, mtime)
+                for (path, size, mtime), t in zip(changed, tags)]
+        # Files without readable IDs (mp3s) keep the IDs they were indexed with by add()
+        tagged = [r for r in rows if r[1]]
+        untagged = [r for r in rows if not r[1]]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", tagged)
+            self._db.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(path) "
+                                 "DO UPDATE SET codec = excluded.codec, size = excluded.size, "
+                                 "mtime = excluded.mtime", untagged)
+            self._db.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in removed])
+            if scanned:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('scanned', '1')")
+
+    def add(self, path, tags):
+        # Index a file under tags read elsewhere (e.g. an mp3 transcoded from a tagged m4a, whose
+        # own ID3 tags carry no catalog ID). Later scans keep the row while size and mtime match.
+        st = os.stat(path)
+        row = (str(path), tags.get("catalog_id"), tags.get("album_id"), tags.get("track_no"),
+               tags.get("track_total"), tags.get("disc_no"), tags.get("disc_total"),
+               read_tags(path).get("codec"), st.st_size, st.st_mtime)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def ensure_scanned(self):
+        if not self.scanned:
+            self.scan()
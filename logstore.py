@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import threading
+from pathlib import Path
+
+# =================================================================================
+# LOG STORE
+# =================================================================================
+# Output of every job, kept across sessions in a size-capped directory of gzip segments
+# (logs/ams-000001.log.gz, ...). Each job's lines are buffered and written as one gzip member
+# per chunk, so a segment is a normal .gz file (zcat works) and every chunk can also be read
+# on its own: index.sqlite maps job -> (segment, offset, length) of its chunks. Searching
+# decompresses one chunk at a time and only the chunks that can match.
+
+LOG_INDEX = "index.sqlite"
+SEGMENT_PATTERN = re.compile(r"^ams-(\d{6})\.log\.gz$")
+SEGMENT_SIZE = 8 * 1024 * 1024  # Compressed bytes per segment before rotating
+MAX_LOG_BYTES = 256 * 1024 * 1024  # Oldest segments are deleted above this
+CHUNK_BYTES = 64 * 1024  # A job's buffer is written once it holds this much ...
+CHUNK_SECONDS = 2.0  # ... or is this old
+ERROR_LINE = re.compile(r"\[(?:ERROR|CRITICAL)\b|Traceback|\w+Error\b")
+
+LOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, url TEXT, started REAL);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    job_key TEXT,
+    segment INTEGER,
+    offset INTEGER,
+    length INTEGER,
+    lines INTEGER,
+    errors INTEGER,
+    written REAL
+);
+CREATE INDEX IF NOT EXISTS chunks_job ON chunks (job_key);
+CREATE INDEX IF NOT EXISTS chunks_segment ON chunks (segment);
+"""
+
+
+def gzip_member(data):
+    # One complete gzip stream; concatenated members are still a valid .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class LogStore:
+    def __init__(self, log_dir, segment_size=SEGMENT_SIZE, max_bytes=MAX_LOG_BYTES):
+        self.log_dir = Path(log_dir)
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.log_dir / LOG_INDEX, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(LOG_SCHEMA)
+        self._buffers = {}  # Job key -> [lines, errors, first write time]
+
+        segments = self.segments()
+        self._segment = segments[-1] if segments else 1
+        self._file = open(self._segment_path(self._segment), "ab")
+
+    # --- Writing ---------------------------------------------------------------
+    def start_job(self, key, url):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?)", (key, url, time.time()))
+
+    def write(self, key, line, error=False):
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is None:
+                buf = self._buffers[key] = [[], 0, time.monotonic(), 0]
+            buf[0].append(line)
+            buf[1] += error
+            buf[3] += len(line) + 1
+            if buf[3] >= CHUNK_BYTES or time.monotonic() - buf[2] >= CHUNK_SECONDS:
+                self._flush(key)
+
+    def flush(self, key=None):
+        with self._lock:
+            for k in ([key] if key else list(self._buffers)):
+                if k in self._buffers:
+                    self._flush(k)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._file.close()
+            self._db.close()
+
+    def _flush(self, key):
+        lines, errors, _, _ = self._buffers.pop(key)
+        data = gzip_member(("\n".join(lines) + "\n").encode("utf-8", errors="replace"))
+        offset = self._file.tell()
+        self._file.write(data)
+        self._file.flush()
+        with self._db:
+            self._db.execute("INSERT INTO chunks (job_key, segment, offset, length, lines, errors, written) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, self._segment, offset, len(data), len(lines), errors, time.time()))
+        if offset + len(data) >= self.segment_size:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), "ab")
+        # Size cap: drop whole segments, oldest first, never the one being written
+        segments = self.segments()
+        total = sum(self._segment_path(s).stat().st_size for s in segments)
+        for segment in segments[:-1]:
+            if total <= self.max_bytes: break
+            path = self._segment_path(segment)
+            total -= path.stat().st_size
+            path.unlink()
+            self._db.execute("DELETE FROM chunks WHERE segment = ?", (segment,))
+        self._db.execute("DELETE FROM jobs WHERE key NOT IN (SELECT DISTINCT job_key FROM chunks)")
+        self._db.commit()
+
+    # --- Reading ---------------------------------------------------------------
+    def segments(self):
+        found = (SEGMENT_PATTERN.match(name) for name in os.listdir(self.log_dir))
+        return sorted(int(m.group(1)) for m in found if m)
+
+    def _segment_path(self, segment):
+        return self.log_dir / f"ams-{segment:06d}.log.gz"
+
+    def search(self, pattern, errors_only=False, regex=False, limit=None, cancelled=lambda: False):
+        # Yields (url, time, line) for matching lines, newest chunks first. Safe to run in any
+        # thread: it reads through its own connection and only ever holds one chunk in memory.
+        if regex:
+            match = re.compile(pattern, re.IGNORECASE).search
+        else:
+            needle = pattern.lower()
+            match = lambda text: needle in text.lower()
+        self.flush()
+
+        db = sqlite3.connect(self.log_dir / LOG_INDEX)
+        files = {}
+        found = 0
+        try:
+            rows = db.execute("SELECT c.segment, c.offset, c.length, j.url, c.written FROM chunks c "
+                              "LEFT JOIN jobs j ON j.key = c.job_key "
+                              f"{'WHERE c.errors > 0 ' if errors_only else ''}ORDER BY c.id DESC")
+            for segment, offset, length, url, written in rows:
+                if cancelled(): return
+                text = self._read_chunk(files, segment, offset, length)
+                if text is None or not match(text): continue  # Whole chunk first, lines only on a hit
+                for line in text.splitlines():
+                    if match(line) and (not errors_only or ERROR_LINE.search(line)):
+                        yield url, written, line
+                        found += 1
+                        if limit and found >= limit: return
+        finally:
+            for f in files.values(): f.close()
+            db.close()
+
+    def _read_chunk(self, files, segment, offset, length):
+        try:
+            if segment not in files:
+                files[segment] = open(self._segment_path(segment), "rb")
+            f = files[segment]
+            f.seek(offset)
+            return zlib.decompress(f.read(length), 31).decode("utf-8", errors="replace")
+        except (OSError, zlib.error):
+            return None  # Rotated away meanwhile, or torn by a crash
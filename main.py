@@ -1,25 +1,37 @@
-import os
-import sys
-import subprocess
+import shutil
+import concurrent.futures
+import itertools
 import threading
-import tkinter as tk
 import time
-import re
-import shutil
+import tkinter as tk
+from collections import deque
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 from pathlib import Path
 
+from engine import (DownloadEngine, EngineError, DownloadEvent, CODEC_MAP, TRANSCODE_MAP, TRANSCODE_SOURCE_CODEC,
+                    DOC_COOKIES_PATH, DEFAULT_MUSIC_FOLDER, EVENT_JOB, EVENT_LINE, EVENT_MESSAGE, JOB_QUEUED,
+                    JOB_RUNNING, JOB_PROCESSING, JOB_RETRYING, JOB_FAILED, app_dir, find_cookies, format_eta)
+from api import ApiServer, API_HOST, check_target
+from metrics import MetricsRecorder
+from watchlist import WatchList, WatchScheduler, WATCHLIST_FILE
+
 # =================================================================================
 # CONSTANTS & CONFIGURATION
 # =================================================================================
 
-WINDOW_SIZE = "720x680"
+WINDOW_SIZE = "720x720"
 MIN_SIZE = (680, 600)
 FONT_UI = ("Segoe UI", 10)
 FONT_BOLD = ("Segoe UI", 10, "bold")
 FONT_TITLE = ("Segoe UI", 20, "bold")
 FONT_LOG = ("Consolas", 9)
 
+LOG_MAX_LINES = 5000  # Older lines are trimmed from the log panel
+LOG_BUFFER_LINES = 20000  # Pending lines kept between two redraws
+LOG_FPS = 20  # Maximum log panel redraws per second
+SEARCH_MAX_RESULTS = 2000  # Matches shown per log search
+SEARCH_BATCH = 200  # Matches inserted into the results window per Tk tick
+
 THEMES = {
     "light": {
         "bg": "#F2F2F7",  # SystemGray6
@@ -55,43 +67,102 @@ THEMES = {
     }
 }
 
-GAMDL_CONFIG_TEMPLATE = """[gamdl]
-save_cover = true
-no_synced_lyrics = true
-log_level = INFO
-log_file = null
-no_exceptions = false
-language = en-US
-wvd_path = null
-overwrite = false
-save_playlist = false
-nm3u8dlre_path = N_m3u8DL-RE
-mp4decrypt_path = mp4decrypt
-ffmpeg_path = ffmpeg
-mp4box_path = MP4Box
-download_mode = ytdlp
-remux_mode = ffmpeg
-cover_format = jpg
-album_folder_template = {album_artist}/{album}
-compilation_folder_template = Compilations/{album}
-single_disc_file_template = {track:02d} {title}
-multi_disc_file_template = {disc}-{track:02d} {title}
-no_album_folder_template = {artist}/Unknown Album
-no_album_file_template = {title}
-playlist_file_template = Playlists/{playlist_artist}/{playlist_title}
-date_tag_template = %Y-%m-%dT%H:%M:%SZ
-exclude_tags = null
-cover_size = 1200
-truncate = null
-synced_lyrics_format = lrc
-synced_lyrics_only = false
-music_video_codec_priority = h264,h265
-music_video_remux_format = m4v
-music_video_resolution = 1080p
-uploaded_video_quality = best
-codec_song = {codec}
-cookies_path = {cookies}
-"""
+# =================================================================================
+# LOG RENDERING
+# =================================================================================
+
+class LogSink:
+    # Collects log lines from any thread in a ring buffer and renders them into a Text
+    # widget at a capped frame rate with a single insert per flush. Progress lines
+    # written with a key replace the previous progress line of that key in place.
+    def __init__(self, root, widget, max_lines=LOG_MAX_LINES, buffer_lines=LOG_BUFFER_LINES, fps=LOG_FPS):
+        self.root = root
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval = max(1, int(1000 / fps))
+
+        self._pending = deque(maxlen=buffer_lines)
+        self._dropped = 0
+        self._marks = {}  # key -> mark name of the line currently showing that key's progress
+        self._mark_ids = itertools.count()
+        self.root.after(self.interval, self._tick)
+
+    def write(self, msg, tag=None, key=None, progress=False):
+        if len(self._pending) == self._pending.maxlen:
+            self._dropped += 1
+        self._pending.append((msg, tag, key, progress))
+
+    def _tick(self):
+        try:
+            if self._pending or self._dropped:
+                self.flush()
+        finally:
+            self.root.after(self.interval, self._tick)
+
+    def flush(self):
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        dropped, self._dropped = self._dropped, 0
+
+        chunks = []  # [text, tags] pairs for one insert call
+        opened = {}  # key -> chunk index of a progress line opened in this batch
+        updates = {}  # mark -> (text, tags) for progress lines already on screen
+        if dropped:
+            chunks.append([f"... {dropped} lines skipped ...\n", "yellow"])
+
+        for msg, tag, key, progress in batch:
+            if progress and key in opened:
+                chunks[opened[key]] = [f"{msg}\n", tag]
+                continue
+            if progress and key in self._marks:
+                updates[self._marks[key]] = (msg, tag)
+                continue
+            if key is not None and not progress:
+                # Any regular line closes the key's progress line, the next one starts fresh
+                opened.pop(key, None)
+                self._marks.pop(key, None)
+            if progress:
+                opened[key] = len(chunks)
+            chunks.append([f"{msg}\n", tag])
+
+        w = self.widget
+        at_bottom = w.yview()[1] >= 0.999
+        w.config(state='normal')
+
+        live = set(self._marks.values())
+        for mark, (msg, tag) in updates.items():
+            if mark in live:
+                w.delete(mark, f"{mark} lineend")
+                w.insert(mark, msg, tag)
+
+        if chunks:
+            line = int(w.index("end-1c").split(".")[0])
+            line_of = {}
+            for i, (text, _) in enumerate(chunks):
+                line_of[i] = line
+                line += text.count("\n")
+            w.insert(tk.END, *[x if x is not None else () for chunk in chunks for x in chunk])
+
+            for key, i in opened.items():
+                mark = f"progress{next(self._mark_ids)}"
+                w.mark_set(mark, f"{line_of[i]}.0")
+                w.mark_gravity(mark, tk.LEFT)
+                self._marks[key] = mark
+
+        self._trim()
+        if at_bottom: w.see(tk.END)
+        w.config(state='disabled')
+
+    def _trim(self):
+        w = self.widget
+        excess = int(w.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess <= 0: return
+        for key, mark in list(self._marks.items()):
+            if int(w.index(mark).split(".")[0]) <= excess:
+                w.mark_unset(mark)
+                del self._marks[key]
+        w.delete("1.0", f"{excess + 1}.0")
 
 
 class GamdlApp:
@@ -113,13 +184,27 @@ class GamdlApp:
         self.ui_dividers = []
         self.ui_std_frames = []
 
-        self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-
         # Codec Mapping
-        self.codec_map = {
-            "m4a (AAC - Original)": "aac-legacy",
-            "mp3 (Converted)": "mp3"
-        }
+        self.codec_map = CODEC_MAP
+
+        # Download Engine
+        self.batch = []
+        self.started_jobs = set()
+        self.engine = DownloadEngine(self.base_dir)
+        self.engine.add_listener(self._on_engine_event)
+        self.metrics = MetricsRecorder(self.base_dir / "metrics")
+        self.engine.add_listener(self.metrics.on_event)
+        self.api = ApiServer(self.engine, submit=self._api_submit, metrics=self.metrics)
+
+        # Watched playlists/albums/artists, synced in the background
+        try:
+            self.watchlist = WatchList(self.base_dir / WATCHLIST_FILE)
+        except EngineError as e:
+            self.watchlist = None
+            self._watch_error = str(e)
+        if self.watchlist:
+            self.watch_scheduler = WatchScheduler(self.engine, self.watchlist, None, log=self._watch_log,
+                                                  on_jobs=lambda jobs: self.root.after(0, self.batch.extend, jobs))
 
         self._create_layout()
         self._apply_theme()
@@ -129,19 +214,39 @@ class GamdlApp:
         self.root.title("Apple Music Downloader")
         self.root.geometry(WINDOW_SIZE)
         self.root.minsize(*MIN_SIZE)
-
-    def _init_paths(self):
-        if getattr(sys, 'frozen', False):
-            self.base_dir = Path(sys.executable).parent
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _on_close(self):
+        # gamdl runs in process groups of its own and would outlive the window: the engine kills
+        # them, flushes logs, journal and metrics, and unfinished jobs resume on the next start
+        active = self.engine.queue.active_count()
+        if active and not messagebox.askyesno("Quit", f"{active} job(s) not finished yet. They are stopped now "
+                                                      f"and resumed on the next start.\n\nQuit anyway?"):
+            return
+        self.root.protocol("WM_DELETE_WINDOW", lambda: None)
+        self.status_var.set("Stopping downloads...")
+        self.api.stop()
+        if self.watchlist: self.watch_scheduler.stop()
+        # Engine events would wait for this thread, which waits for the engine
+        self.engine.listeners.remove(self._on_engine_event)
+        def close():
+            self.engine.close()
+            self.metrics.close()
+
+        closer = threading.Thread(target=close, daemon=True)
+        closer.start()
+        self._finish_close(closer)
+
+    def _finish_close(self, closer):
+        if closer.is_alive():
+            self.root.after(100, self._finish_close, closer)
         else:
-            self.base_dir = Path(__file__).parent.resolve()
-
-        self.temp_config_file = self.base_dir / "temp_config.ini"
-        self.doc_cookies_path = Path(os.path.expanduser("~")) / "Documents" / "Apple Music" / "cookies.txt"
-        self.local_cookies_path = self.base_dir / "cookies.txt"
-        self.default_music_folder = Path(os.path.expanduser("~")) / "Downloads" / "Apple Music Download"
+            self.root.destroy()
 
-        self.gamdl_exe = shutil.which("gamdl")
+    def _init_paths(self):
+        self.base_dir = app_dir()
+        self.doc_cookies_path = DOC_COOKIES_PATH
+        self.default_music_folder = DEFAULT_MUSIC_FOLDER
 
     # =========================================================================
     # UI CONSTRUCTION
@@ -159,6 +264,7 @@ class GamdlApp:
         self._create_url_card()
         self._create_settings_card()
         self._create_action_area()
+        self._create_job_list()
         self._create_log_area()
         self._create_status_bar()
         self._setup_bindings()
@@ -186,10 +292,22 @@ class GamdlApp:
         self.card_url.pack(fill=tk.X, pady=(0, 15))
         self.ui_std_frames.append(self.card_url)
 
-        lbl = tk.Label(self.card_url, text="Link to album or track:", font=FONT_BOLD, anchor="w")
-        lbl.pack(fill=tk.X, padx=15, pady=(12, 5))
+        head = tk.Frame(self.card_url, bd=0)
+        head.pack(fill=tk.X, padx=15, pady=(12, 5))
+        self.ui_card_bg.append(head)
+
+        lbl = tk.Label(head, text="Link to album or track:", font=FONT_BOLD, anchor="w")
+        lbl.pack(side=tk.LEFT)
         self.ui_card_bg.append(lbl)
 
+        # Watch list: the link is kept in sync with the folder instead of downloaded once
+        self.sync_btn = tk.Button(head, text="Sync watch list", font=FONT_UI, bd=0, cursor="hand2",
+                                  relief="flat", command=self.sync_watchlist)
+        self.sync_btn.pack(side=tk.RIGHT)
+        self.watch_btn = tk.Button(head, text="+ Watch", font=FONT_UI, bd=0, cursor="hand2", relief="flat",
+                                   command=self.watch_link)
+        self.watch_btn.pack(side=tk.RIGHT, padx=(0, 12))
+
         # Wrapper for input border/shadow effect
         self.url_wrapper = tk.Frame(self.card_url, bd=0)
         self.url_wrapper.pack(fill=tk.X, padx=15, pady=(0, 15))
@@ -213,19 +331,91 @@ class GamdlApp:
         self._add_divider(3)
         # 3. Cookies
         self._add_setting_row(4, "Cookies", btn_cmd=self.browse_cookies, is_cookie=True)
-
-    def _add_setting_row(self, row, label_text, btn_cmd=None, is_combo=False, is_folder=False, is_cookie=False):
+        self._add_divider(5)
+        # 4. Parallel downloads
+        self._add_setting_row(6, "Workers", is_workers=True)
+        self._add_divider(7)
+        # 5. Duplicate files, local API
+        self._add_setting_row(8, "Options", is_storage=True)
+        self._add_divider(9)
+        # 6. Fast local folder for gamdl's intermediates (empty: gamdl's default temp folder)
+        self._add_setting_row(10, "Staging", btn_cmd=self.browse_staging, is_staging=True)
+
+    def _add_setting_row(self, row, label_text, btn_cmd=None, is_combo=False, is_folder=False, is_cookie=False,
+                         is_workers=False, is_storage=False, is_staging=False):
         lbl = tk.Label(self.card_settings, text=label_text, font=FONT_BOLD, anchor="w", width=10)
         lbl.grid(row=row, column=0, sticky="w", padx=(15, 0), pady=12)
         self.ui_card_bg.append(lbl)
 
         if is_combo:
+            frame = tk.Frame(self.card_settings, bd=0)
+            frame.grid(row=row, column=1, columnspan=2, sticky="ew", padx=(0, 15), pady=12)
+            self.ui_card_bg.append(frame)
+
             self.codec_var = tk.StringVar()
-            self.codec_combo = ttk.Combobox(self.card_settings, textvariable=self.codec_var, state="readonly",
-                                            font=FONT_UI)
+            self.codec_combo = ttk.Combobox(frame, textvariable=self.codec_var, state="readonly", font=FONT_UI)
             self.codec_combo['values'] = list(self.codec_map.keys())
             self.codec_combo.current(0)
-            self.codec_combo.grid(row=row, column=1, columnspan=2, sticky="ew", padx=(0, 15), pady=12)
+            self.codec_combo.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            self.codec_combo.bind("<<ComboboxSelected>>", self._on_codec_changed)
+
+            # Extra formats: every track is downloaded once as AAC and converted to each ticked one
+            self.format_vars = {label: tk.BooleanVar(value=False) for label in TRANSCODE_MAP}
+            self.formats_btn = tk.Menubutton(frame, text="Also as...", font=FONT_UI, bd=0, relief="flat",
+                                             cursor="hand2")
+            self.formats_menu = tk.Menu(self.formats_btn, tearoff=0)
+            for label, var in self.format_vars.items():
+                self.formats_menu.add_checkbutton(label=label, variable=var, command=self._on_formats_changed)
+            self.formats_btn.config(menu=self.formats_menu)
+            self.formats_btn.pack(side=tk.LEFT, padx=(10, 0))
+
+            # Only used by the parallel transcode formats
+            self.keep_originals_var = tk.BooleanVar(value=True)
+            self.keep_originals_check = tk.Checkbutton(frame, text="Keep originals", font=FONT_UI,
+                                                       variable=self.keep_originals_var, bd=0,
+                                                       highlightthickness=0, cursor="hand2")
+            self.keep_originals_check.pack(side=tk.RIGHT, padx=(10, 0))
+        elif is_workers:
+            self.workers_var = tk.StringVar(value=str(self.engine.queue.max_workers))
+            self.workers_spin = tk.Spinbox(self.card_settings, from_=1, to=64, textvariable=self.workers_var,
+                                           font=FONT_UI, bd=0, relief="flat", width=6,
+                                           command=self._on_workers_changed)
+            self.workers_spin.grid(row=row, column=1, sticky="w", pady=12, ipady=2)
+            self.workers_spin.bind("<FocusOut>", lambda e: self._on_workers_changed())
+            self.workers_spin.bind("<Return>", lambda e: self._on_workers_changed())
+            self.ui_inputs.append(self.workers_spin)
+
+            self.persistent_var = tk.BooleanVar(value=self.engine.persistent)
+            self.persistent_check = tk.Checkbutton(self.card_settings, text="Keep gamdl loaded", font=FONT_UI,
+                                                   variable=self.persistent_var, bd=0, highlightthickness=0,
+                                                   cursor="hand2", command=self._on_persistent_changed)
+            self.persistent_check.grid(row=row, column=1, columnspan=2, sticky="e", padx=(0, 15), pady=12)
+        elif is_storage:
+            frame = tk.Frame(self.card_settings, bd=0)
+            frame.grid(row=row, column=1, columnspan=2, sticky="ew", padx=(0, 15), pady=12)
+            self.ui_card_bg.append(frame)
+
+            self.dedup_var = tk.BooleanVar(value=self.engine.dedup)
+            self.dedup_check = tk.Checkbutton(frame, text="Deduplicate files", font=FONT_UI,
+                                              variable=self.dedup_var, bd=0, highlightthickness=0,
+                                              cursor="hand2", command=self._on_dedup_changed)
+            self.dedup_check.pack(side=tk.LEFT)
+
+            # Probe and hash every new file; the button re-checks what changed in the whole folder
+            self.verify_var = tk.BooleanVar(value=self.engine.verify)
+            self.verify_check = tk.Checkbutton(frame, text="Verify", font=FONT_UI, variable=self.verify_var,
+                                               bd=0, highlightthickness=0, cursor="hand2",
+                                               command=self._on_verify_changed)
+            self.verify_check.pack(side=tk.LEFT, padx=(10, 0))
+            self.verify_btn = tk.Button(frame, text="Verify library", font=FONT_UI, bd=0, cursor="hand2",
+                                        relief="flat", command=self.verify_library)
+            self.verify_btn.pack(side=tk.LEFT, padx=(4, 0))
+
+            self.api_var = tk.BooleanVar(value=False)
+            self.api_check = tk.Checkbutton(frame, text=f"Local API (port {self.api.port})",
+                                            font=FONT_UI, variable=self.api_var, bd=0, highlightthickness=0,
+                                            cursor="hand2", command=self._on_api_changed)
+            self.api_check.pack(side=tk.RIGHT)
         else:
             entry = tk.Entry(self.card_settings, font=FONT_UI, bd=0, relief="flat")
             entry.grid(row=row, column=1, sticky="ew", pady=12, ipady=2)
@@ -233,6 +423,7 @@ class GamdlApp:
 
             if is_folder: self.folder_entry = entry
             if is_cookie: self.cookies_entry = entry
+            if is_staging: self.staging_entry = entry
 
             btn = tk.Button(self.card_settings, text="•••", bd=0, cursor="hand2", command=btn_cmd,
                             font=("Segoe UI", 8, "bold"))
@@ -240,6 +431,7 @@ class GamdlApp:
 
             if is_folder: self.btn_fld = btn
             if is_cookie: self.btn_cook = btn
+            if is_staging: self.btn_stage = btn
 
     def _add_divider(self, row):
         div = tk.Frame(self.card_settings, height=1)
@@ -251,21 +443,67 @@ class GamdlApp:
                                       cursor="hand2", command=self.start_download, relief="flat")
         self.download_btn.pack(fill=tk.X, pady=(0, 20), ipady=8)
 
+    def _create_job_list(self):
+        self.job_tree = ttk.Treeview(self.pad_frame, columns=("url", "state", "progress"), show="headings",
+                                     height=4)
+        self.job_tree.heading("url", text="Link", anchor="w")
+        self.job_tree.heading("state", text="Status", anchor="w")
+        self.job_tree.heading("progress", text="Progress", anchor="e")
+        self.job_tree.column("url", stretch=True, width=400)
+        self.job_tree.column("state", stretch=False, width=90)
+        self.job_tree.column("progress", stretch=False, width=110, anchor="e")
+        self.job_tree.pack(fill=tk.X, pady=(0, 15))
+        self.job_tree.bind("<Delete>", self.cancel_selected)  # Cancel the selected jobs
+        self.job_menu = tk.Menu(self.job_tree, tearoff=0)
+        self.job_menu.add_command(label="Cancel", command=self.cancel_selected)
+        self.job_menu.add_command(label="Cancel all", command=self.cancel_all)
+        self.job_tree.bind("<Button-3>", self._show_job_menu)
+
     def _create_log_area(self):
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(self.pad_frame, orient="horizontal", mode="determinate",
                                             variable=self.progress_var)
         self.progress_bar.pack(fill=tk.X)
 
+        # Search across the stored logs of past runs
+        search = tk.Frame(self.pad_frame)
+        search.pack(fill=tk.X, pady=(8, 8))
+        self.ui_main_bg.append(search)
+        lbl = tk.Label(search, text="Search logs", font=FONT_BOLD)
+        lbl.pack(side=tk.LEFT, padx=(0, 10))
+        self.ui_text.append(lbl)
+        self.search_entry = tk.Entry(search, font=FONT_UI, bd=0, relief="flat")
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=2)
+        self.search_entry.bind("<Return>", lambda e: self.search_logs())
+        self.ui_inputs.append(self.search_entry)
+        self.search_errors_var = tk.BooleanVar(value=False)
+        self.search_errors_check = tk.Checkbutton(search, text="Errors only", font=FONT_UI, bd=0,
+                                                  highlightthickness=0, variable=self.search_errors_var,
+                                                  cursor="hand2")
+        self.search_errors_check.pack(side=tk.LEFT, padx=(10, 0))
+        self.search_window = None
+        self._search_gen = 0
+
         self.log_area = scrolledtext.ScrolledText(self.pad_frame, state='disabled', height=10, font=FONT_LOG,
                                                   relief="flat", padx=10, pady=10, bd=0)
         self.log_area.pack(fill=tk.BOTH, expand=True)
 
     def _create_status_bar(self):
+        self.status_frame = tk.Frame(self.root)
+        self.status_frame.pack(fill=tk.X, side=tk.BOTTOM)
+        self.ui_main_bg.append(self.status_frame)
+
         self.status_var = tk.StringVar(value="Ready")
-        self.status_bar = tk.Label(self.root, textvariable=self.status_var, font=("Segoe UI", 8), anchor="w", padx=15,
-                                   pady=3)
-        self.status_bar.pack(fill=tk.X, side=tk.BOTTOM)
+        self.status_bar = tk.Label(self.status_frame, textvariable=self.status_var, font=("Segoe UI", 8), anchor="w",
+                                   padx=15, pady=3)
+        self.status_bar.pack(fill=tk.X, side=tk.LEFT, expand=True)
+
+        # Live stats (last minute)
+        self.stats_var = tk.StringVar()
+        self.stats_label = tk.Label(self.status_frame, textvariable=self.stats_var, font=("Segoe UI", 8), anchor="e",
+                                    padx=15, pady=3)
+        self.stats_label.pack(side=tk.RIGHT)
+        self.root.after(1000, self._update_stats)
 
     def _setup_bindings(self):
         # Placeholders logic
@@ -278,6 +516,7 @@ class GamdlApp:
         # Context Menus
         for w in self.ui_inputs: self._bind_context_menu(w, is_readonly=False)
         self._bind_context_menu(self.log_area, is_readonly=True)
+        self.log_sink = LogSink(self.root, self.log_area)
 
     # =========================================================================
     # THEME ENGINE
@@ -301,6 +540,10 @@ class GamdlApp:
                   selectbackground=[("readonly", c["card_bg"])], foreground=[("readonly", c["fg"])],
                   selectforeground=[("readonly", c["fg"])])
         style.configure("TCombobox", background=c["card_bg"], arrowcolor=c["fg"], borderwidth=0)
+        style.configure("Treeview", background=c["card_bg"], fieldbackground=c["card_bg"], foreground=c["fg"],
+                        borderwidth=0)
+        style.configure("Treeview.Heading", background=c["bg"], foreground=c["sub_fg"], borderwidth=0)
+        style.map("Treeview", background=[("selected", c["accent"])], foreground=[("selected", c["accent_fg"])])
 
         # Batch Updates
         for w in self.ui_main_bg: w.config(bg=c["bg"])
@@ -317,12 +560,36 @@ class GamdlApp:
         self.version_label.config(bg=c["bg"], fg=c["sub_fg"])
         self.theme_btn.config(fg=c["fg"], activebackground=c["bg"], activeforeground=c["accent"])
         self.status_bar.config(bg=c["bg"], fg=c["sub_fg"])
+        self.stats_label.config(bg=c["bg"], fg=c["sub_fg"])
         self.btn_fld.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"], activeforeground=c["accent"])
         self.btn_cook.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"], activeforeground=c["accent"])
+        self.btn_stage.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"], activeforeground=c["accent"])
+        for btn in (self.watch_btn, self.sync_btn):
+            btn.config(bg=c["card_bg"], fg=c["accent"], activebackground=c["card_bg"], activeforeground=c["fg"])
+        self.persistent_check.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"],
+                                     activeforeground=c["fg"], selectcolor=c["entry_bg"])
+        self.keep_originals_check.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"],
+                                         activeforeground=c["fg"], selectcolor=c["entry_bg"])
+        self.formats_btn.config(bg=c["card_bg"], fg=c["accent"], activebackground=c["card_bg"],
+                                activeforeground=c["fg"])
+        self.formats_menu.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["accent"],
+                                 activeforeground=c["accent_fg"], selectcolor=c["fg"])
+        self.dedup_check.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"],
+                                activeforeground=c["fg"], selectcolor=c["entry_bg"])
+        self.api_check.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"],
+                              activeforeground=c["fg"], selectcolor=c["entry_bg"])
+        self.verify_check.config(bg=c["card_bg"], fg=c["fg"], activebackground=c["card_bg"],
+                                 activeforeground=c["fg"], selectcolor=c["entry_bg"])
+        self.verify_btn.config(bg=c["card_bg"], fg=c["accent"], activebackground=c["card_bg"],
+                               activeforeground=c["fg"])
+        self.search_errors_check.config(bg=c["bg"], fg=c["fg"], activebackground=c["bg"],
+                                        activeforeground=c["fg"], selectcolor=c["entry_bg"])
 
         # Log
         self.log_area.config(bg=c["log_bg"], fg=c["log_fg"], selectbackground=c["accent"])
         self._update_log_tags(c)
+        if self.search_window and self.search_window.winfo_exists():
+            self.search_text.config(bg=c["log_bg"], fg=c["log_fg"], selectbackground=c["accent"])
 
         # Inputs & Placeholders
         self._update_input_colors()
@@ -405,8 +672,8 @@ class GamdlApp:
     # =========================================================================
     def _check_environment(self):
         self._log("--- SYSTEM CHECK ---")
-        if self.gamdl_exe:
-            self._log(f"[OK] Gamdl found: {self.gamdl_exe}", "green")
+        if self.engine.gamdl_cmd:
+            self._log(f"[OK] Gamdl found: {self.engine.gamdl_cmd[0]}", "green")
         else:
             self._log("[ERROR] Gamdl not found in PATH! Install it via pip.", "red")
 
@@ -414,22 +681,40 @@ class GamdlApp:
         self._check_tool("mp4decrypt")
 
         # Cookies Logic
-        if self.doc_cookies_path.exists():
+        cookies = find_cookies(self.base_dir)
+        if cookies:
             self._set_flag(False, False)
             self.cookies_entry.delete(0, tk.END)
-            self.cookies_entry.insert(0, str(self.doc_cookies_path))
-            self._log(f"[OK] Cookies found: {self.doc_cookies_path}", "green")
-        elif self.local_cookies_path.exists():
-            self._set_flag(False, False)
-            self.cookies_entry.delete(0, tk.END)
-            self.cookies_entry.insert(0, str(self.local_cookies_path))
-            self._log(f"[OK] Cookies found: {self.local_cookies_path}", "green")
+            self.cookies_entry.insert(0, str(cookies))
+            self._log(f"[OK] Cookies found: {cookies}", "green")
         else:
             self._set_placeholder(False)
             self._log("[WARNING] cookies.txt not found.", "yellow")
 
         self._update_input_colors()
-        if self.gamdl_exe: self._log("--------------------------\n")
+        if self.engine.gamdl_cmd:
+            self._log("--------------------------\n")
+            self._resume_jobs()
+            self._start_watchlist()
+
+    def _resume_jobs(self):
+        # Jobs the last session didn't finish (closed or crashed) are picked up where they stopped
+        jobs, errors = self.engine.resume()
+        for url, error in errors:
+            self._log(f"[WARNING] Could not resume {url}: {error}", "yellow")
+        if jobs:
+            self._log(f"[INFO] Resuming {len(jobs)} unfinished job(s) from the last session", "green")
+            self.batch.extend(jobs)
+
+    def _start_watchlist(self):
+        if not self.watchlist:
+            self._log(f"[WARNING] {self._watch_error}", "yellow")
+            return
+        if self.watchlist.entries:
+            self._log(f"[INFO] Watching {len(self.watchlist.entries)} link(s), synced every "
+                      f"{self.watchlist.interval / 3600:g} h", "green")
+        self.watch_scheduler.cookies = "" if self.is_cookie_placeholder else self.cookies_entry.get().strip()
+        self.watch_scheduler.start()
 
     def _check_tool(self, name):
         if shutil.which(name) or (self.base_dir / f"{name}.exe").exists():
@@ -453,114 +738,376 @@ class GamdlApp:
             self._set_flag(False, False)
             self._update_input_colors()
 
+    def browse_staging(self):
+        path = filedialog.askdirectory()
+        if path:
+            self.staging_entry.delete(0, tk.END)
+            self.staging_entry.insert(0, path)
+
     def get_target_folder(self):
         if self.is_folder_placeholder: return self.default_music_folder
         return Path(self.folder_entry.get().strip())
 
+    def _selected_format(self):
+        selected_codec = self.codec_combo.get()
+        # Use codec_map to get internal value, fallback to mp3 if not found
+        codec = self.codec_map.get(selected_codec, "mp3")
+        transcode = [TRANSCODE_MAP[label] for label, var in self.format_vars.items() if var.get()]
+        return codec, transcode
+
+    # Extra formats are converted from the m4a download, so they only go with that codec.
+    # Whichever of the two the user changed last wins, and the other one visibly follows.
+    def _on_formats_changed(self):
+        labels = [label for label, var in self.format_vars.items() if var.get()]
+        self.formats_btn.config(text="+ " + ", ".join(labels) if labels else "Also as...")
+        if labels and self.codec_map.get(self.codec_combo.get()) != TRANSCODE_SOURCE_CODEC:
+            source = next(label for label, codec in self.codec_map.items() if codec == TRANSCODE_SOURCE_CODEC)
+            self.codec_combo.set(source)
+            self._format_notice(f"Codec set to {source}: extra formats are converted from the m4a files")
+
+    def _on_codec_changed(self, event=None):
+        labels = [label for label, var in self.format_vars.items() if var.get()]
+        if labels and self.codec_map.get(self.codec_combo.get()) != TRANSCODE_SOURCE_CODEC:
+            for var in self.format_vars.values():
+                var.set(False)
+            self.formats_btn.config(text="Also as...")
+            self._format_notice(f"Extra formats cleared ({', '.join(labels)}): they need the m4a codec")
+
+    def _format_notice(self, text):
+        self.status_var.set(text)
+        self._log(f"[INFO] {text}", "yellow")
+
     def start_download(self):
         url = self.url_entry.get().strip()
-        if not url or not self.gamdl_exe:
+        if not url or not self.engine.gamdl_cmd:
             if not url: messagebox.showinfo("Info", "Enter a link")
             return
 
-        target = self.get_target_folder()
-        if not target.exists():
+        # Preflight: an expired login would only show once gamdl has failed
+        cookies_val = "" if self.is_cookie_placeholder else self.cookies_entry.get().strip()
+        try:
+            problems = [text for level, text in self.engine.check_cookies(cookies_val) if level == "ERROR"]
+        except EngineError:
+            problems = []  # submit reports it
+        if problems and not messagebox.askyesno("Cookies", "\n".join(problems) + "\n\nDownload anyway?"):
+            return
+
+        jobs, errors = self._submit_links([url])
+        for _, error in errors:
+            self._log(f"[ERROR] {error}", "red")
+        if jobs: self.url_entry.delete(0, tk.END)
+
+    def _submit_links(self, urls, options=None):
+        # Shared by the URL field and the local API; options override the window's settings
+        options = options or {}
+        cookies_val = "" if self.is_cookie_placeholder else self.cookies_entry.get().strip()
+        codec, transcode = self._selected_format()
+        codec = options.get("codec", codec)
+        if "transcode" in options:
+            transcode = options["transcode"]
+            if transcode: codec = TRANSCODE_SOURCE_CODEC
+        target = options.get("target") or self.get_target_folder()
+        keep_original = options.get("keep_original", self.keep_originals_var.get())
+
+        staging = self.staging_entry.get().strip()
+        self.engine.staging_dir = Path(staging) if staging else None
+
+        if not self.engine.queue.active_count():
+            self.batch = []
+            self.progress_var.set(0)
+        jobs, errors = [], []
+        for url in urls:
             try:
-                target.mkdir(parents=True, exist_ok=True)
+                job = self.engine.submit(url, target, cookies_val, codec, transcode=transcode,
+                                         keep_original=keep_original)
+            except EngineError as e:
+                errors.append((url, str(e)))
+                continue
+            if job not in jobs: jobs.append(job)  # Duplicates come back as the queued job
+        self.batch.extend(j for j in jobs if j not in self.batch)
+        return jobs, errors
+
+    def _api_submit(self, urls, options):
+        # Called from the API's executor thread; the links are queued on the Tk thread
+        done = concurrent.futures.Future()
+
+        def run():
+            try:
+                if options.get("target"):
+                    options["target"] = check_target(options["target"], [self.get_target_folder()])
+                done.set_result(self._submit_links(urls, options))
             except Exception as e:
-                self._log(f"[ERROR] Folder creation error: {e}", "red")
-                return
+                done.set_exception(e)
 
-        cookies_val = self.cookies_entry.get().strip()
-        if self.is_cookie_placeholder or not os.path.exists(cookies_val):
-            self._log("[ERROR] Cookies file not found!", "red")
+        self.root.after(0, run)
+        jobs, errors = done.result(30)
+        if jobs: self._log(f"[API] {len(jobs)} link(s) queued", "green")
+        return jobs, errors
+
+    def _on_api_changed(self):
+        if self.api_var.get():
+            try:
+                port = self.api.start()
+            except OSError as e:
+                self.api_var.set(False)
+                self._log(f"[ERROR] Local API not started: {e}", "red")
+                return
+            self._log(f"[INFO] Local API listening on http://{API_HOST}:{port}, token in {self.api.token_path}",
+                      "green")
+        else:
+            self.api.stop()
+            self._log("[INFO] Local API stopped", "yellow")
+
+    def _show_job_menu(self, event):
+        row = self.job_tree.identify_row(event.y)
+        if row and row not in self.job_tree.selection():
+            self.job_tree.selection_set(row)
+        self.job_menu.tk_popup(event.x_root, event.y_root)
+
+    def cancel_all(self):
+        for job in list(self.engine.jobs):
+            if not job.finished: self.engine.cancel(job)
+
+    def cancel_selected(self, event=None):
+        ids = set(self.job_tree.selection())
+        for job in list(self.engine.jobs):
+            if str(job.id) in ids and not job.finished:
+                self.engine.cancel(job)
+
+    def watch_link(self):
+        url = self.url_entry.get().strip()
+        if not url:
+            messagebox.showinfo("Info", "Enter a playlist, album or artist link to watch")
+            return
+        if not self.watchlist: return
+        codec, transcode = self._selected_format()
+        try:
+            self.watchlist.add(url, self.get_target_folder(), codec, transcode)
+        except (EngineError, OSError) as e:
+            self._log(f"[ERROR] {e}", "red")
             return
+        self._log(f"[INFO] Watching {url} ({len(self.watchlist.entries)} link(s) in the watch list)", "green")
+        self.url_entry.delete(0, tk.END)
+        self.sync_watchlist()
 
-        cookie_path = Path(cookies_val).resolve().as_posix()
-        selected_codec = self.codec_combo.get()
-        # Use codec_map to get internal value, fallback to mp3 if not found
-        codec = self.codec_map.get(selected_codec, "mp3")
+    def sync_watchlist(self):
+        if not self.watchlist or not self.engine.gamdl_cmd: return
+        if not self.watchlist.entries:
+            messagebox.showinfo("Info", "The watch list is empty. Enter a link and press + Watch.")
+            return
+        if not self.engine.queue.active_count():
+            self.batch = []
+            self.progress_var.set(0)
+        # The scheduler runs in the engine thread, so it gets the cookies path and not the entry
+        self.watch_scheduler.cookies = "" if self.is_cookie_placeholder else self.cookies_entry.get().strip()
+        self.watch_scheduler.sync_now()
 
-        cfg_content = GAMDL_CONFIG_TEMPLATE.format(codec=codec, cookies=cookie_path)
-        with open(self.temp_config_file, "w", encoding="utf-8") as f:
-            f.write(cfg_content)
+    def _watch_log(self, text, level):
+        tag = {"ERROR": "red", "WARNING": "yellow", "INFO": "green"}.get(level)
+        self._log(f"[Watch] {text}", tag)
 
-        self.download_btn.config(state=tk.DISABLED)
-        self.progress_var.set(0)
-        self.status_var.set("Downloading...")
-        self.url_entry.delete(0, tk.END)
+    # =========================================================================
+    # LOG SEARCH
+    # =========================================================================
+    def search_logs(self):
+        # Matches stream in from a background thread and are inserted in small batches,
+        # so a search over thousands of stored runs never blocks the window
+        pattern = self.search_entry.get().strip()
+        if not pattern or not self.engine.logs: return
+        self._search_gen += 1
+        gen = self._search_gen
+        errors_only = self.search_errors_var.get()
+        results = deque()
+        done = threading.Event()
+
+        def run():
+            last_url = None
+            try:
+                for url, written, line in self.engine.logs.search(pattern, errors_only, limit=SEARCH_MAX_RESULTS,
+                                                                   cancelled=lambda: gen != self._search_gen):
+                    if url != last_url:
+                        stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(written))
+                        results.append((f"\n{stamp}  {url}", "header"))
+                        last_url = url
+                    results.append((line, None))
+            except Exception as e:
+                results.append((f"Search failed: {e}", "red"))
+            finally:
+                done.set()
 
-        threading.Thread(target=self._run_process, args=(url, target, cookie_path), daemon=True).start()
+        threading.Thread(target=run, daemon=True).start()
+        self._open_search_window(pattern)
+        self._drain_search(gen, results, done, 0)
 
-    def _run_process(self, url, target, cookies):
-        self.root.after(0, lambda: self._log("\n\n=========================================", "header"))
-        self.root.after(0, lambda: self._log(f" Starting: {url}", "header"))
-        self.root.after(0, lambda: self._log("=========================================\n"))
+    def _open_search_window(self, pattern):
+        c = THEMES[self.current_theme]
+        if not (self.search_window and self.search_window.winfo_exists()):
+            self.search_window = tk.Toplevel(self.root)
+            self.search_window.geometry("820x480")
+            self.search_text = scrolledtext.ScrolledText(self.search_window, state='disabled', font=FONT_LOG,
+                                                         relief="flat", padx=10, pady=10, bd=0)
+            self.search_text.pack(fill=tk.BOTH, expand=True)
+            self.search_status = tk.StringVar()
+            tk.Label(self.search_window, textvariable=self.search_status, anchor="w", font=FONT_UI).pack(fill=tk.X)
+            self._bind_context_menu(self.search_text, is_readonly=True)
+        self.search_window.title(f"Log search: {pattern}")
+        self.search_text.config(bg=c["log_bg"], fg=c["log_fg"], selectbackground=c["accent"])
+        self.search_text.tag_config("header", foreground=c["bg"], background=c["fg"])
+        self.search_text.tag_config("red", foreground="#FF453A")
+        self.search_text.config(state='normal')
+        self.search_text.delete("1.0", tk.END)
+        self.search_text.config(state='disabled')
+        self.search_status.set("Searching...")
+        self.search_window.lift()
+
+    def _drain_search(self, gen, results, done, count):
+        if gen != self._search_gen: return
+        if not self.search_window.winfo_exists():
+            self._search_gen += 1  # Window closed: stops the search thread
+            return
+        finished = done.is_set()
+        batch = []
+        while results and len(batch) < SEARCH_BATCH:
+            batch.append(results.popleft())
+        if batch:
+            self.search_text.config(state='normal')
+            for text, tag in batch:
+                self.search_text.insert(tk.END, text + "\n", tag)
+            self.search_text.config(state='disabled')
+            count += sum(1 for _, tag in batch if tag is None)
+
+        if finished and not results:
+            limit = " (limit reached)" if count >= SEARCH_MAX_RESULTS else ""
+            self.search_status.set(f"{count} matching lines{limit}")
+            return
+        self.search_status.set(f"Searching... {count} matching lines")
+        self.root.after(50, self._drain_search, gen, results, done, count)
 
-        cmd = [self.gamdl_exe, "--config-path", str(self.temp_config_file),
-               "--cookies-path", cookies, "--output-path", str(target), url]
+    def _on_workers_changed(self):
+        try:
+            count = max(1, int(self.workers_var.get()))
+        except ValueError:
+            count = self.engine.concurrency.ceiling
+        self.workers_var.set(str(count))
+        self.engine.set_workers(count)
+
+    def _update_stats(self):
+        tracks_per_min, bytes_per_sec, running = self.metrics.rates()
+        concurrency = self.engine.concurrency
+        throttled = f" · throttled to {concurrency.limit}/{concurrency.ceiling}" \
+            if concurrency.limit < concurrency.ceiling else ""
+        killed = f" · {self.engine.killed} killed, {self.engine.restarted} restarted" if self.engine.killed else ""
+        if running or tracks_per_min or bytes_per_sec:
+            self.stats_var.set(f"{tracks_per_min:.1f} tracks/min · {bytes_per_sec / 1e6:.2f} MB/s{throttled}{killed}")
+        else:
+            self.stats_var.set(killed.lstrip(" ·"))
+        self.root.after(1000, self._update_stats)
 
-        env = os.environ.copy()
-        env.update({"PYTHONUNBUFFERED": "1", "TERM": "dumb", "NO_COLOR": "1"})
+    def _on_persistent_changed(self):
+        self.engine.persistent = self.persistent_var.get()
 
-        si = subprocess.STARTUPINFO()
-        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    def _on_dedup_changed(self):
+        self.engine.dedup = self.dedup_var.get()
 
-        log_file = self.base_dir / "gamdl_output.log"
+    def _on_verify_changed(self):
+        self.engine.verify = self.verify_var.get()
 
-        try:
-            with open(log_file, "w", encoding="utf-8") as writer:
-                proc = subprocess.Popen(cmd, stdout=writer, stderr=writer, stdin=subprocess.DEVNULL,
-                                        cwd=self.base_dir, startupinfo=si, env=env)
-
-            with open(log_file, "r", encoding="utf-8", errors="replace") as reader:
-                while True:
-                    line = reader.readline()
-                    if not line:
-                        if proc.poll() is not None:
-                            for l in reader.readlines(): self._process_log(l.strip())
-                            break
-                        time.sleep(0.1)
-                    else:
-                        self._process_log(line.strip())
+    def verify_library(self):
+        folder = self.get_target_folder()
+        if not Path(folder).is_dir():
+            messagebox.showinfo("Info", "The download folder doesn't exist yet")
+            return
+        self.verify_btn.config(state="disabled")
+        self._log(f"[INFO] Verifying {folder} (only new or changed files are probed)...", "yellow")
 
-            if proc.returncode == 0:
-                self.root.after(0, lambda: [self.progress_var.set(100), self.status_var.set("Done"),
-                                            messagebox.showinfo("Success", "Download complete!")])
+        def run():
+            started = time.monotonic()
+            try:
+                report = self.engine.verifier.verify_library(folder)
+            except OSError as e:
+                self._log(f"[ERROR] Verification failed: {e}", "red")
             else:
-                self.root.after(0, lambda: [self.status_var.set("Error"), self._log(f"Code: {proc.returncode}", "red")])
-
-        except Exception as e:
-            self.root.after(0, lambda: self._log(f"Launch error: {e}", "red"))
-        finally:
-            self.root.after(0, lambda: self.download_btn.config(state=tk.NORMAL))
-
-    def _process_log(self, line):
-        if not line: return
-        clean = self.ansi_escape.sub('', line)
-
-        if "[download]" in clean:
-            if match := re.search(r'(\d+\.?\d*)%', clean):
-                try:
-                    self.root.after(0, lambda: self.progress_var.set(float(match.group(1))))
-                except:
-                    pass
-            if "100%" in clean or "Destination" in clean:
-                self.root.after(0, self._log, f"        {clean}", "cyan")
+                for path, error in report.bad:
+                    self._log(f"[ERROR] Damaged file: {path}: {error}", "red")
+                busy = f", {report.busy} still being written" if report.busy else ""
+                self._log(f"[INFO] Verified {report.checked} file(s), {report.unchanged} unchanged{busy}, "
+                          f"{len(report.bad)} damaged ({time.monotonic() - started:.1f}s)",
+                          "red" if report.bad else "green")
+            self.root.after(0, lambda: self.verify_btn.config(state="normal"))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_job_changed(self, job):
+        row = str(job.id)
+        eta = format_eta(job.album.eta) if job.state == JOB_RUNNING else ""
+        values = (job.label, job.state, f"{job.progress:.0f}%  {eta}".strip())
+        if self.job_tree.exists(row):
+            self.job_tree.item(row, values=values)
+        else:
+            # Shards are listed under the job they were split from
+            parent = str(job.parent.id) if job.parent and self.job_tree.exists(str(job.parent.id)) else ""
+            self.job_tree.insert(parent, tk.END, iid=row, values=values)
+            if parent: self.job_tree.item(parent, open=True)
+            self.job_tree.see(row)
+
+        if self.batch:
+            self.progress_var.set(sum(100 if j.finished else j.progress for j in self.batch) / len(self.batch))
+
+        # A split job counts as its shards
+        work = [s for j in self.batch for s in (j.shards or [j])]
+        running = sum(1 for j in work if j.state == JOB_RUNNING)
+        waiting = sum(1 for j in work if j.state in (JOB_QUEUED, JOB_RETRYING))
+        processing = sum(1 for j in work if j.state == JOB_PROCESSING)
+        if running or waiting or processing:
+            etas = [j.album.eta for j in work if j.state == JOB_RUNNING and j.album.eta is not None]
+            eta = f" · ETA {format_eta(max(etas))}" if etas and not waiting else ""
+            converting = f", {processing} converting" if processing else ""
+            self.status_var.set(f"Downloading... {running} running{converting}, {waiting} queued{eta}")
+        elif job.finished and job in self.batch:
+            failed = sum(1 for j in self.batch if j.state == JOB_FAILED)
+            if failed:
+                self.status_var.set(f"Done with errors ({failed} of {len(self.batch)} failed)")
+            else:
+                self.status_var.set("Done")
+                messagebox.showinfo("Success", "Download complete!")
+            self.batch = []
+
+    def _on_engine_event(self, event, job, data):
+        # Called from engine threads: state changes are marshalled to Tk, output goes to the log sink
+        if event == EVENT_JOB:
+            if job.state == JOB_RUNNING and job.id not in self.started_jobs:
+                self.started_jobs.add(job.id)
+                self._log("\n\n=========================================", "header", key=job.id)
+                self._log(f" Starting [{job.id}]: {job.label}", "header", key=job.id)
+                self._log("=========================================\n", key=job.id)
+            self.root.after(0, self._on_job_changed, job)
+        elif event == EVENT_LINE:
+            self._log_output(job, data)
+        elif event == EVENT_MESSAGE:
+            text, level = data
+            tag = {"ERROR": "red", "WARNING": "yellow", "INFO": "green"}.get(level)
+            self._log(f"[{job.id}] {text}", tag, key=job.id)
+
+    def _log_output(self, job, parsed):
+        clean = parsed.text
+
+        if parsed.kind == "download":
+            if parsed.events and type(parsed.events[0]) is DownloadEvent:
+                self._log(f"[{job.id}]     {clean}", "cyan", key=job.id, progress=True)
+            elif "Destination" in clean:
+                self._log(f"[{job.id}]     {clean}", "cyan", key=job.id)
             return
 
-        tag = "green" if any(x in clean for x in ["INFO", "Downloading", "Finished", "Processing"]) else \
-            "yellow" if "WARNING" in clean else \
-                "red" if "ERROR" in clean or "Traceback" in clean else None
+        tag = "red" if parsed.level == "ERROR" else \
+            "yellow" if parsed.level == "WARNING" else \
+                "green" if parsed.level == "INFO" or parsed.kind else None
 
-        prefix = "\n" if "Processing" in clean or "Finished" in clean else "    " if "Downloading" in clean else ""
-        self.root.after(0, self._log, f"{prefix}{clean}", tag)
+        prefix = "\n" if parsed.kind == "heading" else "    " if parsed.kind == "step" else ""
+        self._log(f"{prefix}[{job.id}] {clean}", tag, key=job.id)
 
-    def _log(self, msg, tag=None):
-        self.log_area.config(state='normal')
-        self.log_area.insert(tk.END, f"{msg}\n", tag)
-        self.log_area.see(tk.END)
-        self.log_area.config(state='disabled')
+    def _log(self, msg, tag=None, key=None, progress=False):
+        # Safe to call from any thread, the sink renders on the Tk thread
+        self.log_sink.write(msg, tag, key, progress)
 
 
 if __name__ == "__main__":
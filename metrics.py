@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+
+from engine import (EVENT_JOB, EVENT_LINE, JOB_RUNNING, STAGE_DOWNLOAD, DownloadEvent, StageEvent,
+                    TrackEvent)
+
+# =================================================================================
+# JOB METRICS
+# =================================================================================
+# Stage timings are derived from the gamdl output: a stage lasts from the line that starts it
+# until the next stage, track or the end of the job. "startup" is the time from launch until
+# gamdl prints its first line (interpreter start, imports, auth).
+
+STAGE_STARTUP = "startup"
+STATS_WINDOW = 60  # Seconds covered by the live tracks/min and MB/s figures
+METRICS_FILE = "jobs.jsonl"
+PROMETHEUS_FILE = "ams.prom"
+
+
+class TrackMetrics:
+    def __init__(self, index, total, now):
+        self.index = index
+        self.total = total
+        self.started = now
+        self.finished = None
+        self.stages = {}
+        self.bytes = 0
+
+    def to_dict(self):
+        return {"index": self.index, "total": self.total, "bytes": self.bytes,
+                "seconds": round((self.finished or time.monotonic()) - self.started, 3),
+                "stages": {k: round(v, 3) for k, v in self.stages.items()}}
+
+
+class JobMetrics:
+    def __init__(self, job, now, on_progress):
+        self.job = job
+        self.on_progress = on_progress  # Called with (tracks, bytes) as they complete
+        self.started = now
+        self.started_at = time.time()
+        self.finished = None
+        self.stages = {}
+        self.tracks = []
+        self.bytes = 0
+        self._stage = STAGE_STARTUP
+        self._stage_started = now
+        self._track = None
+
+    def feed(self, events, now):
+        finished_download = False
+        size = None
+        for ev in events:
+            kind = type(ev)
+            if kind is DownloadEvent:
+                self._switch_stage(STAGE_DOWNLOAD, now)
+                if ev.percent >= 100:
+                    finished_download, size = True, ev.total
+            elif kind is TrackEvent:
+                if self._track is None or ev.index != self._track.index:
+                    self._switch_stage(None, now)
+                    self._close_track(now)
+                    self._track = TrackMetrics(ev.index, ev.total, now)
+            elif kind is StageEvent:
+                self._switch_stage(ev.stage, now)
+        if self._stage == STAGE_STARTUP:
+            self._switch_stage(None, now)
+        if finished_download and size:
+            self.bytes += size
+            if self._track: self._track.bytes += size
+            self.on_progress(0, size)
+
+    def finish(self, now):
+        self._switch_stage(None, now)
+        self._close_track(now)
+        self.finished = now
+
+    def _switch_stage(self, stage, now):
+        if stage == self._stage: return
+        if self._stage is not None:
+            elapsed = now - self._stage_started
+            self.stages[self._stage] = self.stages.get(self._stage, 0.0) + elapsed
+            if self._track and self._stage != STAGE_STARTUP:
+                self._track.stages[self._stage] = self._track.stages.get(self._stage, 0.0) + elapsed
+        self._stage, self._stage_started = stage, now
+
+    def _close_track(self, now):
+        if self._track and self._track.finished is None:
+            self._track.finished = now
+            self.tracks.append(self._track)
+            self.on_progress(1, 0)
+
+    def to_dict(self):
+        job = self.job
+        seconds = (self.finished or time.monotonic()) - self.started
+        return {"job": job.id, "url": job.url, "state": job.state, "returncode": job.returncode,
+                "retries": getattr(job, "retries", 0), "started": round(self.started_at, 3),
+                "seconds": round(seconds, 3), "bytes": self.bytes,
+                "throughput": round(self.bytes / seconds, 1) if seconds > 0 else 0.0,
+                "stages": {k: round(v, 3) for k, v in self.stages.items()},
+                "tracks": [t.to_dict() for t in self.tracks]}
+
+
+# =================================================================================
+# RECORDER
+# =================================================================================
+
+class MetricsRecorder:
+    # Engine listener: keeps live metrics for running jobs, appends one JSON line per finished
+    # job and rewrites a Prometheus textfile (for node_exporter's textfile collector). The files
+    # are written by a thread of their own, like the journal, so listeners on the engine loop
+    # never wait for the disk.
+    def __init__(self, metrics_dir):
+        self.metrics_dir = metrics_dir
+        self.jsonl_path = metrics_dir / METRICS_FILE
+        self.prom_path = metrics_dir / PROMETHEUS_FILE
+
+        self._lock = threading.Lock()
+        self._running = {}
+        self._recent = deque()  # (time, tracks, bytes) as they complete, for the live figures
+        self.totals = {"jobs": {}, "tracks": 0, "bytes": 0, "retries": 0, "stages": {}, "seconds": 0.0}
+        self._queue = queue.SimpleQueue()  # (JSON line, Prometheus text), then None when closing
+        self._writer = threading.Thread(target=self._write_loop, name="metrics", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        # Whatever was recorded before is written when this returns
+        if not self._writer.is_alive(): return
+        self._queue.put(None)
+        self._writer.join()
+
+    def on_event(self, event, job, data):
+        now = time.monotonic()
+        with self._lock:
+            if event == EVENT_JOB:
+                if job.state == JOB_RUNNING and job.id not in self._running:
+                    self._running[job.id] = JobMetrics(job, now, self._progress)
+                elif job.finished and job.id in self._running:
+                    metrics = self._running.pop(job.id)
+                    metrics.finish(now)
+                    self._record(metrics)
+            elif event == EVENT_LINE and data.events and job.id in self._running:
+                self._running[job.id].feed(data.events, now)
+
+    def rates(self):
+        # Tracks per minute and bytes per second over the last STATS_WINDOW seconds
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - STATS_WINDOW:
+                self._recent.popleft()
+            tracks = sum(r[1] for r in self._recent)
+            size = sum(r[2] for r in self._recent)
+            return tracks * 60 / STATS_WINDOW, size / STATS_WINDOW, len(self._running)
+
+    def _progress(self, tracks, size):
+        self._recent.append((time.monotonic(), tracks, size))
+
+    def _record(self, metrics):
+        record = metrics.to_dict()
+        totals = self.totals
+        totals["jobs"][record["state"]] = totals["jobs"].get(record["state"], 0) + 1
+        totals["tracks"] += len(record["tracks"])
+        totals["bytes"] += record["bytes"]
+        totals["retries"] += record["retries"]
+        totals["seconds"] += record["seconds"]
+        for stage, seconds in metrics.stages.items():
+            totals["stages"][stage] = totals["stages"].get(stage, 0.0) + seconds
+
+        self._queue.put((json.dumps(record) + "\n", self.prometheus_text()))
+
+    def prometheus_text(self):
+        totals = self.totals
+        lines = [
+            "# HELP ams_jobs_total Finished download jobs by final state.",
+            "# TYPE ams_jobs_total counter",
+            *[f'ams_jobs_total{{state="{state}"}} {count}' for state, count in sorted(totals["jobs"].items())],
+            "# HELP ams_tracks_total Tracks processed by finished jobs.",
+            "# TYPE ams_tracks_total counter",
+            f"ams_tracks_total {totals['tracks']}",
+            "# HELP ams_downloaded_bytes_total Bytes downloaded by finished jobs.",
+            "# TYPE ams_downloaded_bytes_total counter",
+            f"ams_downloaded_bytes_total {totals['bytes']}",
+            "# HELP ams_job_retries_total Retries of finished jobs.",
+            "# TYPE ams_job_retries_total counter",
+            f"ams_job_retries_total {totals['retries']}",
+            "# HELP ams_job_seconds_total Wall-clock time of finished jobs.",
+            "# TYPE ams_job_seconds_total counter",
+            f"ams_job_seconds_total {totals['seconds']:.3f}",
+            "# HELP ams_stage_seconds_total Time spent per processing stage.",
+            "# TYPE ams_stage_seconds_total counter",
+            *[f'ams_stage_seconds_total{{stage="{stage}"}} {seconds:.3f}'
+              for stage, seconds in sorted(totals["stages"].items())],
+            "# HELP ams_jobs_running Jobs currently running.",
+            "# TYPE ams_jobs_running gauge",
+            f"ams_jobs_running {len(self._running)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _write_loop(self):
+        # Jobs finished while the last batch was written go out together; only the newest
+        # Prometheus text of a batch is written
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get())
+            closing = None in batch
+            batch = [item for item in batch if item is not None]
+            if not batch: continue
+            try:
+                self.metrics_dir.mkdir(parents=True, exist_ok=True)
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.writelines(line for line, _ in batch)
+                self._write_prometheus(batch[-1][1])
+            except OSError:
+                pass
+
+    def _write_prometheus(self, text):
+        # Atomic replace so the collector never reads a half-written file
+        tmp = self.prom_path.with_suffix(".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.prom_path)
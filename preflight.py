@@ -0,0 +1,77 @@
+import os
+import time
+import threading
+from http.cookiejar import LoadError, MozillaCookieJar
+
+# =================================================================================
+# PREFLIGHT CHECKS
+# =================================================================================
+# An expired cookies.txt otherwise only shows once gamdl has started and failed. The
+# Netscape file is parsed once per version (path, mtime, size) and shared by the engine, the
+# catalog client and the GUI; its Apple Music auth cookies are checked before anything runs.
+
+AUTH_COOKIES = ("media-user-token",)  # gamdl can't download anything without these
+COOKIE_DOMAIN = "apple.com"
+EXPIRY_WARNING = 3 * 24 * 3600  # Warn this long before an auth cookie expires
+
+
+class CookieFileError(Exception):
+    pass
+
+
+class CookieFile:
+    def __init__(self, path, mtime, cookies):
+        self.path = path
+        self.mtime = mtime
+        self.cookies = cookies  # name -> http.cookiejar.Cookie, Apple domains only
+
+    def values(self):
+        return {name: c.value for name, c in self.cookies.items()}
+
+    def problems(self, now=None):
+        # [(level, text)]: ERROR when gamdl is bound to fail, WARNING when it soon will
+        now = time.time() if now is None else now
+        found = []
+        for name in AUTH_COOKIES:
+            cookie = self.cookies.get(name)
+            if cookie is None or not cookie.value:
+                found.append(("ERROR", f"Cookie {name} missing, export cookies.txt again while signed in "
+                                       f"to music.apple.com"))
+            elif cookie.expires and cookie.expires <= now:
+                day = time.strftime("%Y-%m-%d", time.localtime(cookie.expires))
+                found.append(("ERROR", f"Cookie {name} expired on {day}, export cookies.txt again"))
+            elif cookie.expires and cookie.expires - now < EXPIRY_WARNING:
+                hours = (cookie.expires - now) / 3600
+                found.append(("WARNING", f"Cookie {name} expires in {hours:.0f} h"))
+        return found
+
+
+_cache = {}  # Absolute path -> ((mtime_ns, size), CookieFile)
+_cache_lock = threading.Lock()
+
+
+def load_cookies(path):
+    # Parsed again only after the file changed. Raises CookieFileError.
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        raise CookieFileError(f"Cookies file not readable: {e}") from e
+    version = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+    jar = MozillaCookieJar(path)
+    try:
+        jar.load(ignore_discard=True, ignore_expires=True)
+    except LoadError as e:
+        raise CookieFileError(f"Cookies file is not in Netscape format: {e}") from e
+    except OSError as e:
+        raise CookieFileError(f"Cookies file not readable: {e}") from e
+    cookies = {c.name: c for c in jar if c.domain.lstrip(".").endswith(COOKIE_DOMAIN)}
+    result = CookieFile(path, st.st_mtime, cookies)
+    with _cache_lock:
+        _cache[path] = (version, result)
+    return result
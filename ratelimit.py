@@ -0,0 +1,108 @@
+import re
+import time
+import asyncio
+from collections import deque
+
+# =================================================================================
+# RATE LIMITING & ADAPTIVE CONCURRENCY
+# =================================================================================
+# Too many parallel gamdl runs get throttled by Apple (HTTP 429/503, dropped connections).
+# Two mechanisms keep the engine just below that point:
+#   TokenBucket        - one budget for all jobs: every gamdl launch (first run or retry) costs a
+#                        token, so a queue of short song links can't fire a burst of sessions.
+#   ConcurrencyControl - AIMD on the number of parallel jobs: halved when throttle/error lines
+#                        pile up, raised by one after a healthy round of finished tracks.
+
+RATE_LIMIT = 30.0  # gamdl launches per minute across all jobs (0 = unlimited)
+RATE_BURST = 8  # Launches allowed back to back after an idle period
+
+THROTTLE_LINE = re.compile(r"too many requests|\b429\b|\b503\b|rate.?limit|throttl|service unavailable|"
+                           r"connection (?:reset|aborted|refused)|timed? ?out", re.IGNORECASE)
+
+
+class TokenBucket:
+    # Only used from the engine loop. Waiters are served in arrival order.
+    def __init__(self, per_minute=RATE_LIMIT, burst=RATE_BURST):
+        self.rate = per_minute / 60
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def set_rate(self, per_minute):
+        self._refill()
+        self.rate = per_minute / 60
+
+    async def acquire(self):
+        if self.rate <= 0: return
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+
+class ConcurrencyControl:
+    # Tracks the parallel job limit between 1 and the user's setting (the ceiling).
+    # observe() and track_done() return the new limit when it changed, else None.
+    def __init__(self, ceiling, adaptive=True, error_window=30.0, error_threshold=3, cooldown=20.0,
+                 decrease=0.5):
+        self.ceiling = max(1, ceiling)
+        self.limit = self.ceiling
+        self.adaptive = adaptive
+        self.error_window = error_window
+        self.error_threshold = error_threshold  # Errors within the window that count as a spike
+        self.cooldown = cooldown  # No further change this soon after a decrease
+        self.decrease = decrease
+        self.throttled = 0  # Times the limit was cut, for the status bar and metrics
+
+        self._errors = deque()
+        self._healthy = 0
+        self._last_cut = float("-inf")
+
+    def set_ceiling(self, ceiling):
+        # Set by hand: taken as is until the next spike
+        self.ceiling = self.limit = max(1, ceiling)
+        self._healthy = 0
+        return self.limit
+
+    def observe(self, line, level):
+        # Throttle lines cut the limit at once; other errors only when several come close together
+        if not self.adaptive: return None
+        now = time.monotonic()
+        if THROTTLE_LINE.search(line):
+            return self._cut(now)
+        if level == "ERROR":
+            self._errors.append(now)
+            while self._errors and now - self._errors[0] > self.error_window:
+                self._errors.popleft()
+            if len(self._errors) >= self.error_threshold:
+                return self._cut(now)
+        return None
+
+    def track_done(self):
+        # One finished track per running slot is one healthy "round trip": grow by one
+        if not self.adaptive or self.limit >= self.ceiling: return None
+        self._healthy += 1
+        if self._healthy < self.limit or time.monotonic() - self._last_cut < self.cooldown:
+            return None
+        self._healthy = 0
+        self.limit += 1
+        return self.limit
+
+    def _cut(self, now):
+        self._healthy = 0
+        if now - self._last_cut < self.cooldown:
+            return None  # The jobs started before the last cut are still reporting the same spike
+        self._last_cut = now
+        self._errors.clear()
+        old, self.limit = self.limit, max(1, int(self.limit * self.decrease))
+        if self.limit == old: return None
+        self.throttled += 1
+        return self.limit
@@ -0,0 +1,115 @@
+import os
+import shutil
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from catalog import CatalogError
+from transcode import TRANSCODE_PROFILES
+
+# =================================================================================
+# STAGING & FREE SPACE
+# =================================================================================
+# gamdl writes every track three times into its temp folder (encrypted, decrypted, remuxed)
+# before it moves the result into the album folder. With a staging folder on fast local
+# storage those round trips stay off the (network) download folder. Before a job starts, its
+# size is estimated from the catalog's track durations and checked against the free space of
+# both places, minus what running jobs have already reserved.
+
+CODEC_KBPS = {"aac-legacy": 256, "aac-he-legacy": 64, "aac": 256, "aac-he": 64, "aac-binaural": 256,
+              "aac-downmix": 256, "alac": 1100, "atmos": 768, "ac3": 640}
+DEFAULT_KBPS = 320
+VIDEO_KBPS = 8000  # 1080p music videos
+TRACK_SECONDS = 240  # Unknown durations
+GUESS_TRACKS = {"song": 1, "music-video": 1, "album": 14, "playlist": 40}  # Without the catalog
+INTERMEDIATE_COPIES = 3  # Copies of the current track in the temp folder
+SPACE_MARGIN = 1.15
+MIN_FREE = 256 * 2 ** 20  # Never fill a disk to the last byte
+
+
+class InsufficientSpace(Exception):
+    pass
+
+
+class SizeEstimate:
+    def __init__(self, total, largest, tracks, source):
+        self.total = total  # Bytes the download folder needs
+        self.largest = largest  # Bytes of the largest single track
+        self.tracks = tracks
+        self.source = source  # "catalog" or "guess"
+
+
+def missing_tracks(parsed, catalog, library=None):
+    # (storefront, playable tracks of an album or playlist link that aren't on disk yet, number of playable tracks)
+    try:
+        storefront = parsed.storefront or catalog.storefront()
+        lookup = catalog.album if parsed.kind == "album" else catalog.playlist
+        tracks = [t for t in lookup(storefront, parsed.id)[1] if t.playable]
+    except (KeyError, IndexError) as e:
+        raise CatalogError(f"Unexpected catalog response: {e}")
+    # gamdl skips what is already on disk
+    have = library.paths_for(t.id for t in tracks) if library else {}
+    return storefront, [t for t in tracks if t.id not in have], len(tracks)
+
+
+def estimate_size(parsed, codec, transcode=(), catalog=None, library=None, tracks=None):
+    # None when nothing sensible can be said (artist pages, unknown link types). Catalog
+    # failures raise CatalogError; without a catalog the size is guessed from the link type.
+    # Shards pass the catalog tracks they download.
+    if parsed is None: return None
+    if tracks is None and catalog and parsed.kind in ("album", "playlist") and not parsed.track_id:
+        tracks = missing_tracks(parsed, catalog, library)[1]
+    if tracks is not None:
+        source, durations = "catalog", [t.duration or TRACK_SECONDS for t in tracks]
+    else:
+        kind = "song" if parsed.track_id else parsed.kind
+        if kind not in GUESS_TRACKS: return None
+        source, durations = "guess", [TRACK_SECONDS] * GUESS_TRACKS[kind]
+
+    kbps = VIDEO_KBPS if parsed.kind == "music-video" else CODEC_KBPS.get(codec, DEFAULT_KBPS)
+    kbps_out = kbps + sum(TRANSCODE_PROFILES[p].get("kbps", DEFAULT_KBPS) for p in transcode)
+    return SizeEstimate(int(sum(durations) * kbps_out * 125), int(max(durations, default=0) * kbps * 125),
+                        len(durations), source)
+
+
+def existing_parent(path):
+    path = Path(path).absolute()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path
+
+
+class SpaceBudget:
+    # Free space per filesystem minus what running jobs reserved. Thread-safe.
+    def __init__(self, margin=SPACE_MARGIN, min_free=MIN_FREE):
+        self.margin = margin
+        self.min_free = min_free
+        self._reserved = defaultdict(int)  # st_dev -> bytes
+        self._lock = threading.Lock()
+
+    def reserve(self, needs):
+        # needs: {path: bytes}. Returns a reservation for release(), or raises InsufficientSpace.
+        by_dev = {}
+        for path, size in needs.items():
+            path = existing_parent(path)
+            dev = os.stat(path).st_dev
+            known = by_dev.get(dev, (path, 0))
+            by_dev[dev] = (known[0], known[1] + int(size * self.margin))
+        with self._lock:
+            for dev, (path, size) in by_dev.items():
+                free = shutil.disk_usage(path).free - self._reserved[dev]
+                if free - size < self.min_free:
+                    raise InsufficientSpace(f"{format_size(size)} needed on {path}, "
+                                            f"{format_size(max(free, 0))} free")
+            for dev, (_, size) in by_dev.items():
+                self._reserved[dev] += size
+        return [(dev, size) for dev, (_, size) in by_dev.items()]
+
+    def release(self, reservation):
+        with self._lock:
+            for dev, size in reservation or ():
+                self._reserved[dev] -= size
+
+
+def format_size(size):
+    return f"{size / 2 ** 30:.1f} GB" if size >= 2 ** 30 else f"{size / 2 ** 20:.0f} MB"
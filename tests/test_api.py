@@ -0,0 +1,66 @@
+import json
+import socket
+
+import pytest
+
+import api
+from api import ApiServer
+from engine import DownloadEngine
+
+TOKEN = "secret-token"
+
+
+@pytest.fixture
+def server(tmp_path):
+    engine = DownloadEngine(base_dir=tmp_path / "app", journal=False)
+    server = ApiServer(engine, port=0, token=TOKEN, defaults={"target": str(tmp_path / "music")})
+    server.start()
+    yield server
+    server.stop()
+    engine.close()
+
+
+def send(server, raw):
+    # Raw bytes in, (status, decoded JSON body) out
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+        sock.sendall(raw)
+        data = b""
+        while chunk := sock.recv(65536):
+            data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def request(server, method="GET", path="/jobs", headers=None, body=b""):
+    fields = {"Host": f"127.0.0.1:{server.port}", "Authorization": f"Bearer {TOKEN}", **(headers or {})}
+    lines = [f"{method} {path} HTTP/1.1"] + [f"{k}: {v}" for k, v in fields.items() if v is not None]
+    return send(server, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+
+def test_token_is_required(server):
+    assert request(server, headers={"Authorization": None})[0] == 401
+    assert request(server, headers={"Authorization": "Bearer wrong"})[0] == 401
+    assert request(server, path=f"/jobs?token={TOKEN}", headers={"Authorization": None}) == (200, {"jobs": []})
+    assert request(server) == (200, {"jobs": []})
+
+
+def test_foreign_host_and_origin_are_refused(server):
+    status, body = request(server, headers={"Host": f"evil.example:{server.port}"})
+    assert status == 403 and "Host" in body["error"]
+    status, body = request(server, headers={"Origin": "http://evil.example"})
+    assert status == 403 and "Origin" in body["error"]
+    assert request(server, headers={"Origin": f"http://127.0.0.1:{server.port}"})[0] == 200
+
+
+@pytest.mark.parametrize("length, status", [("abc", 400), ("-5", 400), ("1e3", 400), (None, 400),
+                                            (str(api.API_MAX_BODY + 1), 413)])
+def test_bad_content_length_is_refused(server, length, status):
+    code, body = request(server, "POST", headers={"Content-Type": "application/json", "Content-Length": length},
+                         body=b'{"urls": []}')
+    assert code == status
+    assert "error" in body
+
+
+def test_slow_request_times_out(server, monkeypatch):
+    monkeypatch.setattr(api, "API_READ_TIMEOUT", 0.2)
+    assert send(server, b"GET /jobs HTTP/1.1\r\nHost: 127.0.0.1\r\n")[0] == 408
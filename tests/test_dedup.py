@@ -0,0 +1,113 @@
+import os
+import errno
+
+import dedup
+from dedup import DedupIndex
+
+TRACK = b"\x00\x00\x00\x20ftypM4A " + os.urandom(4096)
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def no_reflink(src, dst):
+    raise OSError(errno.EOPNOTSUPP, "reflinks not supported")
+
+
+def test_duplicate_is_linked_and_content_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "reflink", no_reflink)
+    album = write(tmp_path / "Artist" / "Album" / "01 Song.m4a", TRACK)
+    playlist = write(tmp_path / "Artist" / "Compilation" / "05 Song.m4a", TRACK)
+    other = write(tmp_path / "Artist" / "Album" / "02 Other.m4a", bytes(reversed(TRACK)))
+
+    index = DedupIndex(tmp_path)
+    report = index.run()
+    index.close()
+
+    assert report.linked == 1
+    assert report.reclaimed == len(TRACK)
+    assert os.path.samefile(album, playlist)
+    assert album.read_bytes() == playlist.read_bytes() == TRACK
+    assert not os.path.samefile(album, other)
+    assert other.read_bytes() == bytes(reversed(TRACK))
+
+
+def test_falls_back_to_hardlink_without_reflinks(tmp_path, monkeypatch):
+    calls = []
+
+    def failing_reflink(src, dst):
+        calls.append(dst)
+        no_reflink(src, dst)
+
+    monkeypatch.setattr(dedup, "reflink", failing_reflink)
+    first = write(tmp_path / "a" / "cover.jpg", TRACK)
+    second = write(tmp_path / "b" / "cover.jpg", TRACK)
+
+    index = DedupIndex(tmp_path)
+    report = index.run()
+    index.close()
+
+    assert calls  # Tried first
+    assert report.linked == 1
+    assert os.stat(first).st_nlink == 2
+    assert os.path.samefile(first, second)
+    assert not any(name.endswith(".dedup") for name in os.listdir(tmp_path / "b"))
+
+
+def test_failed_swap_leaves_the_file_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "reflink", no_reflink)
+    first = write(tmp_path / "a" / "01 Song.m4a", TRACK)
+    second = write(tmp_path / "b" / "01 Song.m4a", TRACK)
+
+    def failing_replace(src, dst):
+        raise OSError(errno.EIO, "swap failed")
+
+    monkeypatch.setattr(dedup.os, "replace", failing_replace)
+    index = DedupIndex(tmp_path)
+    report = index.run()
+    index.close()
+
+    assert report.linked == 0 and report.reclaimed == 0
+    assert second.read_bytes() == TRACK
+    assert not os.path.samefile(first, second)
+    assert os.listdir(tmp_path / "b") == ["01 Song.m4a"]
+
+
+def test_job_files_are_matched_without_a_walk(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "reflink", no_reflink)
+    old = write(tmp_path / "Album" / "01 Song.m4a", TRACK)
+    index = DedupIndex(tmp_path)
+    assert index.run().linked == 0
+
+    def no_walk(*args):
+        raise AssertionError("folder walked")
+
+    monkeypatch.setattr(dedup, "walk_files", no_walk)
+    new = write(tmp_path / "Playlist" / "01 Song.m4a", TRACK)
+    report = index.run([str(new)])
+    index.close()
+
+    assert report.scanned == 1
+    assert report.linked == 1
+    assert os.path.samefile(old, new)
+
+
+def test_changed_index_entries_are_not_linked(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "reflink", no_reflink)
+    old = write(tmp_path / "Album" / "01 Song.m4a", TRACK)
+    write(tmp_path / "Album" / "02 Other.m4a", bytes(reversed(TRACK)))  # Same size: both get hashed
+    index = DedupIndex(tmp_path)
+    index.run()
+    edited = TRACK[:-1] + b"!"
+    old.write_bytes(edited)  # Same size, other content, digest in the index is stale
+    os.utime(old, (1, 1))
+
+    new = write(tmp_path / "Playlist" / "01 Song.m4a", TRACK)
+    report = index.run([str(new)])
+    index.close()
+
+    assert report.linked == 0
+    assert old.read_bytes() == edited
@@ -0,0 +1,77 @@
+import json
+
+from journal import JobJournal
+
+
+def queue_job(journal, key, **fields):
+    journal.write(key, "queued", url=f"https://music.apple.com/us/album/x/{key}", target="/music",
+                  cookies="/cookies.txt", codec="aac-legacy", retries=0, **fields)
+
+
+def test_unfinished_jobs_are_replayed_with_their_tracks(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = JobJournal(path)
+    queue_job(journal, "a")
+    queue_job(journal, "b")
+    queue_job(journal, "c")
+    journal.write("a", "running", retries=0, returncode=None)
+    journal.write("a", "track", path="Artist/Album/01 One.m4a")
+    journal.write("a", "track", path="Artist/Album/02 Two.m4a")
+    journal.write("a", "retrying", retries=2, returncode=1)
+    journal.write("b", "running", retries=0, returncode=None)
+    journal.write("b", "track", path="Artist/Other/01 One.m4a")
+    journal.write("b", "done", retries=0, returncode=0)
+    journal.write("c", "cancelled", retries=0, returncode=None)
+    journal.close()
+
+    reopened = JobJournal(path)
+    jobs = reopened.unfinished()
+    assert jobs == [{"job": "a", "url": "https://music.apple.com/us/album/x/a", "target": "/music",
+                     "cookies": "/cookies.txt", "codec": "aac-legacy", "retries": 2,
+                     "tracks": ["Artist/Album/01 One.m4a", "Artist/Album/02 Two.m4a"]}]
+    assert reopened.unfinished() == []  # Handed out once
+    reopened.close()
+
+
+def test_requeued_job_keeps_the_tracks_of_earlier_runs(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = JobJournal(path)
+    queue_job(journal, "a")
+    journal.write("a", "track", path="01 One.m4a")
+    journal.close()
+
+    journal = JobJournal(path)
+    entry, = journal.unfinished()
+    queue_job(journal, "a", tracks=entry["tracks"])  # What resume() writes
+    journal.write("a", "track", path="02 Two.m4a")
+    journal.close()
+
+    entry, = JobJournal(path).unfinished()
+    assert entry["tracks"] == ["01 One.m4a", "02 Two.m4a"]
+
+
+def test_open_compacts_to_unfinished_jobs(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = JobJournal(path)
+    queue_job(journal, "a")
+    queue_job(journal, "b")
+    journal.write("a", "track", path="01 One.m4a")
+    journal.write("b", "failed", retries=3, returncode=1)
+    journal.close()
+
+    JobJournal(path).close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["job"], r["event"]) for r in records] == [("a", "queued"), ("a", "track")]
+
+
+def test_torn_lines_and_numbered_tracks_are_ignored(tmp_path):
+    # Older journals counted finished tracks by number; those can't be matched to files
+    path = tmp_path / "journal.jsonl"
+    lines = [{"t": 1, "job": "a", "event": "queued", "url": "u", "target": "/music", "tracks": [1, 2]},
+             {"t": 2, "job": "a", "event": "track", "index": 3},
+             {"t": 3, "job": "a", "event": "running", "retries": 1}]
+    path.write_text("".join(json.dumps(r) + "\n" for r in lines) + '{"t": 4, "job": "a", "ev')
+
+    journal = JobJournal(path)
+    assert journal.unfinished() == [{"job": "a", "url": "u", "target": "/music", "tracks": [], "retries": 1}]
+    journal.close()
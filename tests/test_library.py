@@ -0,0 +1,71 @@
+import shutil
+import struct
+from pathlib import Path
+
+import library
+from library import LibraryIndex, read_tags, read_mp4_tags
+
+FIXTURE = Path(__file__).with_name("fixtures") / "tagged.m4a"  # gamdl-style iTunes atoms, no audio
+FIXTURE_TAGS = {"codec": "mp4a", "catalog_id": "1440857794", "album_id": "1440857781",
+                "track_no": 3, "track_total": 17, "disc_no": 1, "disc_total": 2}
+
+
+def copy_fixture(folder, name="03 Song.m4a"):
+    folder.mkdir(parents=True, exist_ok=True)
+    return Path(shutil.copy(FIXTURE, folder / name))
+
+
+def test_reads_gamdl_atoms():
+    assert read_mp4_tags(FIXTURE) == FIXTURE_TAGS
+
+
+def test_large_box_header(tmp_path):
+    # A 64-bit size box (size field 1) in front of moov is skipped correctly
+    data = FIXTURE.read_bytes()
+    free = struct.pack(">I4sQ", 1, b"free", 24) + b"\0" * 8
+    path = tmp_path / "large.m4a"
+    ftyp = struct.unpack(">I", data[:4])[0]
+    path.write_bytes(data[:ftyp] + free + data[ftyp:])
+    assert read_mp4_tags(path) == FIXTURE_TAGS
+
+
+def test_truncated_and_foreign_files(tmp_path):
+    truncated = tmp_path / "truncated.m4a"
+    truncated.write_bytes(FIXTURE.read_bytes()[:60])
+    assert "catalog_id" not in read_tags(truncated)
+    garbage = tmp_path / "garbage.m4a"
+    garbage.write_bytes(b"\xff" * 64)
+    assert read_tags(garbage) == {}
+    assert read_tags(tmp_path / "missing.m4a") == {}
+    assert read_tags(tmp_path / "song.mp3") == {"codec": "mp3"}
+
+
+def test_update_indexes_only_the_given_files(tmp_path, monkeypatch):
+    index = LibraryIndex(tmp_path)
+    index.scan()
+    path = copy_fixture(tmp_path / "Artist" / "Album")
+
+    def no_walk(*args):
+        raise AssertionError("folder walked")
+
+    monkeypatch.setattr(library, "walk_files", no_walk)
+    assert index.update([str(path), str(tmp_path / ".hidden.m4a"), str(tmp_path / "cover.jpg")]) == (1, 0)
+    assert index.has_track("1440857794")
+    assert index.paths_for(["1440857794"]) == {"1440857794": str(path)}
+
+    path.unlink()
+    assert index.update([str(path)]) == (0, 1)
+    assert not index.has_track("1440857794")
+    index.close()
+
+
+def test_scan_finds_new_and_removed_files(tmp_path):
+    index = LibraryIndex(tmp_path)
+    path = copy_fixture(tmp_path / "Artist" / "Album")
+    assert not index.scanned
+    assert index.scan() == (1, 0)
+    assert index.scanned and index.has_track(1440857794)
+    assert index.scan() == (0, 0)  # Unchanged files aren't read again
+    path.unlink()
+    assert index.scan() == (0, 1)
+    index.close()
@@ -0,0 +1,47 @@
+import json
+
+from engine import EVENT_JOB, EVENT_LINE, JOB_RUNNING, JOB_DONE, GamdlOutputParser
+from metrics import MetricsRecorder
+
+
+class FakeJob:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.url = f"https://music.apple.com/us/album/x/{job_id}"
+        self.state = JOB_RUNNING
+        self.returncode = None
+        self.retries = 0
+
+    @property
+    def finished(self):
+        return self.state == JOB_DONE
+
+
+def run_job(recorder, job, lines):
+    parser = GamdlOutputParser()
+    recorder.on_event(EVENT_JOB, job, None)
+    for line in lines:
+        recorder.on_event(EVENT_LINE, job, parser.parse(line))
+    job.state, job.returncode = JOB_DONE, 0
+    recorder.on_event(EVENT_JOB, job, None)
+
+
+def test_finished_jobs_are_written_by_the_writer_thread(tmp_path):
+    recorder = MetricsRecorder(tmp_path / "metrics")
+    for job_id in (1, 2):
+        run_job(recorder, FakeJob(job_id), [
+            "[INFO     12:00:00] (Track 1/2) Downloading \"A\"",
+            "[download] 100% of 1.00MiB at 2.00MiB/s ETA 00:00",
+            "[INFO     12:00:01] (Track 2/2) Downloading \"B\"",
+            "[download] 100% of 2.00MiB at 2.00MiB/s ETA 00:00",
+        ])
+    recorder.close()
+
+    records = [json.loads(line) for line in (tmp_path / "metrics" / "jobs.jsonl").read_text().splitlines()]
+    assert [r["job"] for r in records] == [1, 2]
+    assert records[0]["bytes"] == 3 * 1024 ** 2
+    assert len(records[0]["tracks"]) == 2
+    prom = (tmp_path / "metrics" / "ams.prom").read_text()
+    assert 'ams_jobs_total{state="Done"} 2' in prom
+    assert "ams_tracks_total 4" in prom
+    recorder.close()  # A second close is harmless
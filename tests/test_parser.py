@@ -0,0 +1,79 @@
+from engine import (LineSplitter, GamdlOutputParser, AlbumProgress, DownloadEvent, TrackEvent, StageEvent,
+                    STAGE_DOWNLOAD, STAGE_DECRYPT, STAGE_COVER)
+
+
+def test_line_splitter_splits_on_any_line_break():
+    splitter = LineSplitter()
+    assert splitter.feed(b"one\r\ntwo\rthree\nfo") == ["one", "two", "three"]
+    assert splitter.feed(b"ur\n\n") == ["four"]
+    assert splitter.flush() == []
+
+
+def test_line_splitter_keeps_split_characters_and_tail():
+    splitter = LineSplitter()
+    data = "Ünïcode ✓\n".encode()
+    assert splitter.feed(data[:2]) == []
+    assert splitter.feed(data[2:]) == ["Ünïcode ✓"]
+    assert splitter.feed(b"no newline") == []
+    assert splitter.flush() == ["no newline"]
+    assert splitter.flush() == []
+
+
+def test_download_line():
+    line = "[download]  45.3% of    7.89MiB at    1.23MiB/s ETA 01:05"
+    parsed = GamdlOutputParser().parse(line)
+    assert parsed.kind == "download" and parsed.level is None
+    event, = parsed.events
+    assert type(event) is DownloadEvent
+    assert event.percent == 45.3
+    assert event.total == int(7.89 * 1024 ** 2)
+    assert event.bytes_per_sec == 1.23 * 1024 ** 2
+    assert event.eta == 65
+
+
+def test_download_line_without_details():
+    event, = GamdlOutputParser().parse("[download] 100% of ~ 3.00MB").events
+    assert event.percent == 100.0
+    assert event.total == 3_000_000
+    assert event.bytes_per_sec is None and event.eta is None
+
+
+def test_download_line_without_percent_starts_the_download_stage():
+    parsed = GamdlOutputParser().parse("[download] Destination: /tmp/x.m4a")
+    assert parsed.kind == "download"
+    assert parsed.events == (StageEvent(STAGE_DOWNLOAD),)
+
+
+def test_log_line_with_track_and_step():
+    line = '\x1b[32m[INFO     12:00:02]\x1b[0m (Track 3/12 from URL 1/1) Decrypting "Title"'
+    parsed = GamdlOutputParser().parse(line)
+    assert parsed.text == '[INFO     12:00:02] (Track 3/12 from URL 1/1) Decrypting "Title"'
+    assert parsed.level == "INFO" and parsed.kind == "step"
+    assert parsed.events == [TrackEvent(3, 12), StageEvent(STAGE_DECRYPT)]
+
+
+def test_shard_links_count_as_tracks():
+    parsed = GamdlOutputParser().parse("[INFO     12:00:02] (Track 1/1 from URL 4/6) Downloading \"Title\"")
+    assert parsed.events[0] == TrackEvent(4, 6)
+
+
+def test_levels_headings_and_cover():
+    parser = GamdlOutputParser()
+    assert parser.parse("[CRITICAL 12:00:00] Could not sign in").level == "ERROR"
+    assert parser.parse("[DEBUG    12:00:00] noise").level is None
+    assert parser.parse("Traceback (most recent call last):").level == "ERROR"
+    assert parser.parse("[INFO     12:00:00] Finished with 0 error(s)").kind == "heading"
+    assert parser.parse("[INFO     12:00:00] Downloading cover").events == [StageEvent(STAGE_COVER)]
+    assert parser.parse("plain text").events == []
+
+
+def test_album_progress_folds_events():
+    parser, album = GamdlOutputParser(), AlbumProgress()
+    for line in ["[INFO] (Track 1/4) Downloading \"A\"", "[download]  50.0% of 1.00MiB at 1.00MiB/s ETA 00:02"]:
+        album.update(parser.parse(line).events)
+    assert album.index == 1 and album.total == 4
+    assert album.download_eta == 2
+    assert round(album.percent, 3) == round(0.5 * 0.85 / 4 * 100, 3)
+    album.update(parser.parse("[INFO] (Track 2/4) Downloading \"B\"").events)
+    assert album.download is None
+    assert album.percent == 25.0
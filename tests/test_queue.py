@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from engine import EventLoopThread, DownloadQueue, Job, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+
+
+@pytest.fixture
+def loop_thread():
+    thread = EventLoopThread()
+    yield thread
+    thread.stop()
+
+
+def make_job(n):
+    return Job(n, f"https://music.apple.com/us/album/x/{n}", "/music", "aac-legacy", None, None)
+
+
+def wait_finished(jobs, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not all(j.finished for j in jobs):
+        assert time.monotonic() < deadline, [j.state for j in jobs]
+        time.sleep(0.01)
+
+
+def test_jobs_run_on_at_most_the_set_number_of_workers(loop_thread):
+    running, peak = [0], [0]
+
+    async def runner(job):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.02)
+        running[0] -= 1
+        return 0 if job.id % 3 else 1
+
+    queue = DownloadQueue(loop_thread.loop, runner, workers=2)
+    jobs = [make_job(n) for n in range(1, 10)]
+    for job in jobs: queue.add(job)
+    wait_finished(jobs)
+    assert peak[0] == 2
+    assert [j.state for j in jobs] == [JOB_DONE, JOB_DONE, JOB_FAILED] * 3
+    assert queue.active_count() == 0
+
+
+def test_more_workers_take_effect_for_waiting_jobs(loop_thread):
+    running, peak = [0], [0]
+
+    async def runner(job):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+        return 0
+
+    queue = DownloadQueue(loop_thread.loop, runner, workers=1)
+    jobs = [make_job(n) for n in range(1, 9)]
+    for job in jobs: queue.add(job)
+    queue.set_workers(4)
+    wait_finished(jobs)
+    assert peak[0] == 4
+
+
+def test_failed_job_is_retried_while_retry_gives_a_delay(loop_thread):
+    attempts = []
+
+    async def runner(job):
+        attempts.append(job.id)
+        return 1 if len(attempts) < 3 else 0
+
+    queue = DownloadQueue(loop_thread.loop, runner, workers=1,
+                          retry=lambda job: 0.01 if job.retries < 5 else None)
+    job = make_job(1)
+    queue.add(job)
+    wait_finished([job])
+    assert job.state == JOB_DONE
+    assert job.retries == 2 and attempts == [1, 1, 1]
+
+
+def test_cancelled_waiting_job_never_runs(loop_thread):
+    started = []
+    release = asyncio.Event()
+
+    async def runner(job):
+        started.append(job.id)
+        await release.wait()
+        return 0
+
+    queue = DownloadQueue(loop_thread.loop, runner, workers=1)
+    first, second = make_job(1), make_job(2)
+    queue.add(first)
+    queue.add(second)
+    loop_thread.loop.call_soon_threadsafe(queue.cancel, second)
+    loop_thread.loop.call_soon_threadsafe(release.set)
+    wait_finished([first, second])
+    assert second.state == JOB_CANCELLED
+    assert first.state == JOB_DONE and started == [1]
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from ratelimit import TokenBucket, ConcurrencyControl
+
+
+async def timed(coro):
+    start = time.monotonic()
+    await coro
+    return time.monotonic() - start
+
+
+def test_token_bucket_allows_a_burst_then_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(per_minute=600, burst=3)  # A token every 0.1 s
+        assert [await timed(bucket.acquire()) < 0.05 for _ in range(3)] == [True] * 3
+        assert 0.05 < await timed(bucket.acquire()) < 0.5
+
+    asyncio.run(run())
+
+
+def test_token_bucket_refill_is_capped():
+    async def run():
+        bucket = TokenBucket(per_minute=600, burst=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        await asyncio.sleep(0.5)  # Five tokens' worth, but only two fit
+        assert [await timed(bucket.acquire()) < 0.05 for _ in range(2)] == [True] * 2
+        assert await timed(bucket.acquire()) > 0.05
+
+    asyncio.run(run())
+
+
+def test_token_bucket_rate_can_be_lifted():
+    async def run():
+        bucket = TokenBucket(per_minute=1, burst=1)
+        await bucket.acquire()
+        bucket.set_rate(0)
+        await asyncio.wait_for(bucket.acquire(), 0.1)
+
+    asyncio.run(run())
+
+
+def test_token_bucket_without_rate_never_waits():
+    async def run():
+        bucket = TokenBucket(per_minute=0, burst=1)
+        for _ in range(100):
+            await asyncio.wait_for(bucket.acquire(), 0.1)
+
+    asyncio.run(run())
+
+
+def test_throttle_line_halves_the_limit_once_per_cooldown():
+    control = ConcurrencyControl(8, cooldown=60)
+    assert control.observe("HTTP Error 429: Too Many Requests", "ERROR") == 4
+    assert control.observe("HTTP Error 429: Too Many Requests", "ERROR") is None  # Same spike
+    assert control.limit == 4
+    assert control.throttled == 1
+
+
+def test_errors_cut_only_when_they_pile_up():
+    control = ConcurrencyControl(4, error_threshold=3, cooldown=0)
+    assert control.observe("something broke", "ERROR") is None
+    assert control.observe("something broke", "ERROR") is None
+    assert control.observe("a warning", "WARNING") is None
+    assert control.observe("something broke", "ERROR") == 2
+
+
+def test_limit_never_drops_below_one():
+    control = ConcurrencyControl(1, cooldown=0)
+    assert control.observe("503 Service Unavailable", "ERROR") is None
+    assert control.limit == 1
+
+
+def test_healthy_round_raises_the_limit_up_to_the_ceiling():
+    control = ConcurrencyControl(4, cooldown=0)
+    control.observe("connection reset by peer", "ERROR")
+    assert control.limit == 2
+    assert control.track_done() is None
+    assert control.track_done() == 3  # A track per running slot
+    assert [control.track_done() for _ in range(3)] == [None, None, 4]
+    assert control.track_done() is None
+
+
+def test_fixed_limit_ignores_errors():
+    control = ConcurrencyControl(4, adaptive=False)
+    assert control.observe("429 Too Many Requests", "ERROR") is None
+    assert control.track_done() is None
+    assert control.limit == 4
+    assert control.set_ceiling(2) == 2
@@ -0,0 +1,44 @@
+from urls import parse_url, url_key, song_id
+
+
+def test_url_key_ignores_slug_query_and_trailing_slash():
+    key = ("album", "us", "1440857781")
+    assert url_key("https://music.apple.com/us/album/abbey-road/1440857781") == key
+    assert url_key("https://music.apple.com/us/album/other-slug/1440857781/") == key
+    assert url_key("https://music.apple.com/us/album/1440857781?l=en-GB") == key
+    assert url_key("  https://music.apple.com/us/album/abbey-road/1440857781  ") == key
+
+
+def test_url_key_album_link_with_track_is_the_song():
+    album = url_key("https://music.apple.com/us/album/abbey-road/1440857781?i=1440857794")
+    song = url_key("https://music.apple.com/us/song/come-together/1440857794")
+    assert album == song == ("song", "us", "1440857794")
+
+
+def test_url_key_keeps_storefront_and_kind_apart():
+    assert url_key("https://music.apple.com/us/album/x/1") != url_key("https://music.apple.com/gb/album/x/1")
+    assert url_key("https://music.apple.com/us/album/x/1") != url_key("https://music.apple.com/us/song/x/1")
+    assert url_key("https://music.apple.com/us/playlist/mix/pl.u-abc") == ("playlist", "us", "pl.u-abc")
+
+
+def test_url_key_ignores_case_of_host_and_storefront():
+    key = ("album", "us", "1440857781")
+    assert url_key("https://MUSIC.APPLE.COM/US/album/abbey-road/1440857781") == key
+    assert url_key("https://music.apple.com:443/us/Album/abbey-road/1440857781") == key
+    assert url_key("https://apple.com/us/album/abbey-road/1440857781") == key
+    assert url_key("https://music.apple.com/us/playlist/mix/pl.u-AbC") == ("playlist", "us", "pl.u-AbC")
+
+
+def test_url_key_rejects_other_links():
+    assert url_key("https://evilapple.com/us/album/x/1") is None
+    assert url_key("https://music.apple.com.example.org/us/album/x/1") is None
+    assert url_key("https://example.com/us/album/x/1") is None
+    assert url_key("https://music.apple.com/us/browse") is None
+    assert url_key("not a link") is None
+
+
+def test_song_id():
+    assert song_id(parse_url("https://music.apple.com/us/song/x/42")) == "42"
+    assert song_id(parse_url("https://music.apple.com/us/album/x/1?i=42")) == "42"
+    assert song_id(parse_url("https://music.apple.com/us/album/x/1")) is None
+    assert song_id(None) is None
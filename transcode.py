@@ -0,0 +1,100 @@
+import os
+import asyncio
+import shutil
+import subprocess
+from pathlib import Path
+
+# =================================================================================
+# TRANSCODE STAGE
+# =================================================================================
+# gamdl's own mp3 codec converts inside the download run, one track after the other. Here the
+# originals are downloaded as AAC and every finished track is handed to ffmpeg right away,
+# so encoding runs on all cores while the next tracks are still downloading. A track can be
+# fanned out to several profiles; each one is its own ffmpeg process.
+#
+# folder: where a profile's files go, relative to the download folder. {dir} is the original's
+# folder (relative too), so "MP3 V0/{dir}" mirrors the album layout; None writes next to it.
+# The layouts are fixed, neither the CLI nor the GUI changes them. "mp3" stays next to the
+# original because it replaces gamdl's own mp3 codec, which wrote there.
+# kbps: average bitrate, for the free space estimate before a job starts.
+
+TRANSCODE_PROFILES = {
+    # Tags are copied with -map_metadata, the cover (an attached picture stream) with -c:v copy
+    "mp3": {"kbps": 320, "label": "MP3 320k", "ext": ".mp3", "format": "mp3", "folder": None,
+            "args": ["-c:a", "libmp3lame", "-b:a", "320k", "-id3v2_version", "3"]},
+    "mp3-v0": {"kbps": 245, "label": "MP3 V0 (VBR)", "ext": ".mp3", "format": "mp3", "folder": "MP3 V0/{dir}",
+               "args": ["-c:a", "libmp3lame", "-q:a", "0", "-id3v2_version", "3"]},
+    "mp3-128": {"kbps": 128, "label": "MP3 128k", "ext": ".mp3", "format": "mp3", "folder": "MP3 128k/{dir}",
+                "args": ["-c:a", "libmp3lame", "-b:a", "128k", "-id3v2_version", "3"]},
+    "aac-128": {"kbps": 128, "label": "AAC 128k", "ext": ".m4a", "format": "ipod", "folder": "AAC 128k/{dir}",
+                "args": ["-c:a", "aac", "-b:a", "128k", "-disposition:v", "attached_pic"]},
+}
+TRANSCODE_SOURCES = {".m4a"}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+class Transcoder:
+    # At most one ffmpeg process per core. ffmpeg already runs out of process, so a semaphore
+    # over asyncio subprocesses gives a process pool without Python workers in between.
+    def __init__(self, ffmpeg=None, workers=None, spawn_kwargs=None):
+        self.ffmpeg = ffmpeg or shutil.which("ffmpeg")
+        self.workers = workers or os.cpu_count() or 1
+        self.spawn_kwargs = spawn_kwargs or {}
+        self.active = 0
+        self._slots = None
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    @staticmethod
+    def output_path(src, profile, root=None):
+        spec = TRANSCODE_PROFILES[profile]
+        src = Path(src)
+        if not spec["folder"] or root is None:
+            return src.with_suffix(spec["ext"])
+        relative = src.parent.relative_to(root).as_posix()
+        folder = spec["folder"].format(dir=relative if relative != "." else "")
+        return (Path(root) / folder / src.name).with_suffix(spec["ext"])
+
+    async def transcode(self, src, profile="mp3", keep_original=True, root=None):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)  # Bound to the loop of the first call
+        spec = TRANSCODE_PROFILES[profile]
+        src = Path(src)
+        dst = self.output_path(src, profile, root)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        # Hidden while being written, so library scans never pick up a partial file
+        tmp = dst.with_name(f".{dst.name}.part")
+
+        async with self._slots:
+            self.active += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    self.ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-i", str(src),
+                    "-map", "0:a:0", "-map", "0:v?", "-map_metadata", "0", "-c:v", "copy", *spec["args"],
+                    "-f", spec["format"], str(tmp),
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                    **self.spawn_kwargs)
+                try:
+                    _, err = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    await proc.wait()
+                    tmp.unlink(missing_ok=True)
+                    raise
+            finally:
+                self.active -= 1
+
+        if proc.returncode != 0:
+            tmp.unlink(missing_ok=True)
+            lines = err.decode("utf-8", errors="replace").strip().splitlines()
+            raise TranscodeError(lines[-1] if lines else f"ffmpeg exited with code {proc.returncode}")
+
+        os.replace(tmp, dst)
+        if not keep_original and dst != src:
+            src.unlink(missing_ok=True)
+        return dst
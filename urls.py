@@ -0,0 +1,57 @@
+import re
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+
+# kind: album, song, playlist, artist, music-video, ...; track_id: the ?i= song of an album link
+AppleMusicUrl = namedtuple("AppleMusicUrl", "kind storefront id track_id")
+
+URL_PATH = re.compile(r"""
+    ^/(?:(?P<storefront>[a-z]{2})/)?
+    (?P<kind>album|song|playlist|artist|music-video|post|station)/
+    (?:[^/]+/)?
+    (?P<id>[^/]+?)/?$
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def parse_url(url):
+    parts = urlsplit(url.strip())
+    host = parts.hostname or ""  # Lowercased, without port or credentials
+    if host != "apple.com" and not host.endswith(".apple.com"):
+        return None
+    m = URL_PATH.match(parts.path)
+    if not m:
+        return None
+    track_id = parse_qs(parts.query).get("i", [None])[0]
+    storefront = m.group("storefront")
+    return AppleMusicUrl(m.group("kind").lower(), storefront.lower() if storefront else None, m.group("id"), track_id)
+
+
+def song_id(parsed):
+    # Catalog ID of the single song a link points at, if it points at one
+    if parsed is None: return None
+    if parsed.kind == "song": return parsed.id
+    if parsed.kind == "album" and parsed.track_id: return parsed.track_id
+    return None
+
+
+def url_key(url):
+    # (kind, storefront, id) of what a link downloads, whatever its slug, query or trailing slash;
+    # an album link with ?i= is the song. None for anything that isn't an Apple Music link.
+    parsed = parse_url(url)
+    if parsed is None: return None
+    track = song_id(parsed)
+    return ("song", parsed.storefront, track) if track else (parsed.kind, parsed.storefront, parsed.id)
+
+
+def song_link(storefront, song):
+    return f"https://music.apple.com/{storefront}/song/{song}"
+
+
+def album_link(storefront, album):
+    return f"https://music.apple.com/{storefront}/album/{album}"
+
+
+def track_link(storefront, track):
+    # Link to one catalog track (CatalogTrack) of an album or playlist
+    kind = "song" if track.is_song else "music-video"
+    return f"https://music.apple.com/{storefront}/{kind}/{track.id}"
@@ -0,0 +1,227 @@
+import os
+import json
+import shutil
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dedup import file_digest
+from library import AUDIO_EXTENSIONS, SCAN_WORKERS, walk_files
+
+# =================================================================================
+# INTEGRITY VERIFICATION
+# =================================================================================
+# gamdl's return code only says it didn't crash. After each job every new file is probed
+# with ffprobe (it must parse, hold an audio/video stream with a known codec, a duration,
+# as many bytes as its sample table promises, and decode its first seconds cleanly) and
+# hashed. The results go into one manifest per album folder:
+#   <album>/.ams_manifest.json  {"digest": "blake2b-160", "files": {"01 Track.m4a": {...}}}
+# Checking the whole library later only probes files whose size or mtime changed since.
+
+MANIFEST_FILE = ".ams_manifest.json"
+DIGEST_NAME = "blake2b-160"  # dedup.file_digest
+VERIFY_CODECS = {"aac", "alac", "mp3", "eac3", "ac3", "flac", "opus", "h264", "hevc"}
+MIN_DURATION = 1.0  # Seconds; shorter files are previews or broken
+MIN_SIZE_SHARE = 0.95  # A file smaller than this share of its stream sizes is truncated
+DECODE_SECONDS = 10  # Decoded from the start, catches streams that didn't decrypt
+PROBE_TIMEOUT = 60
+SETTLE = 2.0  # Files touched more recently than this may still be written and are left for later
+
+
+class VerifyError(Exception):
+    pass
+
+
+class VerifyReport:
+    def __init__(self):
+        self.checked = 0  # Files probed and hashed by this run
+        self.unchanged = 0  # Skipped: same size and mtime as in the manifest
+        self.removed = 0  # Manifest entries whose file is gone
+        self.busy = 0  # Skipped: changed within the last SETTLE seconds
+        self.bad = []  # (path, reason), including unchanged files that were bad before
+
+    def to_dict(self):
+        return {"checked": self.checked, "unchanged": self.unchanged, "removed": self.removed, "busy": self.busy,
+                "bad": [{"path": p, "error": e} for p, e in self.bad]}
+
+
+def find_ffprobe(ffmpeg=None, base_dir=None):
+    # Ships next to ffmpeg in every build
+    if ffmpeg:
+        sibling = Path(ffmpeg).with_name("ffprobe" + Path(ffmpeg).suffix)
+        if sibling.exists():
+            return str(sibling)
+    found = shutil.which("ffprobe")
+    if found or not base_dir:
+        return found
+    bundled = Path(base_dir) / "ffprobe.exe"
+    return str(bundled) if bundled.exists() else None
+
+
+def probe(ffprobe, path, spawn_kwargs=None):
+    # (duration, codec) of a sane file, else VerifyError
+    cmd = [ffprobe, "-v", "error", "-read_intervals", f"%+{DECODE_SECONDS}", "-count_frames",
+           "-show_entries", "format=duration,size:stream=codec_type,codec_name,bit_rate,nb_read_frames",
+           "-of", "json", str(path)]
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, timeout=PROBE_TIMEOUT,
+                                **(spawn_kwargs or {}))
+    except subprocess.TimeoutExpired:
+        raise VerifyError("ffprobe timed out")
+    errors = result.stderr.decode("utf-8", errors="replace").strip().splitlines()
+    if result.returncode != 0:
+        raise VerifyError(errors[-1] if errors else f"ffprobe exited with code {result.returncode}")
+    try:
+        info = json.loads(result.stdout or b"{}")
+    except ValueError:
+        raise VerifyError("unreadable ffprobe output")
+
+    streams = [s for s in info.get("streams", []) if s.get("codec_type") in ("audio", "video")]
+    if not streams:
+        raise VerifyError("no audio or video stream")
+    main = next((s for s in streams if s["codec_type"] == "audio"), streams[0])
+    codec = main.get("codec_name", "")
+    if codec not in VERIFY_CODECS:
+        raise VerifyError(f"unexpected codec: {codec or 'none'}")
+    if not int(main.get("nb_read_frames") or 0):
+        raise VerifyError("no decodable frames")
+    if errors:
+        raise VerifyError(errors[-1])  # Decoder complaints: garbage where audio should be
+
+    fmt = info.get("format", {})
+    duration = float(fmt.get("duration") or 0)
+    if duration < MIN_DURATION:
+        raise VerifyError(f"duration only {duration:.1f}s")
+    expected = sum(int(s.get("bit_rate") or 0) for s in streams) * duration / 8
+    size = int(fmt.get("size") or 0)
+    if expected and size < expected * MIN_SIZE_SHARE:
+        raise VerifyError(f"truncated: {size} of ~{int(expected)} bytes")
+    return duration, codec
+
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_manifest(folder, files):
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not files:
+        if os.path.exists(path): os.unlink(path)
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"digest": DIGEST_NAME, "files": dict(sorted(files.items()))}, f, indent=1)
+    os.replace(tmp, path)
+
+
+class Verifier:
+    # Thread-safe. Probes and hashes run on a shared pool, so parallel jobs don't multiply it.
+    def __init__(self, ffprobe=None, workers=None, spawn_kwargs=None):
+        self.ffprobe = ffprobe
+        self.spawn_kwargs = spawn_kwargs or {}
+        self._pool = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self._locks = defaultdict(threading.Lock)  # One per album folder, for its manifest
+        self._locks_lock = threading.Lock()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def check_file(self, path):
+        st = os.stat(path)
+        entry = {"size": st.st_size, "mtime": st.st_mtime, "checked": round(time.time(), 3)}
+        try:
+            if self.ffprobe:
+                duration, entry["codec"] = probe(self.ffprobe, path, self.spawn_kwargs)
+                entry["duration"] = round(duration, 3)
+            entry["digest"] = file_digest(path)
+            entry["status"] = "ok"
+        except (VerifyError, OSError) as e:
+            entry.update(status="bad", error=str(e))
+        return entry
+
+    def verify_files(self, paths):
+        # The files a job wrote (downloads and conversions), complete by the time it asks
+        paths = [p for p in paths if os.path.splitext(p)[1].lower() in AUDIO_EXTENSIONS]
+        report = VerifyReport()
+        # Another job writing into the same folder may have checked some of them already
+        manifests = {folder: load_manifest(folder) for folder in {os.path.dirname(p) for p in paths}}
+        todo = []
+        for path in paths:
+            entry = manifests[os.path.dirname(path)].get(os.path.basename(path))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry and entry.get("status") == "ok" and (entry.get("size"), entry.get("mtime")) == \
+                    (st.st_size, st.st_mtime):
+                report.unchanged += 1
+            else:
+                todo.append(path)
+        self._check(todo, report)
+        return report
+
+    def verify_library(self, root):
+        # Incremental: only files that are new or changed since their manifest entry are probed
+        report = VerifyReport()
+        on_disk = defaultdict(dict)
+        now = time.time()
+        with ThreadPoolExecutor(SCAN_WORKERS) as pool:
+            for path, size, mtime in walk_files(root, pool, AUDIO_EXTENSIONS):
+                on_disk[os.path.dirname(path)][os.path.basename(path)] = (size, mtime)
+
+        todo, pruned = [], {}
+        for folder, files in on_disk.items():
+            manifest = load_manifest(folder)
+            gone = manifest.keys() - files.keys()
+            if gone:
+                report.removed += len(gone)
+                pruned[folder] = files.keys()
+            for name, (size, mtime) in files.items():
+                entry = manifest.get(name)
+                if now - mtime < SETTLE:
+                    report.busy += 1  # A running job may still be writing it
+                elif entry and (entry.get("size"), entry.get("mtime")) == (size, mtime):
+                    report.unchanged += 1
+                    if entry.get("status") != "ok":
+                        report.bad.append((os.path.join(folder, name), entry.get("error", "")))
+                else:
+                    todo.append(os.path.join(folder, name))
+        self._check(todo, report, pruned)
+        return report
+
+    def _check(self, paths, report, pruned=None):
+        entries = {}
+        for path, entry in zip(paths, self._pool.map(self._safe_check, paths)):
+            if entry is None: continue  # Gone since the scan
+            entries[path] = entry
+            report.checked += 1
+            if entry["status"] != "ok":
+                report.bad.append((path, entry["error"]))
+
+        by_folder = defaultdict(dict)
+        for path, entry in entries.items():
+            by_folder[os.path.dirname(path)][os.path.basename(path)] = entry
+        for folder in by_folder.keys() | (pruned or {}).keys():
+            with self._folder_lock(folder):
+                files = load_manifest(folder)
+                if pruned and folder in pruned:
+                    files = {k: v for k, v in files.items() if k in pruned[folder]}
+                files.update(by_folder.get(folder, {}))
+                save_manifest(folder, files)
+
+    def _safe_check(self, path):
+        try:
+            return self.check_file(path)
+        except OSError:
+            return None
+
+    def _folder_lock(self, folder):
+        with self._locks_lock:
+            return self._locks[folder]
@@ -0,0 +1,261 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+from catalog import CatalogClient, CatalogError
+from engine import EngineError
+from urls import parse_url, song_link, album_link
+
+# =================================================================================
+# WATCH LIST
+# =================================================================================
+# Playlists, albums and artists that are kept in sync with a download folder. Each sync
+# asks the catalog for the current track list (one or two API calls per playlist), diffs it
+# against the folder's library index and queues only what is missing: the song links of a
+# few new tracks, or the whole link when most of it is new. Each target folder is scanned
+# once per sync, before its entries are planned. Stored in watchlist.json in the app folder:
+#   {"interval": 86400, "entries": [{"url": "...", "target": "...", "codec": "aac-legacy", ...}]}
+
+WATCHLIST_FILE = "watchlist.json"
+SYNC_INTERVAL = 24 * 3600  # Seconds between two syncs of an entry
+SYNC_CHECK = 60  # Seconds between checks for due entries
+WHOLE_LINK_SHARE = 0.5  # More new tracks than this share of the list: one run of the whole link
+PLAYLIST_DIR = "Playlists"
+WATCH_KINDS = {"playlist", "album", "artist", "song"}
+
+
+class WatchEntry:
+    FIELDS = ("url", "target", "codec", "transcode", "playlist_file", "last_sync", "last_result")
+
+    def __init__(self, url, target, codec="aac-legacy", transcode=None, playlist_file=False, last_sync=0.0,
+                 last_result=""):
+        self.url = url
+        self.target = str(target)
+        self.codec = codec
+        self.transcode = transcode
+        self.playlist_file = playlist_file  # Write Playlists/<name>.m3u8 after each sync
+        self.last_sync = last_sync
+        self.last_result = last_result
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.FIELDS}
+
+
+class WatchList:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.interval = SYNC_INTERVAL
+        self.entries = []
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.interval = data.get("interval", SYNC_INTERVAL)
+            self.entries = [WatchEntry(**{k: v for k, v in e.items() if k in WatchEntry.FIELDS})
+                            for e in data.get("entries", [])]
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError) as e:
+            raise EngineError(f"Watch list unreadable ({self.path}): {e}")
+
+    def add(self, url, target, codec="aac-legacy", transcode=None, playlist_file=None):
+        parsed = parse_url(url)
+        if parsed is None or parsed.kind not in WATCH_KINDS:
+            raise EngineError("Only playlist, album, artist and song links can be watched")
+        if playlist_file is None:
+            playlist_file = parsed.kind == "playlist"
+        with self._lock:
+            self.entries = [e for e in self.entries if (e.url, e.target) != (url, str(target))]
+            entry = WatchEntry(url, target, codec, transcode, playlist_file)
+            self.entries.append(entry)
+        self.save()
+        return entry
+
+    def remove(self, url):
+        with self._lock:
+            before = len(self.entries)
+            self.entries = [e for e in self.entries if e.url != url]
+            removed = before - len(self.entries)
+        self.save()
+        return removed
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return [e for e in self.entries if now - e.last_sync >= self.interval]
+
+    def save(self):
+        with self._lock:
+            data = {"interval": self.interval, "entries": [e.to_dict() for e in self.entries]}
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+# =================================================================================
+# SYNC
+# =================================================================================
+
+class SyncPlan:
+    def __init__(self, name, links, new=0, tracks=None):
+        self.name = name
+        self.links = links  # Links to queue
+        self.new = new  # Tracks missing from the folder
+        self.tracks = tracks  # Catalog track list, for the playlist file
+
+
+def plan_sync(entry, catalog, library):
+    parsed = parse_url(entry.url)
+    if parsed is None:
+        raise EngineError(f"Not an Apple Music link: {entry.url}")
+
+    if parsed.kind == "song":
+        missing = not library.has_track(parsed.id)
+        return SyncPlan(parsed.id, [entry.url] if missing else [], int(missing))
+    if parsed.kind == "album" and library.album_complete(parsed.id):
+        return SyncPlan(parsed.id, [])  # Nothing to ask the catalog
+
+    storefront = parsed.storefront or catalog.storefront()
+    if parsed.kind == "artist":
+        name, albums = catalog.artist_albums(storefront, parsed.id)
+        missing = [a for a in albums if not library.album_complete(a)]
+        return SyncPlan(name, [album_link(storefront, a) for a in missing], len(missing))
+
+    if parsed.kind == "playlist":
+        name, tracks = catalog.playlist(storefront, parsed.id)
+    else:
+        name, tracks = catalog.album(storefront, parsed.id)
+    tracks = [t for t in tracks if t.is_song and t.playable]
+    have = library.paths_for(t.id for t in tracks)
+    new = [t for t in tracks if t.id not in have]
+    if not new:
+        links = []
+    elif len(new) > len(tracks) * WHOLE_LINK_SHARE:
+        links = [entry.url]
+    else:
+        links = [song_link(storefront, t.id) for t in new]
+    return SyncPlan(name, links, len(new), tracks)
+
+
+def write_playlist(entry, plan, library):
+    # Extended M3U with paths relative to the playlist, in catalog order, only tracks on disk
+    folder = Path(entry.target) / PLAYLIST_DIR
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / (re.sub(r'[\\/:*?"<>|]', "_", plan.name).strip(" .") + ".m3u8")
+    have = library.paths_for(t.id for t in plan.tracks)
+    lines = ["#EXTM3U", f"#PLAYLIST:{plan.name}"]
+    for track in plan.tracks:
+        if track.id in have:
+            lines.append(f"#EXTINF:{track.duration},{track.artist} - {track.title}")
+            lines.append(os.path.relpath(have[track.id], folder).replace(os.sep, "/"))
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+class WatchScheduler:
+    # Runs on the engine's event loop: checks for due entries every minute and syncs them one
+    # by one. The catalog calls and index scans run in the default executor.
+    def __init__(self, engine, watchlist, cookies, log=None, on_jobs=None):
+        self.engine = engine
+        self.watchlist = watchlist
+        self.cookies = cookies  # Cookies file for the catalog and the queued jobs
+        self.log = log or (lambda text, level: None)
+        self.on_jobs = on_jobs or (lambda jobs: None)
+        self._task = None
+        self._lock = None
+        self._playlists = set()  # Playlist files waiting for their jobs
+        self._missing_cookies = None  # Cookies path already reported missing by a scheduled sync
+
+    def start(self):
+        if self._task is None:
+            self._task = self.engine.loop_thread.submit(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def sync_now(self, entries=None):
+        return self.engine.loop_thread.submit(self._sync(entries or list(self.watchlist.entries)))
+
+    def wait_playlists(self, timeout=None):
+        # Blocks until the playlist files of the syncs so far are written (their jobs must finish first)
+        async def drain():
+            while self._playlists:
+                await asyncio.gather(*list(self._playlists), return_exceptions=True)
+
+        self.engine.loop_thread.submit(drain()).result(timeout)
+
+    async def _run(self):
+        while True:
+            due = self.watchlist.due()
+            if due:
+                await self._sync(due, scheduled=True)
+            await asyncio.sleep(SYNC_CHECK)
+
+    async def _sync(self, entries, scheduled=False):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            cookies = self.cookies or ""
+            if not cookies or not os.path.exists(cookies):
+                # Due entries stay due, but the scheduler only reports it once per cookies path
+                if scheduled and cookies == self._missing_cookies: return
+                self._missing_cookies = cookies
+                for entry in entries:
+                    entry.last_result = "failed: cookies file not found"
+                self.watchlist.save()
+                self.log("Watch list not synced: cookies file not found", "WARNING")
+                return
+            self._missing_cookies = None
+            catalog = CatalogClient(cookies, self.engine.base_dir)
+            # One incremental scan per target folder picks up whatever was downloaded since the last sync
+            for target in dict.fromkeys(entry.target for entry in entries):
+                try:
+                    await loop.run_in_executor(None, self.engine.library_for(target).scan)
+                except OSError as e:
+                    self.log(f"Library index for {target} not updated: {e}", "WARNING")
+            for entry in entries:
+                calls = catalog.calls
+                try:
+                    plan, jobs = await loop.run_in_executor(None, self._sync_entry, entry, catalog, cookies)
+                except (CatalogError, EngineError, OSError) as e:
+                    entry.last_result = f"failed: {e}"
+                    self.log(f"Sync failed for {entry.url}: {e}", "WARNING")
+                else:
+                    entry.last_result = f"{plan.new} new, {len(jobs)} queued"
+                    self.log(f"{plan.name}: {plan.new} new track(s), {len(jobs)} job(s) queued "
+                             f"({catalog.calls - calls} catalog call(s))", "INFO")
+                    self.on_jobs(jobs)
+                    if entry.playlist_file and plan.tracks is not None:
+                        task = asyncio.ensure_future(self._playlist_when_done(entry, plan, jobs))
+                        self._playlists.add(task)
+                        task.add_done_callback(self._playlists.discard)
+                entry.last_sync = time.time()
+                self.watchlist.save()
+
+    def _sync_entry(self, entry, catalog, cookies):
+        plan = plan_sync(entry, catalog, self.engine.library_for(entry.target))
+        # A link still queued from an earlier sync comes back as that job
+        jobs = [self.engine.submit(link, entry.target, cookies, entry.codec, transcode=entry.transcode)
+                for link in plan.links]
+        return plan, jobs
+
+    async def _playlist_when_done(self, entry, plan, jobs):
+        while not all(j.finished for j in jobs):
+            await asyncio.sleep(1)
+        library = self.engine.library_for(entry.target)
+        try:
+            if not self.engine.skip_existing:  # Otherwise the engine already indexed what the jobs wrote
+                await asyncio.get_running_loop().run_in_executor(None, library.scan)
+            path = await asyncio.get_running_loop().run_in_executor(None, write_playlist, entry, plan, library)
+        except OSError as e:
+            self.log(f"Playlist file for {plan.name} not written: {e}", "WARNING")
+            return
+        self.log(f"Playlist written: {path}", "INFO")